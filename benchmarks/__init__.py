@@ -0,0 +1,3 @@
+"""
+Бенчмарки Mattermost Summary Bot
+"""
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк экстрактивного ранжирования: время на 10 000 сообщений
+
+Запуск: python -m benchmarks.bench_extractive [--messages 10000] [--repeat 3]
+"""
+
+import argparse
+import random
+import time
+
+from extractive_ranker import rank_texts, select_ranked_messages
+
+WORDS = (
+    "деплой релиз сборка тест ошибка сервер база данных миграция ревью задача "
+    "дедлайн встреча клиент отчет метрика алерт инцидент откат фича баг "
+    "frontend backend api kubernetes postgres redis kafka pipeline merge branch"
+).split()
+
+
+def generate_messages(count: int, seed: int = 42):
+    """Синтетические сообщения канала: короткие реплики и длинные обсуждения"""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        length = rng.choice((3, 5, 8, 13, 21, 34))
+        text = " ".join(rng.choice(WORDS) for _ in range(length))
+        messages.append({'username': f"user{i % 50}", 'message': text, 'create_at': i * 1000})
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк экстрактивного ранжирования")
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--budget', type=int, default=6000)
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages)
+    texts = [msg['message'] for msg in messages]
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        scores = rank_texts(texts)
+        selected = select_ranked_messages(messages, scores, args.budget, top_k=150)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    per_10k = best * 10000 / max(args.messages, 1)
+    print(f"messages={args.messages} selected={len(selected)} best={best * 1000:.1f}ms "
+          f"per_10k={per_10k * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
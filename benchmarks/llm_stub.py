@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка OpenAI-совместимого LLM для нагрузочных тестов
+
+Реализует /v1/chat/completions (обычный и потоковый ответ) и /v1/models.
+Задержка, доля ошибок, скорость генерации токенов и текст ответа
+настраиваются, поэтому бота можно тестировать без реальной LLM и сети.
+
+Запуск:
+    python -m benchmarks.llm_stub --port 8001 --profile typical
+    python -m benchmarks.llm_stub --latency lognormal:0.8:0.4 --error-rate 0.02 --mode echo
+
+Затем укажите LLM_BASE_URL=http://localhost:8001/v1 и любой LLM_MODEL.
+
+Распределения задержки (секунды до первого токена):
+    fixed:0.5  uniform:0.2:1.5  normal:1.0:0.3  lognormal:<медиана>:<sigma>
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CANNED_RESPONSE = """## 📊 Сводка активности каналов
+
+**🔥 Самые активные обсуждения:**
+- Подготовка релиза и исправление ошибок сборки
+
+**👥 Активные участники:**
+- alice, bob, carol
+
+**📋 Ключевые темы и решения:**
+- Релиз переносится на пятницу после ревью
+
+**💡 Краткие выводы:**
+- Команда сосредоточена на стабилизации"""
+
+# Готовые профили: задержка до первого токена, доля ошибок, токенов в секунду
+PROFILES = {
+    'instant': {'latency': 'fixed:0', 'error_rate': 0.0, 'token_rate': 0.0},
+    'fast': {'latency': 'lognormal:0.3:0.3', 'error_rate': 0.0, 'token_rate': 300.0},
+    'typical': {'latency': 'lognormal:0.8:0.4', 'error_rate': 0.005, 'token_rate': 60.0},
+    'slow': {'latency': 'lognormal:3:0.6', 'error_rate': 0.01, 'token_rate': 20.0},
+    'flaky': {'latency': 'lognormal:1:0.8', 'error_rate': 0.1, 'token_rate': 40.0},
+}
+
+ERROR_STATUSES = (429, 500, 502, 503)
+
+
+def estimate_tokens(text: str) -> int:
+    """Та же грубая оценка, что и в боте (~4 символа на токен)"""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class LatencyDistribution:
+    """Распределение задержки в секундах, задается строкой вида 'lognormal:0.8:0.4'"""
+
+    KINDS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+    def __init__(self, spec: str, rng: Optional[random.Random] = None):
+        parts = spec.split(':')
+        self.kind = parts[0]
+        if self.kind not in self.KINDS:
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+        self.params = [float(value) for value in parts[1:]] or [0.0]
+        self.spec = spec
+        self.rng = rng or random.Random()
+
+    def sample(self) -> float:
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = self.rng.uniform(self.params[0], self.params[1])
+        elif self.kind == 'normal':
+            value = self.rng.gauss(self.params[0], self.params[1])
+        else:
+            median = self.params[0]
+            value = self.rng.lognormvariate(math.log(median), self.params[1]) if median > 0 else 0.0
+        return max(0.0, value)
+
+
+class StubProfile:
+    """Поведение заглушки"""
+
+    def __init__(self, latency: str = 'fixed:0', error_rate: float = 0.0, token_rate: float = 0.0,
+                 mode: str = 'canned', response: str = CANNED_RESPONSE, max_tokens: int = 512,
+                 models: Optional[List[str]] = None, seed: Optional[int] = None):
+        rng = random.Random(seed)
+        self.latency = LatencyDistribution(latency, rng)
+        self.error_rate = error_rate
+        self.token_rate = token_rate
+        self.mode = mode
+        self.response = response
+        self.max_tokens = max_tokens
+        self.models = models or ['stub-model']
+        self.rng = rng
+
+    @classmethod
+    def from_name(cls, name: str, **overrides) -> 'StubProfile':
+        settings = dict(PROFILES[name])
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**settings)
+
+    def completion_text(self, messages: List[Dict[str, Any]]) -> str:
+        if self.mode == 'echo':
+            user_messages = [msg for msg in messages if msg.get('role') == 'user']
+            text = _content_text(user_messages[-1].get('content')) if user_messages else ''
+            return text[:self.max_tokens * 4]
+        return self.response
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+def _chunks(text: str, size: int = 16) -> List[str]:
+    """Делит ответ на порции ~по 4 токена для потоковой отдачи"""
+    return [text[i:i + size] for i in range(0, len(text), size)] or ['']
+
+
+def create_app(profile: StubProfile) -> FastAPI:
+    """Создает приложение заглушки с заданным профилем"""
+    app = FastAPI(title="LLM stub")
+    app.state.stats = {'requests': 0, 'errors': 0, 'streams': 0, 'completion_tokens': 0}
+
+    @app.get("/v1/models")
+    async def models():
+        return {
+            "object": "list",
+            "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "stub"}
+                for model in profile.models
+            ],
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats = app.state.stats
+        stats['requests'] += 1
+
+        await asyncio.sleep(profile.latency.sample())
+
+        if profile.error_rate and profile.rng.random() < profile.error_rate:
+            stats['errors'] += 1
+            status = profile.rng.choice(ERROR_STATUSES)
+            return JSONResponse(
+                status_code=status,
+                content={"error": {"message": f"stub error {status}", "type": "stub_error", "code": status}},
+            )
+
+        messages = body.get('messages') or []
+        model = body.get('model') or profile.models[0]
+        text = profile.completion_text(messages)
+        prompt_tokens = sum(estimate_tokens(_content_text(msg.get('content'))) for msg in messages)
+        completion_tokens = estimate_tokens(text)
+        stats['completion_tokens'] += completion_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if body.get('stream'):
+            stats['streams'] += 1
+            return StreamingResponse(
+                _stream(profile, completion_id, created, model, text, usage),
+                media_type="text/event-stream",
+            )
+
+        if profile.token_rate:
+            await asyncio.sleep(completion_tokens / profile.token_rate)
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+
+    return app
+
+
+async def _stream(profile: StubProfile, completion_id: str, created: int, model: str,
+                  text: str, usage: Dict[str, int]):
+    """Server-sent events в формате OpenAI chat.completion.chunk"""
+    def event(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            **extra,
+        }
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    yield event({"role": "assistant", "content": ""})
+    for piece in _chunks(text):
+        if profile.token_rate:
+            await asyncio.sleep(estimate_tokens(piece) / profile.token_rate)
+        yield event({"content": piece})
+    yield event({}, finish_reason="stop", usage=usage)
+    yield "data: [DONE]\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-совместимая заглушка LLM")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='typical')
+    parser.add_argument('--latency', help="распределение задержки, например lognormal:0.8:0.4")
+    parser.add_argument('--error-rate', type=float, help="доля ответов с ошибкой (429/5xx)")
+    parser.add_argument('--token-rate', type=float, help="токенов в секунду (0 - без задержки генерации)")
+    parser.add_argument('--mode', choices=('canned', 'echo'), default='canned')
+    parser.add_argument('--response-file', help="файл с текстом ответа для режима canned")
+    parser.add_argument('--models', default='stub-model', help="модели для /v1/models через запятую")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    response = CANNED_RESPONSE
+    if args.response_file:
+        with open(args.response_file, encoding='utf-8') as f:
+            response = f.read()
+
+    profile = StubProfile.from_name(
+        args.profile,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        token_rate=args.token_rate,
+        mode=args.mode,
+        response=response,
+        models=[model.strip() for model in args.models.split(',') if model.strip()],
+        seed=args.seed,
+    )
+
+    import uvicorn
+    print(f"🧪 LLM-заглушка: http://{args.host}:{args.port}/v1 "
+          f"(задержка {profile.latency.spec}, ошибки {profile.error_rate:.1%}, "
+          f"{profile.token_rate or '∞'} ток/с, режим {profile.mode})")
+    uvicorn.run(create_app(profile), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
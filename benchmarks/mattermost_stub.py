@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Локальный симулятор Mattermost для сквозных бенчмарков бота
+
+Отдает REST-эндпоинты, которые использует MattermostBot (пользователи,
+каналы, посты, треды, настройки, личные каналы), и websocket, который
+шлет синтетические события posted/user_added/channel_member_added с
+заданной частотой. Данные берутся из сгенерированного рабочего
+пространства из N каналов и пользователей.
+
+Запуск:
+    python -m benchmarks.mattermost_stub --port 8065 --channels 50 --users 200 --event-rate 20
+
+Затем укажите MATTERMOST_URL=http://localhost:8065 и любой MATTERMOST_TOKEN.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import string
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+
+from benchmarks.bench_extractive import WORDS
+
+BOT_USERNAME = 'summary_bot'
+
+
+def new_id(rng: random.Random) -> str:
+    """ID в формате Mattermost (26 символов)"""
+    return "".join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(26))
+
+
+class Workspace:
+    """Сгенерированное рабочее пространство: пользователи, каналы, посты, треды"""
+
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.team_id = new_id(self.rng)
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.channels: Dict[str, Dict[str, Any]] = {}
+        self.members: Dict[str, set] = {}
+        self.posts: Dict[str, Dict[str, Any]] = {}
+        self.channel_posts: Dict[str, List[str]] = {}
+        self.threads: Dict[str, List[str]] = {}
+        self.sent_posts: List[Dict[str, Any]] = []
+        self.direct_channels: Dict[str, str] = {}
+        self.bot = self.add_user(BOT_USERNAME, is_bot=True)
+
+    @classmethod
+    def generate(cls, channels: int = 10, users: int = 50, posts_per_channel: int = 200,
+                 thread_ratio: float = 0.1, span_hours: float = 24.0, seed: int = 42) -> 'Workspace':
+        """Создает пространство с историей сообщений за последние span_hours часов"""
+        workspace = cls(seed)
+        user_ids = [workspace.add_user(f"user{i}")['id'] for i in range(users)]
+        now = int(time.time() * 1000)
+        span_ms = int(span_hours * 3_600_000)
+
+        for index in range(channels):
+            channel = workspace.add_channel(f"channel-{index}", f"Канал {index}", member_ids=user_ids)
+            for _ in range(posts_per_channel):
+                create_at = now - workspace.rng.randint(0, span_ms)
+                root_id = None
+                if workspace.threads and workspace.rng.random() < thread_ratio:
+                    candidates = [root for root in workspace.threads
+                                  if workspace.posts[root]['channel_id'] == channel['id']]
+                    if candidates:
+                        root_id = workspace.rng.choice(candidates)
+                        create_at = max(create_at, workspace.posts[root_id]['create_at'] + 1)
+                post = workspace.add_post(channel['id'], workspace.rng.choice(user_ids),
+                                          workspace.random_text(), root_id=root_id, create_at=create_at)
+                if root_id is None and workspace.rng.random() < thread_ratio:
+                    workspace.threads.setdefault(post['id'], [])
+        return workspace
+
+    def random_text(self) -> str:
+        length = self.rng.choice((3, 5, 8, 13, 21, 34))
+        return " ".join(self.rng.choice(WORDS) for _ in range(length))
+
+    def add_user(self, username: str, is_bot: bool = False) -> Dict[str, Any]:
+        user = {
+            'id': new_id(self.rng),
+            'username': username,
+            'first_name': username,
+            'last_name': '',
+            'is_bot': is_bot,
+            'timezone': {'useAutomaticTimezone': 'false', 'manualTimezone': 'Europe/Moscow'},
+        }
+        self.users[user['id']] = user
+        return user
+
+    def add_channel(self, name: str, display_name: str, channel_type: str = 'O',
+                    member_ids: Optional[List[str]] = None, with_bot: bool = True) -> Dict[str, Any]:
+        channel = {
+            'id': new_id(self.rng),
+            'team_id': self.team_id if channel_type in ('O', 'P') else '',
+            'name': name,
+            'display_name': display_name,
+            'type': channel_type,
+        }
+        self.channels[channel['id']] = channel
+        self.members[channel['id']] = set(member_ids or [])
+        if with_bot:
+            self.members[channel['id']].add(self.bot['id'])
+        self.channel_posts[channel['id']] = []
+        return channel
+
+    def add_post(self, channel_id: str, user_id: str, message: str, root_id: Optional[str] = None,
+                 create_at: Optional[int] = None) -> Dict[str, Any]:
+        create_at = create_at or int(time.time() * 1000)
+        post = {
+            'id': new_id(self.rng),
+            'channel_id': channel_id,
+            'user_id': user_id,
+            'root_id': root_id or '',
+            'message': message,
+            'create_at': create_at,
+            'update_at': create_at,
+            'type': '',
+            'props': {},
+        }
+        self.posts[post['id']] = post
+        self.channel_posts[channel_id].append(post['id'])
+        if root_id:
+            self.threads.setdefault(root_id, []).append(post['id'])
+        return post
+
+    def add_thread(self, channel_id: str, size: int) -> str:
+        """Создает тред из size сообщений (корень + ответы), возвращает ID корня"""
+        user_ids = sorted(self.members[channel_id] - {self.bot['id']}) or [self.bot['id']]
+        now = int(time.time() * 1000) - size
+        root = self.add_post(channel_id, self.rng.choice(user_ids), self.random_text(), create_at=now)
+        self.threads.setdefault(root['id'], [])
+        for offset in range(1, size):
+            self.add_post(channel_id, self.rng.choice(user_ids), self.random_text(),
+                          root_id=root['id'], create_at=now + offset)
+        return root['id']
+
+    def direct_channel(self, user_a: str, user_b: str) -> Dict[str, Any]:
+        name = "__".join(sorted((user_a, user_b)))
+        if name not in self.direct_channels:
+            channel = self.add_channel(name, name, channel_type='D', member_ids=[user_a, user_b])
+            self.direct_channels[name] = channel['id']
+        return self.channels[self.direct_channels[name]]
+
+    def post_list(self, post_ids: List[str]) -> Dict[str, Any]:
+        """Ответ Mattermost PostList (order - от новых к старым)"""
+        ordered = sorted(post_ids, key=lambda post_id: self.posts[post_id]['create_at'], reverse=True)
+        return {'order': ordered, 'posts': {post_id: self.posts[post_id] for post_id in ordered}}
+
+
+def _not_found(what: str) -> JSONResponse:
+    return JSONResponse(status_code=404, content={'id': 'api.not_found', 'message': f"{what} not found",
+                                                  'status_code': 404})
+
+
+def create_app(workspace: Workspace, event_rate: float = 0.0, command_ratio: float = 0.0,
+               member_event_ratio: float = 0.01) -> FastAPI:
+    """
+    Создает приложение симулятора
+
+    Args:
+        event_rate: событий websocket в секунду на соединение (0 - только hello)
+        command_ratio: доля событий posted с командой !summary в существующем треде
+        member_event_ratio: доля событий user_added / channel_member_added
+    """
+    app = FastAPI(title="Mattermost stub")
+    app.state.workspace = workspace
+    app.state.stats = {'requests': 0, 'events_sent': 0, 'posts_created': 0}
+
+    @app.middleware("http")
+    async def count_requests(request: Request, call_next):
+        app.state.stats['requests'] += 1
+        return await call_next(request)
+
+    @app.get("/stub/stats")
+    async def stats():
+        return app.state.stats
+
+    @app.post("/stub/threads")
+    async def create_thread(request: Request):
+        """Создает тред заданного размера (для бенчмарков !summary)"""
+        data = await request.json()
+        if data.get('channel_id') not in workspace.channels:
+            return _not_found("channel")
+        return {'root_id': workspace.add_thread(data['channel_id'], int(data.get('size', 10)))}
+
+    @app.get("/api/v4/users/me")
+    async def users_me():
+        return workspace.bot
+
+    @app.get("/api/v4/users/me/channels")
+    async def my_channels():
+        return [channel for channel_id, channel in workspace.channels.items()
+                if workspace.bot['id'] in workspace.members[channel_id]]
+
+    @app.get("/api/v4/users/{user_id}")
+    async def get_user(user_id: str):
+        return workspace.users.get(user_id) or _not_found("user")
+
+    @app.get("/api/v4/users/{user_id}/preferences")
+    async def get_preferences(user_id: str):
+        if user_id not in workspace.users:
+            return _not_found("user")
+        return [
+            {'user_id': user_id, 'category': 'display_settings', 'name': 'use_military_time', 'value': 'true'},
+            {'user_id': user_id, 'category': 'display_settings', 'name': 'timezone',
+             'value': json.dumps(workspace.users[user_id]['timezone'])},
+        ]
+
+    @app.get("/api/v4/channels/name/{name}")
+    async def get_channel_by_name(name: str):
+        for channel in workspace.channels.values():
+            if channel['name'] == name:
+                return channel
+        return _not_found("channel")
+
+    @app.get("/api/v4/channels/{channel_id}/members/me")
+    async def my_membership(channel_id: str):
+        if workspace.bot['id'] not in workspace.members.get(channel_id, ()):
+            return _not_found("member")
+        return {'channel_id': channel_id, 'user_id': workspace.bot['id'], 'roles': 'channel_user'}
+
+    @app.get("/api/v4/channels/{channel_id}/posts")
+    async def channel_posts(channel_id: str, page: int = 0, per_page: int = 60, since: Optional[int] = None):
+        if channel_id not in workspace.channels:
+            return _not_found("channel")
+        post_ids = workspace.channel_posts[channel_id]
+        if since is not None:
+            return workspace.post_list([pid for pid in post_ids if workspace.posts[pid]['update_at'] >= since])
+        ordered = workspace.post_list(post_ids)['order']
+        return workspace.post_list(ordered[page * per_page:(page + 1) * per_page])
+
+    @app.get("/api/v4/channels/{channel_id}")
+    async def get_channel(channel_id: str):
+        return workspace.channels.get(channel_id) or _not_found("channel")
+
+    @app.post("/api/v4/channels/direct")
+    async def direct_channel(request: Request):
+        user_a, user_b = await request.json()
+        return JSONResponse(status_code=201, content=workspace.direct_channel(user_a, user_b))
+
+    @app.get("/api/v4/posts/{post_id}/thread")
+    async def get_thread(post_id: str):
+        if post_id not in workspace.posts:
+            return _not_found("post")
+        return workspace.post_list([post_id] + workspace.threads.get(post_id, []))
+
+    @app.get("/api/v4/posts/{post_id}")
+    async def get_post(post_id: str):
+        return workspace.posts.get(post_id) or _not_found("post")
+
+    @app.post("/api/v4/posts")
+    async def create_post(request: Request):
+        data = await request.json()
+        if data.get('channel_id') not in workspace.channels:
+            return _not_found("channel")
+        post = workspace.add_post(data['channel_id'], workspace.bot['id'], data.get('message', ''),
+                                  root_id=data.get('root_id'))
+        workspace.sent_posts.append(post)
+        app.state.stats['posts_created'] += 1
+        return JSONResponse(status_code=201, content=post)
+
+    @app.websocket("/api/v4/websocket")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        try:
+            challenge = json.loads(await websocket.receive_text())
+            await websocket.send_text(json.dumps({
+                'event': 'hello', 'data': {'server_version': 'stub'}, 'broadcast': {}, 'seq': 0,
+            }))
+            await websocket.send_text(json.dumps({'status': 'OK', 'seq_reply': challenge.get('seq', 1)}))
+
+            seq = 1
+            rng = random.Random(workspace.rng.random())
+            while event_rate > 0:
+                await asyncio.sleep(1.0 / event_rate)
+                event = synthetic_event(workspace, rng, command_ratio, member_event_ratio)
+                event['seq'] = seq
+                seq += 1
+                await websocket.send_text(json.dumps(event, ensure_ascii=False))
+                app.state.stats['events_sent'] += 1
+            # Без генерации событий просто держим соединение открытым
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    return app
+
+
+def synthetic_event(workspace: Workspace, rng: random.Random, command_ratio: float = 0.0,
+                    member_event_ratio: float = 0.01) -> Dict[str, Any]:
+    """Случайное событие websocket в формате Mattermost"""
+    public_channels = [channel for channel in workspace.channels.values() if channel['type'] == 'O']
+    channel = rng.choice(public_channels)
+    user_ids = sorted(workspace.members[channel['id']] - {workspace.bot['id']})
+    user_id = rng.choice(user_ids) if user_ids else workspace.bot['id']
+
+    roll = rng.random()
+    if roll < member_event_ratio / 2:
+        return {'event': 'user_added', 'data': {'user_id': user_id, 'team_id': workspace.team_id},
+                'broadcast': {'channel_id': channel['id']}}
+    if roll < member_event_ratio:
+        return {'event': 'channel_member_added', 'data': {'user_id': user_id, 'channel_id': channel['id']},
+                'broadcast': {'channel_id': channel['id']}}
+
+    root_id = None
+    message = workspace.random_text()
+    if rng.random() < command_ratio:
+        roots = [root for root in workspace.threads if workspace.posts[root]['channel_id'] == channel['id']]
+        if roots:
+            root_id = rng.choice(roots)
+            message = '!summary'
+
+    post = workspace.add_post(channel['id'], user_id, message, root_id=root_id)
+    return {
+        'event': 'posted',
+        'data': {
+            'channel_display_name': channel['display_name'],
+            'channel_name': channel['name'],
+            'channel_type': channel['type'],
+            'post': json.dumps(post, ensure_ascii=False),
+            'sender_name': workspace.users[user_id]['username'],
+            'team_id': workspace.team_id,
+        },
+        'broadcast': {'channel_id': channel['id']},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симулятор Mattermost API и websocket")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8065)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=200, help="сообщений в канале")
+    parser.add_argument('--event-rate', type=float, default=0.0, help="событий websocket в секунду")
+    parser.add_argument('--command-ratio', type=float, default=0.0, help="доля команд !summary среди событий")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    workspace = Workspace.generate(args.channels, args.users, args.posts, seed=args.seed)
+
+    import uvicorn
+    print(f"🧪 Симулятор Mattermost: http://{args.host}:{args.port} "
+          f"({args.channels} каналов, {args.users} пользователей, {len(workspace.posts)} сообщений, "
+          f"{args.event_rate} событий/с)")
+    uvicorn.run(create_app(workspace, args.event_rate, args.command_ratio),
+                host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк бота на локальных заглушках Mattermost и LLM
+
+Измеряет:
+    - скорость приема событий через _handle_websocket_message
+    - p50/p99 задержки !summary для тредов из 10, 100 и 1000 сообщений
+    - время волны дайджестов SubscriptionScheduler на 1k/10k подписок
+    - выборку наступивших подписок с проверкой журнала доставок на 100k подписок
+    - время отрисовки дашборда
+
+Запуск:
+    python -m benchmarks.run --compare benchmarks/baseline_full.json
+    python -m benchmarks.run --quick --compare benchmarks/baseline.json
+
+В режиме --compare метрики сравниваются с сохраненным базовым прогоном;
+ухудшение больше --threshold (по умолчанию 30%) считается регрессией,
+и команда завершается с кодом 1.
+
+Заглушки работают в отдельных процессах на той же машине, поэтому
+абсолютные числа зависят от железа: базовый прогон нужно снимать там же.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+
+from benchmarks import llm_stub, mattermost_stub
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль с линейной интерполяцией (q от 0 до 100)"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_stats(timings: List[float]) -> Dict[str, float]:
+    """p50/p99/среднее в миллисекундах"""
+    return {
+        'samples': len(timings),
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 2) if timings else 0.0,
+    }
+
+
+# Суффиксы метрик, которые сравниваются с базовым прогоном
+COMPARED_SUFFIXES = ('_ms', '_seconds', '_per_second')
+
+
+def compare_results(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                    threshold: float = 0.3, noise_ms: float = 2.0) -> List[str]:
+    """
+    Сравнивает прогон с базовым
+
+    Метрики *_ms и *_seconds - чем меньше, тем лучше; *_per_second - чем
+    больше, тем лучше. Остальные поля (размеры, число замеров) не сравниваются.
+    Разница во времени меньше noise_ms считается шумом. Метрика, которой нет
+    в одном из прогонов, тоже считается регрессией: иначе сравнение быстрого
+    прогона с полным базовым (или новый сценарий без базы) молча проходит.
+
+    Returns:
+        Описания регрессий
+    """
+    regressions = []
+    for name in sorted(baseline.keys() - results.keys()):
+        regressions.append(f"{name}: нет в прогоне")
+    for name, metrics in results.items():
+        if name not in baseline:
+            regressions.append(f"{name}: нет в базовом прогоне")
+            continue
+        for metric in sorted(baseline[name].keys() - metrics.keys()):
+            if metric.endswith(COMPARED_SUFFIXES):
+                regressions.append(f"{name}.{metric}: нет в прогоне")
+        for metric, value in metrics.items():
+            if not metric.endswith(COMPARED_SUFFIXES):
+                continue
+            base = baseline[name].get(metric)
+            if not isinstance(base, (int, float)):
+                regressions.append(f"{name}.{metric}: нет в базовом прогоне")
+                continue
+            if not base:
+                continue
+            if metric.endswith('_per_second'):
+                change = (base - value) / base
+            elif metric.endswith(('_ms', '_seconds')):
+                scale = 1 if metric.endswith('_ms') else 1000
+                if (value - base) * scale < noise_ms:
+                    continue
+                change = (value - base) / base
+            if change > threshold:
+                regressions.append(f"{name}.{metric}: {base} → {value} (хуже на {change:.0%})")
+    return regressions
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _serve(build, args, port: int):
+    uvicorn.run(build(*args), host='127.0.0.1', port=port, log_level='warning', access_log=False)
+
+
+def _mattermost_app(channels: int, users: int, posts: int, seed: int):
+    workspace = mattermost_stub.Workspace.generate(channels=channels, users=users, posts_per_channel=posts, seed=seed)
+    return mattermost_stub.create_app(workspace)
+
+
+def _llm_app(profile: str, seed: int):
+    return llm_stub.create_app(llm_stub.StubProfile.from_name(profile, seed=seed))
+
+
+class StubProcess:
+    """Заглушка в отдельном процессе, чтобы не делить GIL с измеряемым ботом"""
+
+    def __init__(self, build, *args):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = multiprocessing.Process(target=_serve, args=(build, args, self.port), daemon=True)
+
+    def __enter__(self):
+        self.process.start()
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.5).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.process.terminate()
+        raise RuntimeError(f"Заглушка на порту {self.port} не запустилась")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join(timeout=10)
+
+
+class BenchmarkSuite:
+    """Набор сквозных замеров над одним экземпляром бота"""
+
+    def __init__(self, workspace: 'mattermost_stub.Workspace', mattermost_url: str):
+        from mattermost_bot import MattermostBot
+
+        # Копия рабочего пространства заглушки (тот же seed): ID каналов и пользователей совпадают
+        self.workspace = workspace
+        self.mattermost_url = mattermost_url
+        self.bot = MattermostBot()
+        self.bot.base_url = mattermost_url
+        self.bot.token = 'bench'
+        self.bot.bot_user_id = workspace.bot['id']
+        self.bot.bot_username = workspace.bot['username']
+        self.public_channels = [channel for channel in workspace.channels.values() if channel['type'] == 'O']
+
+    async def _posts_created(self) -> int:
+        response = await self.bot._http_get(f"{self.mattermost_url}/stub/stats")
+        return response.json()['posts_created']
+
+    async def ingest(self, events: int) -> Dict[str, Any]:
+        """Прием обычных сообщений (без команд) через обработчик websocket"""
+        rng = random.Random(1)
+        payloads = [json.dumps(mattermost_stub.synthetic_event(self.workspace, rng, member_event_ratio=0))
+                    for _ in range(events)]
+        started = time.perf_counter()
+        for payload in payloads:
+            await self.bot._handle_websocket_message(payload)
+        elapsed = time.perf_counter() - started
+        return {'events': events, 'seconds': round(elapsed, 3), 'events_per_second': round(events / elapsed, 1)}
+
+    async def thread_summary(self, size: int, repeat: int) -> Dict[str, Any]:
+        """Задержка !summary от события до отправленного ответа"""
+        channel = self.public_channels[0]
+        user_id = next(iter(self.workspace.members[channel['id']] - {self.workspace.bot['id']}))
+        response = await self.bot._http_post(f"{self.mattermost_url}/stub/threads",
+                                             json={'channel_id': channel['id'], 'size': size})
+        root_id = response.json()['root_id']
+        timings = []
+        # Первый прогон не учитываем: в нем устанавливаются соединения
+        for attempt in range(repeat + 1):
+            started = time.perf_counter()
+            await self.bot._handle_summary_command(channel['id'], root_id, f"command{attempt}", user_id)
+            if attempt:
+                timings.append(time.perf_counter() - started)
+        return {'thread_size': size, **latency_stats(timings)}
+
+    async def digest_wave(self, subscriptions: int, channels_per_subscription: int = 2) -> Dict[str, Any]:
+        """Одна волна рассылки: все подписки наступают в одну и ту же минуту"""
+        from scheduler import SubscriptionScheduler
+        from subscription_manager import SubscriptionManager
+
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(prefix='bench-'), 'subscriptions.db'))
+        fire_at = (datetime.utcnow() + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        schedule_time = fire_at.strftime('%H:%M')
+        names = [channel['name'] for channel in self.public_channels]
+        for index in range(subscriptions):
+            channels = [names[(index + offset) % len(names)] for offset in range(channels_per_subscription)]
+            await manager.create_subscription(f"benchuser{index:06d}", f"benchuser{index}", channels,
+                                              schedule_time, 'daily', timezone='UTC')
+
+        scheduler = SubscriptionScheduler(self.bot, manager)
+        sent_before = await self._posts_created()
+        started = time.perf_counter()
+        try:
+            await scheduler._check_subscriptions(fire_at)
+        finally:
+            scheduler.extractive.shutdown()
+        elapsed = time.perf_counter() - started
+        self.bot.subscription_manager = manager
+        return {
+            'subscriptions': subscriptions,
+            'delivered': await self._posts_created() - sent_before,
+            'seconds': round(elapsed, 3),
+            'subscriptions_per_second': round(subscriptions / elapsed, 1),
+        }
+
+    async def due_check(self, subscriptions: int, repeat: int) -> Dict[str, Any]:
+        """get_due_subscriptions по базе без Mattermost: холостая проверка и наступившая волна"""
+        from subscription_manager import RUN_AT_FORMAT, SubscriptionManager
+
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(prefix='bench-'), 'subscriptions.db'))
+        fire_at = (datetime.utcnow() + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        run_at = fire_at.strftime(RUN_AT_FORMAT)
+        delivered_at = (fire_at - timedelta(days=1)).strftime(RUN_AT_FORMAT)
+
+        def populate(conn):
+            conn.executemany('''
+                INSERT INTO subscriptions (user_id, username, channels, schedule_time, frequency, timezone,
+                                           next_run_at)
+                VALUES (?, ?, '["general"]', ?, 'daily', 'UTC', ?)
+            ''', ((f"benchuser{index:06d}", f"benchuser{index}", fire_at.strftime('%H:%M'), run_at)
+                  for index in range(subscriptions)))
+            # История доставок: по три вчерашних записи на подписку
+            conn.executemany('''
+                INSERT INTO delivery_log (subscription_id, status, message_count, delivered_at)
+                VALUES (?, ?, 10, ?)
+            ''', ((sub_id, status, delivered_at)
+                  for sub_id in range(1, subscriptions + 1) for status in ('success', 'error', 'success')))
+
+        await manager.db.run(populate)
+        idle = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await manager.get_due_subscriptions(fire_at - timedelta(minutes=1))
+            idle.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        due = await manager.get_due_subscriptions(fire_at)
+        elapsed = time.perf_counter() - started
+        manager.close()
+        return {
+            'subscriptions': subscriptions,
+            'due': len(due),
+            'idle_p50_ms': round(percentile(idle, 50) * 1000, 2),
+            'wave_seconds': round(elapsed, 3),
+        }
+
+    async def dashboard(self, repeat: int) -> Dict[str, Any]:
+        """Отрисовка главной страницы веб-сервера"""
+        from fastapi.testclient import TestClient
+        from web_server import create_app
+
+        def requests_dashboard() -> List[float]:
+            client = TestClient(create_app(self.bot))
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = client.get('/')
+                timings.append(time.perf_counter() - started)
+                response.raise_for_status()
+            return timings
+
+        # TestClient запускает приложение в собственном цикле событий - держим его вне текущего
+        timings = await asyncio.to_thread(requests_dashboard)
+        return {'subscriptions': len(await self.bot.subscription_manager.get_all_subscriptions()),
+                **latency_stats(timings)}
+
+
+async def run_suite(args) -> Dict[str, Dict[str, Any]]:
+    workspace = mattermost_stub.Workspace.generate(
+        channels=args.channels, users=args.users, posts_per_channel=args.posts, seed=args.seed
+    )
+    with StubProcess(_mattermost_app, args.channels, args.users, args.posts, args.seed) as mattermost, \
+            StubProcess(_llm_app, args.llm_profile, args.seed) as llm:
+        # Config читается при импорте модулей бота, поэтому подменяем его атрибуты напрямую
+        from config import Config
+        Config.MATTERMOST_URL = mattermost.url
+        Config.MATTERMOST_TOKEN = 'bench'
+        Config.LLM_BASE_URL = f"{llm.url}/v1"
+        Config.LLM_BASE_URLS = ''
+        Config.LLM_MODEL = 'stub-model'
+        Config.LLM_MODELS = ''
+        Config.LLM_PROXY_TOKEN = 'bench'
+        suite = BenchmarkSuite(workspace, Config.MATTERMOST_URL)
+        results = {}
+
+        print(f"📥 Прием событий: {args.events}")
+        results['ingest'] = await suite.ingest(args.events)
+
+        for size in args.thread_sizes:
+            print(f"🧵 !summary для треда из {size} сообщений")
+            results[f'summary_thread_{size}'] = await suite.thread_summary(size, args.repeat)
+
+        for count in args.subscriptions:
+            print(f"📬 Волна дайджестов: {count} подписок")
+            results[f'digest_wave_{count}'] = await suite.digest_wave(count)
+
+        print(f"🗓️ Выборка наступивших подписок: {args.due_subscriptions}")
+        results[f'due_check_{args.due_subscriptions}'] = await suite.due_check(args.due_subscriptions, args.repeat)
+
+        print("🖥️ Дашборд")
+        results['dashboard'] = await suite.dashboard(args.repeat * 5)
+
+    return results
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк Mattermost Summary Bot")
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    parser.add_argument('--compare', help="базовый прогон (JSON) для поиска регрессий")
+    parser.add_argument('--threshold', type=float, default=0.3, help="допустимое ухудшение (0.3 = 30%%)")
+    parser.add_argument('--quick', action='store_true', help="уменьшенные размеры для CI")
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--thread-sizes', type=_int_list, default=[10, 100, 1000])
+    parser.add_argument('--subscriptions', type=_int_list, default=[1000, 10000])
+    parser.add_argument('--due-subscriptions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20, help="замеров для перцентилей")
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=100, help="сообщений в канале")
+    parser.add_argument('--llm-profile', choices=sorted(llm_stub.PROFILES), default='instant')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.events = min(args.events, 500)
+        args.subscriptions = [max(count // 100, 1) for count in args.subscriptions]
+        args.due_subscriptions = max(args.due_subscriptions // 10, 1)
+        args.repeat = min(args.repeat, 10)
+
+    output = os.path.abspath(args.output) if args.output else None
+    compare = os.path.abspath(args.compare) if args.compare else None
+    os.chdir(tempfile.mkdtemp(prefix='bench-'))  # базы бота создаются в рабочем каталоге
+    started = time.perf_counter()
+    results = asyncio.run(run_suite(args))
+
+    report = {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': args.quick,
+            'llm_profile': args.llm_profile,
+            'total_seconds': round(time.perf_counter() - started, 1),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+
+    if compare:
+        with open(compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline.get('results', {}), args.threshold)
+        if regressions:
+            print("❌ Регрессии относительно базового прогона:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Локальная статистика активности канала
+
+Участники, ссылки, файлы и часы пик считаются по всем полученным
+сообщениям, а в промпт попадает компактная таблица - модели не нужно
+пересчитывать их по сырым сообщениям.
+"""
+
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pytz
+
+URL_RE = re.compile(r'https?://[^\s<>()\[\]"\']+')
+
+
+def compute_channel_stats(messages: List[Dict[str, Any]], timezone: str = 'Europe/Moscow',
+                          top_n: int = 5) -> Dict[str, Any]:
+    """
+    Считает статистику по сообщениям канала
+
+    Args:
+        messages: сообщения с полями username, message, create_at (мс), files
+        timezone: часовой пояс для часов пик
+        top_n: сколько участников, ссылок и файлов оставлять
+    """
+    users = Counter()
+    urls = Counter()
+    files = []
+    hours = Counter()
+    timestamps = []
+    tz = pytz.timezone(timezone)
+
+    for msg in messages:
+        users[msg.get('username', 'Неизвестный пользователь')] += 1
+        for url in URL_RE.findall(msg.get('message') or ''):
+            urls[url.rstrip('.,;:!?')] += 1
+        files.extend(msg.get('files') or [])
+        create_at = msg.get('create_at')
+        if create_at:
+            timestamps.append(create_at)
+            hours[datetime.fromtimestamp(create_at / 1000, tz=tz).hour] += 1
+
+    span_hours = (max(timestamps) - min(timestamps)) / 3_600_000 if len(timestamps) > 1 else 0.0
+
+    return {
+        'message_count': len(messages),
+        'participant_count': len(users),
+        'top_participants': users.most_common(top_n),
+        'url_count': sum(urls.values()),
+        'top_urls': urls.most_common(top_n),
+        'file_count': len(files),
+        'files': files[:top_n],
+        'messages_per_hour': round(len(messages) / span_hours, 1) if span_hours >= 1 else float(len(messages)),
+        'busiest_hours': [hour for hour, _ in hours.most_common(3)],
+    }
+
+
+def _format_hours(hours: List[int]) -> str:
+    return ", ".join(f"{hour:02d}:00" for hour in hours) or "-"
+
+
+def format_stats_table(channels: List[Dict[str, Any]]) -> str:
+    """
+    Таблица статистики для промпта
+
+    Args:
+        channels: словари с display_name и stats (результат compute_channel_stats)
+    """
+    rows = [
+        "=== СТАТИСТИКА (посчитана по всем сообщениям периода) ===",
+        "Канал | Сообщений | Участников | Сообщ./час | Часы пик | Ссылок | Файлов",
+    ]
+    details = []
+
+    for channel in channels:
+        stats = channel.get('stats')
+        if not stats:
+            continue
+        name = channel['display_name']
+        rows.append(
+            f"{name} | {stats['message_count']} | {stats['participant_count']} | "
+            f"{stats['messages_per_hour']} | {_format_hours(stats['busiest_hours'])} | "
+            f"{stats['url_count']} | {stats['file_count']}"
+        )
+        if stats['top_participants']:
+            participants = ", ".join(f"{user} ({count})" for user, count in stats['top_participants'])
+            details.append(f"{name} - активные участники: {participants}")
+        if stats['top_urls']:
+            links = ", ".join(f"{url} (×{count})" if count > 1 else url for url, count in stats['top_urls'])
+            details.append(f"{name} - ссылки: {links}")
+        if stats['files']:
+            details.append(f"{name} - файлы: {', '.join(stats['files'])}")
+
+    return "\n".join(rows + details)
+
+
+def format_stats_header(display_name: str, stats: Optional[Dict[str, Any]], message_count: int) -> str:
+    """Строка канала для заголовка сводки"""
+    if not stats:
+        return f"• **{display_name}** ({message_count} сообщений)"
+
+    line = (
+        f"• **{display_name}** ({message_count} сообщений, {stats['participant_count']} участников, "
+        f"🔗 {stats['url_count']}, 📎 {stats['file_count']}, пик {_format_hours(stats['busiest_hours'][:1])})"
+    )
+    if stats['top_participants']:
+        top = ", ".join(f"{user} ({count})" for user, count in stats['top_participants'][:3])
+        line += f"\n  👥 {top}"
+    return line
@@ -16,6 +16,99 @@ class Config:
     LLM_BASE_URL = os.getenv('LLM_BASE_URL', '')
     LLM_MODEL = os.getenv('LLM_MODEL', '')
     
+    # Балансировка между репликами LLM (значения через запятую, по умолчанию - LLM_BASE_URL/LLM_MODEL)
+    LLM_BASE_URLS = os.getenv('LLM_BASE_URLS', '')
+    LLM_MODELS = os.getenv('LLM_MODELS', '')
+    LLM_BALANCING_STRATEGY = os.getenv('LLM_BALANCING_STRATEGY', 'least_requests').lower()
+    LLM_EJECT_FAILURES = int(os.getenv('LLM_EJECT_FAILURES', 3))
+    LLM_EJECT_SECONDS = float(os.getenv('LLM_EJECT_SECONDS', 30))
+    
+    # Дублирование медленных запросов к LLM (hedging)
+    LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+    LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+    LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 2))
+    LLM_HEDGE_MAX_RATIO = float(os.getenv('LLM_HEDGE_MAX_RATIO', 0.1))
+    
+    # Выбор модели по размеру и типу запроса (пустая модель уровня - модель по умолчанию)
+    LLM_ROUTING_ENABLED = os.getenv('LLM_ROUTING_ENABLED', 'false').lower() == 'true'
+    LLM_FAST_MODEL = os.getenv('LLM_FAST_MODEL', '')
+    LLM_THROUGHPUT_MODEL = os.getenv('LLM_THROUGHPUT_MODEL', '')
+    LLM_LONG_CONTEXT_MODEL = os.getenv('LLM_LONG_CONTEXT_MODEL', '')
+    LLM_ROUTING_FAST_MAX_TOKENS = int(os.getenv('LLM_ROUTING_FAST_MAX_TOKENS', 2000))
+    LLM_ROUTING_LONG_CONTEXT_MIN_TOKENS = int(os.getenv('LLM_ROUTING_LONG_CONTEXT_MIN_TOKENS', 24000))
+    
+    # HTTP-транспорт LLM: пул соединений, keep-alive, таймауты (секунды), HTTP/2 (нужен пакет h2)
+    LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 100))
+    LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', 20))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60))
+    LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 10))
+    LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', 120))
+    LLM_HTTP2 = os.getenv('LLM_HTTP2', 'false').lower() == 'true'
+    LLM_WARMUP_ENABLED = os.getenv('LLM_WARMUP_ENABLED', 'true').lower() == 'true'
+    LLM_WARMUP_CONNECTIONS = int(os.getenv('LLM_WARMUP_CONNECTIONS', 2))
+    
+    # Пассивная проверка здоровья LLM: фоновая проба (список моделей) и допустимая доля ошибок
+    LLM_HEALTH_PROBE_INTERVAL = float(os.getenv('LLM_HEALTH_PROBE_INTERVAL', 300))
+    LLM_HEALTH_MAX_ERROR_RATE = float(os.getenv('LLM_HEALTH_MAX_ERROR_RATE', 0.5))
+    
+    # Дневной лимит токенов LLM на пользователя (0 - без ограничений)
+    LLM_USER_DAILY_TOKEN_QUOTA = int(os.getenv('LLM_USER_DAILY_TOKEN_QUOTA', 0))
+    # Сколько суток хранить сырые записи учета LLM (0 - не очищать); дневные агрегаты хранятся всегда,
+    # очистка идет вместе с журналом доставок (DELIVERY_LOG_COMPACTION_BATCH/INTERVAL)
+    USAGE_RETENTION_DAYS = int(os.getenv('USAGE_RETENTION_DAYS', 30))
+    
+    # Сжатие сообщений перед отправкой в LLM
+    PROMPT_COMPACTION_ENABLED = os.getenv('PROMPT_COMPACTION_ENABLED', 'true').lower() == 'true'
+    PROMPT_MAX_MESSAGE_CHARS = int(os.getenv('PROMPT_MAX_MESSAGE_CHARS', 1500))
+    PROMPT_DROP_BOT_POSTS = os.getenv('PROMPT_DROP_BOT_POSTS', 'true').lower() == 'true'
+    
+    # Экстрактивный отбор сообщений для сводок по подпискам
+    EXTRACTIVE_ENABLED = os.getenv('EXTRACTIVE_ENABLED', 'true').lower() == 'true'
+    EXTRACTIVE_MIN_MESSAGES = int(os.getenv('EXTRACTIVE_MIN_MESSAGES', 150))
+    EXTRACTIVE_TOP_K = int(os.getenv('EXTRACTIVE_TOP_K', 150))
+    EXTRACTIVE_TOKEN_BUDGET = int(os.getenv('EXTRACTIVE_TOKEN_BUDGET', 6000))
+    EXTRACTIVE_WORKERS = int(os.getenv('EXTRACTIVE_WORKERS', 2))
+    
+    # Схлопывание почти одинаковых сообщений (алерты, CI-уведомления)
+    DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+    DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', 0.8))
+    DEDUP_MIN_MESSAGES = int(os.getenv('DEDUP_MIN_MESSAGES', 20))
+    
+    # Таблица статистики каналов (участники, ссылки, файлы, часы пик) в промпте
+    PROMPT_STATS_ENABLED = os.getenv('PROMPT_STATS_ENABLED', 'true').lower() == 'true'
+    
+    # Бюджет токенов сводки по нескольким каналам и минимальная доля канала
+    DIGEST_TOKEN_BUDGET = int(os.getenv('DIGEST_TOKEN_BUDGET', 12000))
+    DIGEST_CHANNEL_MIN_TOKENS = int(os.getenv('DIGEST_CHANNEL_MIN_TOKENS', 500))
+    
+    # Планировщик подписок: максимум сна между проверками и допустимое опоздание запуска (секунды)
+    SCHEDULER_MAX_SLEEP = int(os.getenv('SCHEDULER_MAX_SLEEP', 3600))
+    SCHEDULER_MISSED_RUN_GRACE = int(os.getenv('SCHEDULER_MISSED_RUN_GRACE', 3600))
+    
+    # Параллельное выполнение подписок: общий лимит, лимит выборок одного канала, таймаут подписки (секунды)
+    SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', 20))
+    SCHEDULER_CHANNEL_CONCURRENCY = int(os.getenv('SCHEDULER_CHANNEL_CONCURRENCY', 4))
+    SCHEDULER_SUBSCRIPTION_TIMEOUT = int(os.getenv('SCHEDULER_SUBSCRIPTION_TIMEOUT', 300))
+    # Сколько каналов одной подписки разрешаются и выбираются параллельно
+    SCHEDULER_FETCH_CONCURRENCY = int(os.getenv('SCHEDULER_FETCH_CONCURRENCY', 8))
+    
+    # Общие для подписчиков частичные сводки каналов (одна генерация на канал и окно за волну)
+    DIGEST_SHARED_ENABLED = os.getenv('DIGEST_SHARED_ENABLED', 'true').lower() == 'true'
+    
+    # Предрасчет сводок за столько секунд до доставки (0 - выключен, нужен DIGEST_SHARED_ENABLED)
+    DIGEST_PRECOMPUTE_LEAD = int(os.getenv('DIGEST_PRECOMPUTE_LEAD', 600))
+    # Сколько подписок предрасчитывается параллельно (отдельно от лимита доставок)
+    DIGEST_PRECOMPUTE_CONCURRENCY = int(os.getenv('DIGEST_PRECOMPUTE_CONCURRENCY', 4))
+    
+    # Журнал доставок: сколько суток хранить сырые записи (0 - не очищать, минимум 8),
+    # размер пачки удаления и интервал фоновой очистки (секунды); дневные агрегаты хранятся всегда
+    DELIVERY_LOG_RETENTION_DAYS = int(os.getenv('DELIVERY_LOG_RETENTION_DAYS', 30))
+    DELIVERY_LOG_COMPACTION_BATCH = int(os.getenv('DELIVERY_LOG_COMPACTION_BATCH', 500))
+    DELIVERY_LOG_COMPACTION_INTERVAL = int(os.getenv('DELIVERY_LOG_COMPACTION_INTERVAL', 3600))
+    
+    # Максимум страниц (по 200 постов) истории канала для сводок
+    MATTERMOST_MAX_HISTORY_PAGES = int(os.getenv('MATTERMOST_MAX_HISTORY_PAGES', 50))
+    
     # Общие настройки бота
     BOT_PORT = int(os.getenv('BOT_PORT', 8080))
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Слой хранения SQLite
+
+Одно долгоживущее соединение на базу в режиме WAL. Все обращения к нему
+выполняются в выделенном потоке, а наружу отдаются корутины - цикл событий
+(WebSocket, планировщик, веб-сервер) не ждет диска. Подготовленные выражения
+переиспользуются через кеш модуля sqlite3: на постоянном соединении каждый
+текст запроса компилируется один раз.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Прагмы соединения: WAL - чтение не блокируется записью, NORMAL - без fsync на каждую транзакцию
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -16000),
+)
+
+STATEMENT_CACHE_SIZE = 256
+
+
+class Database:
+    """Соединение SQLite и поток, в котором выполняются все запросы к нему"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._thread_id = None
+        self._conn = self._executor.submit(self._connect).result()
+
+    def _connect(self) -> sqlite3.Connection:
+        self._thread_id = threading.get_ident()
+        conn = sqlite3.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for name, value in PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _transaction(self, fn: Callable[..., Any], args: tuple) -> Any:
+        """fn(conn, *args) одной транзакцией: фиксация при успехе, откат при ошибке"""
+        try:
+            result = fn(self._conn, *args)
+            self._conn.commit()
+            return result
+        except BaseException:
+            self._conn.rollback()
+            raise
+
+    def call(self, fn: Callable[..., Any], *args) -> Any:
+        """Синхронный вызов - для инициализации и кода вне цикла событий"""
+        if threading.get_ident() == self._thread_id:
+            return self._transaction(fn, args)
+        return self._executor.submit(self._transaction, fn, args).result()
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Выполняет fn(conn, *args) в потоке базы и возвращает результат"""
+        return await asyncio.wrap_future(self._executor.submit(self._transaction, fn, args))
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        """Ставит запись в очередь потока базы без ожидания; ошибки пишутся в лог"""
+        future = self._executor.submit(self._transaction, fn, args)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def _log_failure(self, future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"❌ Ошибка фоновой записи в {self.path}: {future.exception()}")
+
+    def close(self):
+        """Закрывает соединение после выполнения уже поставленных запросов"""
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Распределение бюджета токенов между каналами сводки
+
+Общий бюджет делится пропорционально активности каналов (не меньше
+минимальной доли на канал); неиспользованный остаток тихих каналов
+переходит к остальным (water-filling).
+"""
+
+from typing import Any, Dict, Hashable, List, Tuple
+
+
+def allocate_token_budget(demands: Dict[Hashable, int], weights: Dict[Hashable, float],
+                          total_budget: int, floor: int) -> Dict[Hashable, int]:
+    """
+    Делит total_budget между каналами
+
+    Args:
+        demands: сколько токенов занимают все сообщения канала
+        weights: активность канала (например, число сообщений)
+        total_budget: общий бюджет токенов
+        floor: минимальная доля канала (если ему столько нужно)
+
+    Returns:
+        Бюджет каждого канала, не больше его потребности
+    """
+    keys = [key for key, demand in demands.items() if demand > 0]
+    budgets = {key: 0 for key in demands}
+    if not keys or total_budget <= 0:
+        return budgets
+
+    # Минимальная доля; если даже ее не хватает - делим поровну
+    floor = min(floor, total_budget // len(keys))
+    for key in keys:
+        budgets[key] = min(demands[key], floor)
+    left = total_budget - sum(budgets.values())
+
+    active = {key for key in keys if demands[key] > budgets[key]}
+    while left > 0 and active:
+        weight_sum = sum(max(weights.get(key, 1), 1) for key in active)
+        distributed = 0
+        saturated = set()
+        for key in active:
+            extra = int(left * max(weights.get(key, 1), 1) / weight_sum)
+            need = demands[key] - budgets[key]
+            if extra >= need:
+                extra = need
+                saturated.add(key)
+            budgets[key] += extra
+            distributed += extra
+        left -= distributed
+        if not saturated:
+            # Все каналы получили пропорциональную долю, остаток - ошибки округления
+            break
+        active -= saturated
+
+    return budgets
+
+
+def select_messages_within_budget(items: List[Tuple[Dict[str, Any], int]],
+                                  budget: int) -> List[Tuple[Dict[str, Any], int]]:
+    """
+    Отбирает сообщения канала в пределах бюджета
+
+    Args:
+        items: пары (сообщение, стоимость в токенах)
+        budget: бюджет канала
+
+    Returns:
+        Отобранные пары в хронологическом порядке: сначала с наибольшим
+        rank_score (если сообщения ранжированы), иначе самые свежие
+    """
+    if sum(cost for _, cost in items) <= budget:
+        return sorted(items, key=lambda item: item[0].get('create_at', 0))
+
+    if any('rank_score' in msg for msg, _ in items):
+        priority = lambda item: (item[0].get('rank_score', 0.0), item[0].get('create_at', 0))
+    else:
+        priority = lambda item: item[0].get('create_at', 0)
+
+    selected = []
+    used = 0
+    for item in sorted(items, key=priority, reverse=True):
+        if used + item[1] > budget:
+            continue
+        used += item[1]
+        selected.append(item)
+
+    return sorted(selected, key=lambda item: item[0].get('create_at', 0))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Общая работа волны рассылки
+
+Подписчики одних и тех же каналов с одинаковым окном получают одинаковые
+данные: поиск канала, выборка истории, отбор сообщений и частичная сводка
+канала выполняются один раз за волну и переиспользуются во всех
+персональных сводках.
+
+Граф может быть заполнен заранее, до времени доставки: тогда работа до
+границы предрасчета (cutoff) уже выполнена, а при доставке остается
+докачать и досуммировать сообщения после нее.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class WaveWorkGraph:
+    """Мемоизированные задачи одной волны рассылки, по ключу"""
+
+    def __init__(self, cutoff: Optional[datetime] = None):
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        # Граница предрасчета (UTC): сообщения до нее обработаны заранее
+        self.cutoff = cutoff
+
+    def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Awaitable[Any]:
+        """
+        Результат задачи key; factory вызывается только при первом обращении
+
+        Задача защищена от отмены: таймаут одной подписки не прерывает
+        работу, которую ждут остальные.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+        else:
+            self.hits += 1
+        return asyncio.shield(task)
+
+    def forget_failed(self):
+        """Забывает завершенные с ошибкой или без результата задачи - при следующем обращении они выполнятся заново"""
+        for key, task in list(self._tasks.items()):
+            if task.done() and (task.cancelled() or task.exception() is not None or task.result() is None):
+                del self._tasks[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {'tasks': len(self._tasks), 'hits': self.hits}
+
+
+def compose_digest(partials: List[Tuple[str, str]]) -> str:
+    """
+    Персональная сводка из частичных сводок каналов
+
+    Args:
+        partials: пары (отображаемое имя канала, сводка канала)
+    """
+    if len(partials) == 1:
+        return partials[0][1]
+    return "\n\n".join(f"### 📢 {display_name}\n\n{summary}" for display_name, summary in partials)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Локальный экстрактивный отбор сообщений перед суммаризацией
+
+Сообщения ранжируются TextRank по TF-IDF векторам (NumPy, только CPU),
+в LLM уходят самые информативные сообщения в пределах бюджета токенов.
+"""
+
+import asyncio
+import logging
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from config import Config
+from prompt_compaction import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w{3,}', re.UNICODE)
+
+
+def _tfidf_matrix(texts: List[str], dim: int) -> np.ndarray:
+    """Строит L2-нормированную TF-IDF матрицу (hashing trick, без словаря)"""
+    rows = []
+    cols = []
+    for row, text in enumerate(texts):
+        for token in TOKEN_RE.findall(text.lower()):
+            rows.append(row)
+            cols.append(zlib.crc32(token.encode('utf-8')) % dim)
+
+    counts = np.zeros((len(texts), dim), dtype=np.float32)
+    if rows:
+        np.add.at(counts, (np.asarray(rows), np.asarray(cols)), 1.0)
+
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1.0 + len(texts)) / (1.0 + document_frequency)) + 1.0
+    matrix = np.log1p(counts) * idf.astype(np.float32)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def rank_texts(texts: List[str], dim: int = 1024, damping: float = 0.85,
+               iterations: int = 30) -> List[float]:
+    """
+    TextRank-оценки для текстов
+
+    Граф сходства W = X·Xᵀ (косинусная близость) не материализуется:
+    произведение W·v считается как X·(Xᵀ·v), поэтому память и время
+    линейны по числу сообщений. Функция выполняется в пуле процессов.
+    """
+    count = len(texts)
+    if count == 0:
+        return []
+
+    matrix = _tfidf_matrix(texts, dim)
+    self_similarity = np.einsum('ij,ij->i', matrix, matrix)
+
+    def similarity_dot(vector: np.ndarray) -> np.ndarray:
+        return matrix @ (matrix.T @ vector) - self_similarity * vector
+
+    degree = similarity_dot(np.ones(count, dtype=np.float32))
+    degree[degree <= 0] = 1.0
+
+    scores = np.full(count, 1.0 / count, dtype=np.float32)
+    for _ in range(iterations):
+        updated = (1.0 - damping) / count + damping * similarity_dot(scores / degree)
+        if np.abs(updated - scores).sum() < 1e-6:
+            scores = updated
+            break
+        scores = updated
+
+    return scores.tolist()
+
+
+def select_ranked_messages(messages: List[Dict[str, Any]], scores: List[float],
+                           token_budget: int, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Отбирает лучшие сообщения в пределах бюджета, сохраняя хронологический порядок"""
+    order = sorted(range(len(messages)), key=lambda i: scores[i], reverse=True)
+    selected = []
+    used_tokens = 0
+
+    for index in order:
+        if top_k is not None and len(selected) >= top_k:
+            break
+        tokens = estimate_tokens(messages[index].get('message', ''))
+        if used_tokens + tokens > token_budget:
+            continue
+        used_tokens += tokens
+        selected.append(index)
+
+    selected.sort()
+    return [{**messages[i], 'rank_score': scores[i]} for i in selected]
+
+
+class ExtractiveSelector:
+    """Отбор самых информативных сообщений канала в пуле процессов"""
+
+    def __init__(self, enabled: bool = True, min_messages: int = 150, top_k: int = 150,
+                 token_budget: int = 6000, workers: int = 2):
+        self.enabled = enabled
+        self.min_messages = min_messages
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_config(cls) -> 'ExtractiveSelector':
+        """Создает селектор с настройками из Config"""
+        return cls(
+            enabled=Config.EXTRACTIVE_ENABLED,
+            min_messages=Config.EXTRACTIVE_MIN_MESSAGES,
+            top_k=Config.EXTRACTIVE_TOP_K,
+            token_budget=Config.EXTRACTIVE_TOKEN_BUDGET,
+            workers=Config.EXTRACTIVE_WORKERS,
+        )
+
+    async def select(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Возвращает отобранные сообщения канала (или исходные, если их немного)"""
+        if not self.enabled or len(messages) <= self.min_messages:
+            return messages
+
+        texts = [msg.get('message', '') for msg in messages]
+        try:
+            scores = await self.run_in_pool(rank_texts, texts)
+        except Exception as e:
+            logger.error(f"❌ Ошибка экстрактивного ранжирования: {e}")
+            return messages
+
+        selected = select_ranked_messages(messages, scores, self.token_budget, self.top_k)
+        logger.info(f"🧮 Экстрактивный отбор: {len(messages)} → {len(selected)} сообщений")
+        return selected
+
+    async def run_in_pool(self, func, *args):
+        """Выполняет CPU-задачу в пуле процессов, не блокируя цикл событий"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, func, *args)
+
+    def shutdown(self):
+        """Останавливает пул процессов"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,28 +1,126 @@
+import asyncio
+import io
 import logging
 import re
-from typing import List, Dict, Any
-from openai import AsyncOpenAI
+import time
+from typing import List, Dict, Any, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError
 from config import Config
+from llm_endpoints import HedgePolicy, LLMEndpoint, LLMEndpointPool, LLMHealth, parse_list_setting
+from prompt_compaction import PromptCompactor, tokens_for_length
+from digest_budget import allocate_token_budget, select_messages_within_budget
+from channel_stats import compute_channel_stats, format_stats_table
+from usage_tracker import LLMQuotaExceeded, UsageTracker
+from model_router import INTERACTIVE, SCHEDULED, ModelRouter, estimate_prompt_tokens
 
 logger = logging.getLogger(__name__)
 
+# Ошибки, при которых запрос повторяется на другом эндпоинте
+FAILOVER_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError)
+
 class LLMClient:
     """Клиент для работы с корпоративной LLM"""
     
-    def __init__(self):
-        self.base_url = Config.LLM_BASE_URL.rstrip('/')
-        self.model = Config.LLM_MODEL
-        self.client = AsyncOpenAI(
-            api_key=Config.LLM_PROXY_TOKEN,
-            base_url=self.base_url,
+    def __init__(self, usage_tracker: Optional[UsageTracker] = None):
+        base_urls = parse_list_setting(Config.LLM_BASE_URLS) or [Config.LLM_BASE_URL]
+        models = parse_list_setting(Config.LLM_MODELS) or [Config.LLM_MODEL]
+        self.pool = self._build_pool(
+            [url.rstrip('/') for url in base_urls],
+            models
+        )
+        
+        # Основной эндпоинт (для обратной совместимости и логов)
+        primary = self.pool.endpoints[0]
+        self.base_url = primary.base_url
+        self.model = primary.model
+        self.client = primary.client
+        
+        self.hedge_policy = None
+        if Config.LLM_HEDGE_ENABLED:
+            self.hedge_policy = HedgePolicy(
+                percentile=Config.LLM_HEDGE_PERCENTILE,
+                min_delay=Config.LLM_HEDGE_MIN_DELAY,
+                max_ratio=Config.LLM_HEDGE_MAX_RATIO,
+            )
+        
+        self.compactor = PromptCompactor.from_config()
+        self.usage_tracker = usage_tracker
+        self.router = ModelRouter.from_config()
+        
+        # Состояние LLM по реальному трафику и фоновым пробам (без запросов на каждый health check)
+        self.health = LLMHealth(
+            max_error_rate=Config.LLM_HEALTH_MAX_ERROR_RATE,
+            stale_after=Config.LLM_HEALTH_PROBE_INTERVAL * 3,
+        )
+        self._probe_task: Optional[asyncio.Task] = None
+        self._transport_stats_warned = False
+    
+    @staticmethod
+    def _build_http_client() -> httpx.AsyncClient:
+        """HTTP-транспорт реплики: лимиты пула, keep-alive, таймауты и HTTP/2"""
+        http2 = Config.LLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("⚠️ LLM_HTTP2=true, но пакет h2 не установлен - используется HTTP/1.1")
+                http2 = False
+        
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=Config.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                Config.LLM_READ_TIMEOUT,
+                connect=Config.LLM_CONNECT_TIMEOUT,
+            ),
+            http2=http2,
+        )
+    
+    def _build_pool(self, base_urls: List[str], models: List[str]) -> LLMEndpointPool:
+        """Создает пул эндпоинтов: каждая реплика x каждый алиас модели"""
+        multiple = len(base_urls) * len(models) > 1
+        endpoints = []
+        self.http_clients: Dict[str, httpx.AsyncClient] = {}
+        
+        for base_url in base_urls:
+            # Один клиент (и пул соединений) на реплику
+            http_client = self._build_http_client()
+            self.http_clients[base_url] = http_client
+            client = AsyncOpenAI(
+                api_key=Config.LLM_PROXY_TOKEN,
+                base_url=base_url,
+                http_client=http_client,
+                timeout=http_client.timeout,
+                # При нескольких эндпоинтах повторяем запрос на другой реплике, а не на той же
+                max_retries=0 if multiple else 2,
+            )
+            for model in models:
+                endpoints.append(LLMEndpoint(base_url, model, client))
+        
+        if multiple:
+            logger.info(
+                f"🔀 Балансировка LLM ({Config.LLM_BALANCING_STRATEGY}) между {len(endpoints)} эндпоинтами"
+            )
+        
+        return LLMEndpointPool(
+            endpoints,
+            strategy=Config.LLM_BALANCING_STRATEGY,
+            eject_failures=Config.LLM_EJECT_FAILURES,
+            eject_seconds=Config.LLM_EJECT_SECONDS,
         )
     
-    async def generate_thread_summary(self, messages: List[Dict[str, Any]]) -> str:
+    async def generate_thread_summary(self, messages: List[Dict[str, Any]],
+                                      usage_context: Optional[Dict[str, Any]] = None) -> str:
         """
         Генерирует саммари треда на основе сообщений
         
         Args:
             messages: Список сообщений треда с полями username, message, create_at
+            usage_context: Кто и зачем делает запрос (user_id, channel_id, subscription_id, command)
             
         Returns:
             Краткое саммари треда
@@ -64,22 +162,26 @@ class LLMClient:
                 },
             ]
 
-            response = await self._send_chat_completion(messages_payload)
+            response = await self._send_chat_completion(messages_payload, usage_context)
             if response:
                 return response
             else:
                 return "❌ Не удалось создать саммари. Попробуйте позже."
             
+        except LLMQuotaExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка при генерации саммари: {e}")
             return "❌ Не удалось создать саммари. Попробуйте позже."
     
-    async def generate_channel_summary(self, messages: List[Dict[str, Any]]) -> str:
+    async def generate_channel_summary(self, messages: List[Dict[str, Any]],
+                                       usage_context: Optional[Dict[str, Any]] = None) -> str:
         """
         Генерирует саммари канала на основе сообщений за определенный период
         
         Args:
             messages: Список сообщений канала с полями username, message, create_at
+            usage_context: Кто и зачем делает запрос (user_id, channel_id, subscription_id, command)
             
         Returns:
             Краткое саммари канала
@@ -113,7 +215,8 @@ class LLMClient:
 **🎯 Общий итог:**
 [краткий общий вывод о активности в канале]
 
-Пиши кратко, по существу, на русском языке. Группируй похожие темы."""
+Пиши кратко, по существу, на русском языке. Группируй похожие темы.
+Участников, ссылки и файлы бери из блока СТАТИСТИКА, если он есть, - не пересчитывай сообщения."""
 
             messages_payload = [
                 {"role": "system", "content": "/no_think"},
@@ -125,13 +228,15 @@ class LLMClient:
             ]
             
             # Отправляем запрос к LLM
-            response = await self._send_chat_completion(messages_payload)
+            response = await self._send_chat_completion(messages_payload, usage_context)
             
             if response:
                 return response.strip()
             else:
                 return "❌ Не удалось создать саммари канала. Попробуйте позже."
                 
+        except LLMQuotaExceeded:
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка генерации саммари канала: {e}")
             return "❌ Не удалось создать саммари канала. Попробуйте позже."
@@ -186,16 +291,160 @@ class LLMClient:
 
         return ""
 
-    async def _send_chat_completion(self, messages: List[Dict[str, str]]) -> str:
-        """Отправляет запрос в LiteLLM через OpenAI chat.completions."""
+    async def _create_completion(self, messages: List[Dict[str, str]],
+                                 model: Optional[str] = None) -> Tuple[Any, LLMEndpoint]:
+        """
+        Выполняет chat.completions с балансировкой и, если включено, дублированием
+        
+        model переопределяет модель эндпоинта (см. ModelRouter).
+        
+        Если ответ не пришел за порог (перцентиль недавних задержек), тот же запрос
+        отправляется на другой эндпоинт; побеждает первый ответ, второй запрос отменяется.
+        
+        Запросы не потоковые, поэтому задержка - время до полного ответа, а не до
+        первого байта. В окно попадает задержка основного запроса, даже если
+        победил дубль: отмененный основной запрос учитывается прошедшим временем
+        (нижняя оценка), иначе медленный хвост выпадал бы из окна и порог падал.
+        """
+        policy = self.hedge_policy
+        if policy is None:
+            return await self._create_completion_with_failover(messages, model=model)
+        
+        policy.on_request()
+        started = time.monotonic()
+        primary_endpoints: List[LLMEndpoint] = []
+        primary = asyncio.create_task(
+            self._create_completion_with_failover(messages, attempted=primary_endpoints, model=model)
+        )
+        tasks = {primary}
+        
         try:
-            logger.info(f"📡 Отправляю запрос к LLM: {self.base_url}")
-            logger.info(f"🤖 Модель: {self.model}")
+            delay = policy.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and policy.try_hedge():
+                    logger.info(f"⏱️ Ответ LLM дольше {delay:.1f}с, отправляю дублирующий запрос")
+                    tasks.add(asyncio.create_task(
+                        self._create_completion_with_failover(messages, avoid=primary_endpoints, model=model)
+                    ))
+            
+            last_error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    if task is primary:
+                        policy.latencies.add(time.monotonic() - started)
+                    else:
+                        policy.hedges_won += 1
+                    return task.result()
+            raise last_error
+        finally:
+            if primary in tasks:
+                policy.latencies.add(time.monotonic() - started)
+            # Проигравший запрос отменяем, эндпоинт освобождается в обработчике отмены
+            for task in tasks:
+                task.cancel()
+    
+    async def _create_completion_with_failover(self, messages: List[Dict[str, str]],
+                                               attempted: Optional[List[LLMEndpoint]] = None,
+                                               avoid: List[LLMEndpoint] = (),
+                                               model: Optional[str] = None) -> Tuple[Any, LLMEndpoint]:
+        """
+        Выполняет chat.completions на выбранном пулом эндпоинте
+        
+        При ошибках соединения, таймаутах и 5xx запрос переносится на следующий
+        эндпоинт; неудачный эндпоинт получает отметку об ошибке. Эндпоинты из avoid
+        используются, только если других не осталось.
+        """
+        if attempted is None:
+            attempted = []
+        last_error: Optional[Exception] = None
+        
+        while True:
+            endpoint = (self.pool.acquire(exclude=attempted + list(avoid), model=model)
+                        or self.pool.acquire(exclude=attempted, model=model))
+            if endpoint is None:
+                break
+            attempted.append(endpoint)
+            request_model = model or endpoint.model
+            
+            logger.info(f"📡 Отправляю запрос к LLM: {endpoint.base_url}")
+            logger.info(f"🤖 Модель: {request_model}")
+            
+            started = time.monotonic()
+            try:
+                response = await endpoint.client.chat.completions.create(
+                    model=request_model,
+                    messages=messages,
+                )
+            except FAILOVER_ERRORS as e:
+                self.pool.release(endpoint, time.monotonic() - started, failed=True)
+                logger.warning(f"⚠️ LLM-эндпоинт {endpoint.name} не ответил: {e}")
+                last_error = e
+                continue
+            except BaseException:
+                self.pool.release(endpoint)
+                raise
+            
+            self.pool.release(endpoint, time.monotonic() - started)
+            return response, endpoint
+        
+        raise last_error or RuntimeError("Нет доступных LLM-эндпоинтов")
 
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-            )
+    def _record_usage(self, usage_context: Optional[Dict[str, Any]], response: Any,
+                      endpoint: Optional[LLMEndpoint], latency: float, success: bool = True,
+                      model: Optional[str] = None):
+        """
+        Передает токены и задержку запроса в учет (если он подключен)
+        
+        Если в usage_context есть счетчик spent_tokens, к нему добавляются токены
+        запроса: так общая работа волны узнает, сколько отнести на подписчиков.
+        """
+        if self.usage_tracker is None:
+            return
+        total_tokens = self.usage_tracker.record(
+            usage_context,
+            model=model or (endpoint.model if endpoint else self.model),
+            endpoint=endpoint.base_url if endpoint else '',
+            usage=getattr(response, 'usage', None),
+            latency=latency,
+            success=success,
+        )
+        if usage_context and 'spent_tokens' in usage_context:
+            usage_context['spent_tokens'] += total_tokens
+
+    async def _send_chat_completion(self, messages: List[Dict[str, str]],
+                                    usage_context: Optional[Dict[str, Any]] = None,
+                                    kind: str = INTERACTIVE) -> str:
+        """
+        Отправляет запрос в LiteLLM через OpenAI chat.completions.
+        
+        Модель выбирается ModelRouter по оценке размера промпта и типу запроса
+        (interactive/scheduled). Дневной лимит пользователя проверяется до отправки:
+        LLMQuotaExceeded пробрасывается вызывающему коду, остальные ошибки дают пустой ответ.
+        """
+        if self.usage_tracker is not None and usage_context:
+            await self.usage_tracker.check_quota(usage_context.get('user_id'))
+        
+        estimated_tokens = estimate_prompt_tokens(messages)
+        tier, model = self.router.route(estimated_tokens, kind)
+        
+        started = time.monotonic()
+        try:
+            response, endpoint = await self._create_completion(messages, model=model)
+            latency = time.monotonic() - started
+            self.health.record_success(latency)
+            self._record_usage(usage_context, response, endpoint, latency, model=model)
+            if self.router.enabled:
+                self.router.record(tier, model or endpoint.model, estimated_tokens, latency)
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                logger.info(
+                    f"🔢 Токены: {usage.prompt_tokens} + {usage.completion_tokens} = {usage.total_tokens}"
+                )
 
             content = self._extract_content_from_completion(response)
             if not content:
@@ -210,10 +459,22 @@ class LLMClient:
 
         except Exception as e:
             logger.error(f"❌ Ошибка при запросе к LLM: {str(e)}")
+            latency = time.monotonic() - started
+            self.health.record_failure(e)
+            self._record_usage(usage_context, None, None, latency, success=False, model=model)
+            if self.router.enabled:
+                self.router.record(tier, model or self.model, estimated_tokens, latency, success=False)
             return ""
     
+    @staticmethod
+    def _duplicate_suffix(msg: Dict[str, Any]) -> str:
+        """Счетчик схлопнутых почти одинаковых сообщений, например ' (×143)'"""
+        count = msg.get('duplicate_count', 1)
+        return f" (×{count})" if count > 1 else ""
+    
     def _format_thread_for_llm(self, messages: List[Dict[str, Any]]) -> str:
         """Форматирует сообщения треда для передачи в LLM"""
+        messages, _ = self.compactor.compact(messages)
         formatted_messages = []
         
         for msg in messages:
@@ -224,13 +485,18 @@ class LLMClient:
             # Убираем лишние символы и форматируем
             clean_message = message.strip()
             if clean_message:
-                formatted_messages.append(f"{username}: {clean_message}")
+                formatted_messages.append(f"{username}: {clean_message}{self._duplicate_suffix(msg)}")
         
         return "\n".join(formatted_messages)
     
     def _format_channel_for_llm(self, messages: List[Dict[str, Any]]) -> str:
         """Форматирует сообщения канала для передачи в LLM"""
         formatted_messages = []
+        if Config.PROMPT_STATS_ENABLED:
+            # Статистика по исходным сообщениям: после сжатия ссылки уже заменены на домены
+            stats = compute_channel_stats(messages)
+            formatted_messages.extend([format_stats_table([{'display_name': 'Канал', 'stats': stats}]), ""])
+        messages, _ = self.compactor.compact(messages)
         
         for msg in messages:
             username = msg.get('username', 'Неизвестный пользователь')
@@ -240,12 +506,13 @@ class LLMClient:
             # Убираем лишние символы и форматируем
             clean_message = message.strip()
             if clean_message:
-                formatted_messages.append(f"{username}: {clean_message}")
+                formatted_messages.append(f"{username}: {clean_message}{self._duplicate_suffix(msg)}")
         
         return "\n".join(formatted_messages)
     
     async def generate_channels_summary(self, messages: List[Dict[str, Any]], 
-                                       channel_summaries: List[Dict], frequency: str) -> str:
+                                       channel_summaries: List[Dict], frequency: str,
+                                       usage_context: Optional[Dict[str, Any]] = None) -> str:
         """
         Генерирует сводку по нескольким каналам
         
@@ -253,6 +520,7 @@ class LLMClient:
             messages: Список всех сообщений из каналов
             channel_summaries: Информация о каналах
             frequency: Частота отправки (daily/weekly)
+            usage_context: Кто и зачем делает запрос (user_id, channel_id, subscription_id, command)
             
         Returns:
             Сводка по каналам
@@ -286,6 +554,7 @@ class LLMClient:
 [общие выводы о активности и тенденциях]
 
 Будь кратким, но информативным. Группируй похожие темы. Указывай канал для важных обсуждений.
+Участников, ссылки и файлы бери из блока СТАТИСТИКА, если он есть, - не пересчитывай сообщения.
 """
             
             user_prompt = f"""Проанализируй активность в каналах {period} и создай сводку:
@@ -298,68 +567,153 @@ class LLMClient:
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ]
-            response = await self._send_chat_completion(messages_payload)
+            response = await self._send_chat_completion(messages_payload, usage_context, kind=SCHEDULED)
             
             if response:
                 return response
             
             return None
             
+        except LLMQuotaExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка генерации сводки каналов: {e}")
             return None
     
+    async def generate_channel_section(self, messages: List[Dict[str, Any]],
+                                       channel_summary: Dict, frequency: str,
+                                       usage_context: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Генерирует раздел дайджеста по одному каналу
+        
+        Разделы общие для подписчиков волны и собираются в персональную сводку
+        compose_digest, поэтому в ответе нет общего заголовка и выводов по всем каналам.
+        
+        Args:
+            messages: Сообщения канала за отрезок окна
+            channel_summary: Информация о канале
+            frequency: Частота отправки (daily/weekly)
+            usage_context: Кто и зачем делает запрос (channel_id, command)
+            
+        Returns:
+            Раздел сводки или None при ошибке
+        """
+        try:
+            channel_context = self._format_channels_for_llm(messages, [channel_summary])
+            
+            period = "за последние 24 часа" if frequency == 'daily' else "за последнюю неделю"
+            
+            system_prompt = f"""Ты - помощник для создания сводок активности в корпоративных каналах.
+
+Твоя задача: проанализировать сообщения одного канала {period} и написать его раздел в общей сводке.
+Раздел вставляется под заголовком с названием канала, поэтому не добавляй свой заголовок,
+название канала и выводы по другим каналам.
+
+Формат ответа:
+**🔥 Обсуждения:**
+[главные темы канала]
+
+**📋 Решения и объявления:**
+[важные вопросы, решения, договоренности]
+
+**🔗 Ссылки и файлы:**
+[только если есть важные]
+
+Пиши кратко, 3-7 пунктов на весь раздел. Пустые пункты пропускай.
+Участников, ссылки и файлы бери из блока СТАТИСТИКА, если он есть, - не пересчитывай сообщения.
+"""
+            
+            user_prompt = f"""Напиши раздел сводки по каналу {channel_summary['display_name']} {period}:
+
+{channel_context}"""
+            
+            messages_payload = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]
+            response = await self._send_chat_completion(messages_payload, usage_context, kind=SCHEDULED)
+            
+            return response or None
+            
+        except LLMQuotaExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка генерации раздела сводки канала: {e}")
+            return None
+    
     def _format_channels_for_llm(self, messages: List[Dict[str, Any]], 
                                 channel_summaries: List[Dict]) -> str:
         """Форматирует сообщения из каналов для передачи в LLM"""
-        # Группируем сообщения по каналам
+        messages, _ = self.compactor.compact(messages)
+        
+        # Группируем сообщения по ID канала (название в подписке может отличаться от имени канала)
         channels_data = {}
         for channel_info in channel_summaries:
-            channel_name = channel_info['channel_name']
-            channels_data[channel_name] = {
+            key = channel_info.get('channel_id') or channel_info['channel_name']
+            channels_data[key] = {
                 'display_name': channel_info['display_name'],
-                'messages': []
+                'activity': channel_info.get('message_count', 0),
+                'items': []
             }
         
-        # Сортируем сообщения по каналам
+        # Стоимость строки "имя: текст (×N)" считаем по длинам частей: строка собирается
+        # только для сообщений, прошедших бюджет, и пишется прямо в буфер промпта
         for msg in messages:
-            channel_name = msg.get('channel_name', 'unknown')
-            if channel_name in channels_data:
-                channels_data[channel_name]['messages'].append(msg)
+            key = msg.get('channel_id') or msg.get('channel_name', 'unknown')
+            if key not in channels_data:
+                continue
+            text_length = len((msg.get('message') or '').strip())
+            if text_length:
+                line_length = (len(msg.get('username', 'Неизвестный пользователь')) + 2 + text_length +
+                               len(self._duplicate_suffix(msg)))
+                channels_data[key]['items'].append((msg, tokens_for_length(line_length) + 1))
         
-        # Форматируем для LLM
-        formatted_channels = []
+        # Делим бюджет между каналами: пропорционально активности, но не меньше минимальной доли
+        budgets = allocate_token_budget(
+            demands={key: sum(cost for _, cost in data['items']) for key, data in channels_data.items()},
+            weights={key: data['activity'] or len(data['items']) for key, data in channels_data.items()},
+            total_budget=Config.DIGEST_TOKEN_BUDGET,
+            floor=Config.DIGEST_CHANNEL_MIN_TOKENS,
+        )
         
-        for channel_name, data in channels_data.items():
-            if data['messages']:
-                formatted_channels.append(f"\n=== КАНАЛ: {data['display_name']} ===")
-                
-                # Сортируем сообщения по времени
-                sorted_messages = sorted(data['messages'], key=lambda x: x.get('create_at', 0))
-                
-                for msg in sorted_messages:
-                    username = msg.get('username', 'Неизвестный пользователь')
-                    message = msg.get('message', '')
-                    
-                    # Убираем лишние символы
-                    clean_message = message.strip()
-                    if clean_message:
-                        formatted_channels.append(f"{username}: {clean_message}")
-                
-                formatted_channels.append("")  # Пустая строка между каналами
+        # Собираем промпт в один буфер, без промежуточных списков строк
+        output = io.StringIO()
+        if Config.PROMPT_STATS_ENABLED and any(info.get('stats') for info in channel_summaries):
+            output.write(format_stats_table(channel_summaries))
+            output.write("\n")
+        for key, data in channels_data.items():
+            if not data['items']:
+                continue
+            selected = select_messages_within_budget(data['items'], budgets[key])
+            
+            output.write(f"\n=== КАНАЛ: {data['display_name']} ===\n")
+            for msg, _ in selected:
+                output.write(msg.get('username', 'Неизвестный пользователь'))
+                output.write(": ")
+                output.write((msg.get('message') or '').strip())
+                output.write(self._duplicate_suffix(msg))
+                output.write("\n")
+            
+            skipped = len(data['items']) - len(selected)
+            if skipped:
+                output.write(f"[пропущено сообщений: {skipped}]\n")
+                logger.info(
+                    f"✂️ Канал {data['display_name']}: {len(selected)} из {len(data['items'])} сообщений "
+                    f"(бюджет ~{budgets[key]} токенов)"
+                )
+            output.write("\n")  # Пустая строка между каналами
         
-        return "\n".join(formatted_channels)
+        return output.getvalue()
     
     async def test_connection(self) -> bool:
         """Тестирует соединение с LLM"""
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "/no_think"},
-                    {"role": "user", "content": "Тест соединения"},
-                ],
-            )
+            started = time.monotonic()
+            response, endpoint = await self._create_completion([
+                {"role": "system", "content": "/no_think"},
+                {"role": "user", "content": "Тест соединения"},
+            ])
+            self._record_usage({'command': 'test_connection'}, response, endpoint, time.monotonic() - started)
             if response:
                 logger.info("✅ LLM соединение успешно")
                 return True
@@ -368,4 +722,120 @@ class LLMClient:
                 
         except Exception as e:
             logger.error(f"Ошибка соединения с LLM: {e}")
-            return False 
\ No newline at end of file
+            return False 
+    
+    async def probe(self, connections: int = 1) -> bool:
+        """
+        Дешевая проверка доступности LLM (список моделей, без генерации)
+        
+        Опрашивается каждая реплика пула; достаточно одного успешного ответа.
+        connections > 1 отправляет параллельные запросы, чтобы заранее открыть
+        (и пройти TLS) несколько соединений пула - прогрев перед первым запросом.
+        В здоровье LLM проба попадает одним исходом: мертвая реплика рядом с
+        живой не должна сдвигать долю ошибок к "нездоров".
+        """
+        clients = {}
+        for endpoint in self.pool.endpoints:
+            clients.setdefault(endpoint.base_url, endpoint.client)
+        
+        async def list_models(base_url: str, client: AsyncOpenAI):
+            """Задержка ответа или ошибка"""
+            started = time.monotonic()
+            try:
+                await client.models.list()
+                return time.monotonic() - started
+            except Exception as e:
+                logger.warning(f"⚠️ Проба LLM {base_url} не прошла: {e}")
+                return e
+        
+        results = await asyncio.gather(*(
+            list_models(base_url, client)
+            for base_url, client in clients.items()
+            for _ in range(max(1, connections))
+        ))
+        
+        latencies = [result for result in results if not isinstance(result, Exception)]
+        if latencies:
+            self.health.record_success(min(latencies))
+        else:
+            self.health.record_failure(results[0])
+        self.health.last_probe_at = time.time()
+        return bool(latencies)
+    
+    async def warm_up(self) -> bool:
+        """Прогрев пула соединений при запуске (LLM_WARMUP_CONNECTIONS на реплику)"""
+        started = time.monotonic()
+        ok = await self.probe(connections=Config.LLM_WARMUP_CONNECTIONS)
+        if ok:
+            logger.info(
+                f"🔥 Прогрев LLM: {self.transport_stats_total()} соединений открыто "
+                f"за {time.monotonic() - started:.2f}с"
+            )
+        return ok
+    
+    def transport_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Состояние пулов HTTP-соединений по репликам
+        
+        httpx не публикует пул транспорта: читаем AsyncHTTPTransport._pool
+        (httpcore.AsyncConnectionPool.connections). Поэтому версия httpx ограничена
+        в requirements.txt, а тест транспорта падает, если атрибуты пропадут.
+        """
+        stats = {}
+        for base_url, http_client in self.http_clients.items():
+            try:
+                connections = list(http_client._transport._pool.connections)
+            except AttributeError as e:
+                if not self._transport_stats_warned:
+                    self._transport_stats_warned = True
+                    logger.warning(f"⚠️ Статистика пула соединений недоступна в httpx {httpx.__version__}: {e}")
+                continue
+            idle = sum(1 for connection in connections if connection.is_idle())
+            stats[base_url] = {
+                'connections': len(connections),
+                'idle': idle,
+                'active': len(connections) - idle,
+            }
+        return stats
+    
+    def transport_stats_total(self) -> int:
+        """Число открытых HTTP-соединений ко всем репликам"""
+        return sum(item['connections'] for item in self.transport_stats().values())
+    
+    def is_healthy(self) -> bool:
+        """Кешированное состояние LLM (без сетевых запросов)"""
+        return self.health.is_healthy()
+    
+    def start_health_probe(self):
+        """Запускает фоновую пробу LLM с интервалом LLM_HEALTH_PROBE_INTERVAL"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._health_probe_loop())
+    
+    def stop_health_probe(self):
+        """Останавливает фоновую пробу"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+    
+    async def aclose(self):
+        """Останавливает пробу и закрывает HTTP-клиенты реплик (соединения пула)"""
+        self.stop_health_probe()
+        results = await asyncio.gather(
+            *(http_client.aclose() for http_client in self.http_clients.values()),
+            return_exceptions=True
+        )
+        for base_url, result in zip(self.http_clients, results):
+            if isinstance(result, Exception):
+                logger.warning(f"⚠️ Не удалось закрыть HTTP-клиент LLM {base_url}: {result}")
+    
+    async def _health_probe_loop(self):
+        while True:
+            await asyncio.sleep(Config.LLM_HEALTH_PROBE_INTERVAL)
+            # Недавний успешный запрос уже подтверждает доступность - проба не нужна
+            last_success = self.health.last_success_at
+            if last_success is not None and time.time() - last_success < Config.LLM_HEALTH_PROBE_INTERVAL:
+                continue
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.error(f"❌ Ошибка фоновой проверки LLM: {e}")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Пул LLM-эндпоинтов: балансировка нагрузки между репликами и пассивное
+исключение неисправных эндпоинтов
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+def parse_list_setting(value: str) -> List[str]:
+    """Разбирает список из переменной окружения (значения через запятую)"""
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+class LLMEndpoint:
+    """Одна реплика LLM (URL + модель) со счетчиками нагрузки и здоровья"""
+
+    def __init__(self, base_url: str, model: str, client: AsyncOpenAI):
+        self.base_url = base_url
+        self.model = model
+        self.client = client
+        self.in_flight = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.base_url} [{self.model}]"
+
+    def is_available(self, now: float) -> bool:
+        """Эндпоинт не исключен из ротации"""
+        return now >= self.ejected_until
+
+    def snapshot(self) -> Dict[str, object]:
+        """Текущее состояние эндпоинта для мониторинга"""
+        return {
+            'base_url': self.base_url,
+            'model': self.model,
+            'in_flight': self.in_flight,
+            'ewma_latency': round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            'consecutive_failures': self.consecutive_failures,
+            'ejected': not self.is_available(time.monotonic()),
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures,
+        }
+
+
+class LLMEndpointPool:
+    """
+    Выбирает эндпоинт для запроса и учитывает результат
+
+    Стратегии:
+        least_requests - минимум запросов в работе, при равенстве - меньшая задержка
+        ewma - минимальная EWMA-задержка с поправкой на текущую нагрузку
+    """
+
+    STRATEGIES = ('least_requests', 'ewma')
+
+    def __init__(self, endpoints: Sequence[LLMEndpoint], strategy: str = 'least_requests',
+                 eject_failures: int = 3, eject_seconds: float = 30.0, ewma_alpha: float = 0.3):
+        if not endpoints:
+            raise ValueError("Пул LLM-эндпоинтов не может быть пустым")
+        if strategy not in self.STRATEGIES:
+            logger.warning(f"⚠️ Неизвестная стратегия балансировки '{strategy}', используется least_requests")
+            strategy = 'least_requests'
+
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.eject_failures = max(1, eject_failures)
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self._rotation = 0
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def acquire(self, exclude: Sequence[LLMEndpoint] = (), model: Optional[str] = None) -> Optional[LLMEndpoint]:
+        """
+        Выбирает эндпоинт и увеличивает счетчик запросов в работе
+        
+        Если указана model, предпочитаются эндпоинты с этой моделью; если таких нет,
+        выбирается любой эндпоинт (модель подставляется в запрос вызывающим кодом).
+        """
+        now = time.monotonic()
+        remaining = [ep for ep in self.endpoints if ep not in exclude]
+        if not remaining:
+            return None
+        
+        if model:
+            remaining = [ep for ep in remaining if ep.model == model] or remaining
+
+        candidates = [ep for ep in remaining if ep.is_available(now)]
+        if not candidates:
+            # Все эндпоинты исключены - пробуем тот, что раньше всех вернется в ротацию
+            candidates = [min(remaining, key=lambda ep: ep.ejected_until)]
+
+        # Сдвигаем порядок обхода, чтобы при равных оценках нагрузка распределялась по кругу
+        self._rotation = (self._rotation + 1) % len(candidates)
+        ordered = candidates[self._rotation:] + candidates[:self._rotation]
+
+        endpoint = min(ordered, key=self._score)
+        endpoint.in_flight += 1
+        endpoint.total_requests += 1
+        return endpoint
+
+    def _score(self, endpoint: LLMEndpoint):
+        latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else 0.0
+        if self.strategy == 'ewma':
+            return (latency * (endpoint.in_flight + 1), endpoint.in_flight)
+        return (endpoint.in_flight, latency)
+
+    def release(self, endpoint: LLMEndpoint, latency: Optional[float] = None, failed: bool = False):
+        """Фиксирует завершение запроса к эндпоинту"""
+        endpoint.in_flight = max(0, endpoint.in_flight - 1)
+
+        if latency is not None:
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * endpoint.ewma_latency
+
+        if failed:
+            endpoint.total_failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.eject_failures:
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                logger.warning(
+                    f"⚠️ LLM-эндпоинт {endpoint.name} исключен из ротации на {self.eject_seconds:.0f}с "
+                    f"после {endpoint.consecutive_failures} ошибок подряд"
+                )
+        else:
+            if endpoint.consecutive_failures and not endpoint.is_available(time.monotonic()):
+                logger.info(f"✅ LLM-эндпоинт {endpoint.name} снова в ротации")
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = 0.0
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """Состояние всех эндпоинтов пула"""
+        return [endpoint.snapshot() for endpoint in self.endpoints]
+
+
+class LatencyWindow:
+    """Скользящее окно последних задержек для расчета перцентилей"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Перцентиль по ближайшему рангу или None, если выборка пуста"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = int(round(percent / 100 * (len(ordered) - 1)))
+        return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+class HedgePolicy:
+    """
+    Решает, когда отправлять дублирующий (hedged) запрос
+
+    Порог ожидания - перцентиль недавних задержек (не ниже min_delay).
+    Доля дублей ограничена бюджетом: каждый запрос добавляет max_ratio
+    токена, каждый дубль расходует один токен.
+    """
+
+    def __init__(self, percentile: float = 95.0, min_delay: float = 2.0, max_ratio: float = 0.1,
+                 min_samples: int = 20, burst: float = 5.0):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.burst = burst
+        self.latencies = LatencyWindow()
+        self._tokens = 0.0
+        self.requests = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def delay(self) -> Optional[float]:
+        """Сколько ждать ответа перед отправкой дубля (None - статистики пока мало)"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        threshold = self.latencies.percentile(self.percentile)
+        return max(self.min_delay, threshold or 0.0)
+
+    def on_request(self):
+        """Учитывает новый запрос и пополняет бюджет дублей"""
+        self.requests += 1
+        self._tokens = min(self.burst, self._tokens + self.max_ratio)
+
+    def try_hedge(self) -> bool:
+        """Расходует токен бюджета, если он есть"""
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        self.hedges_sent += 1
+        return True
+
+    def snapshot(self) -> Dict[str, object]:
+        """Статистика дублирования запросов"""
+        delay = self.delay()
+        return {
+            'requests': self.requests,
+            'hedges_sent': self.hedges_sent,
+            'hedges_won': self.hedges_won,
+            'threshold_seconds': round(delay, 3) if delay is not None else None,
+        }
+
+
+class LLMHealth:
+    """
+    Пассивное состояние LLM по реальным запросам и редким фоновым пробам
+
+    LLM считается доступной, если был успешный ответ не раньше stale_after
+    секунд назад и EWMA доли ошибок ниже max_error_rate.
+    """
+
+    def __init__(self, max_error_rate: float = 0.5, stale_after: float = 900.0, ewma_alpha: float = 0.3):
+        self.max_error_rate = max_error_rate
+        self.stale_after = stale_after
+        self.ewma_alpha = ewma_alpha
+        self.error_rate = 0.0
+        self.ewma_latency: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+        self.last_error_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_probe_at: Optional[float] = None
+
+    def _update_error_rate(self, failed: bool):
+        self.error_rate = self.ewma_alpha * (1.0 if failed else 0.0) + (1 - self.ewma_alpha) * self.error_rate
+
+    def record_success(self, latency: Optional[float] = None):
+        """Учитывает успешный ответ LLM"""
+        self.last_success_at = time.time()
+        self._update_error_rate(False)
+        if latency is not None:
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * self.ewma_latency
+
+    def record_failure(self, error: BaseException):
+        """Учитывает ошибку запроса к LLM"""
+        self.last_error_at = time.time()
+        self.last_error = str(error)[:200]
+        self._update_error_rate(True)
+
+    def is_healthy(self) -> bool:
+        if self.last_success_at is None:
+            return False
+        if time.time() - self.last_success_at > self.stale_after:
+            return False
+        return self.error_rate < self.max_error_rate
+
+    def snapshot(self) -> Dict[str, object]:
+        """Кешированное состояние для health_check и метрик"""
+        now = time.time()
+
+        def ago(timestamp: Optional[float]) -> Optional[float]:
+            return round(now - timestamp, 1) if timestamp is not None else None
+
+        return {
+            'healthy': self.is_healthy(),
+            'error_rate': round(self.error_rate, 3),
+            'ewma_latency': round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            'last_success_seconds_ago': ago(self.last_success_at),
+            'last_error_seconds_ago': ago(self.last_error_at),
+            'last_error': self.last_error,
+            'last_probe_seconds_ago': ago(self.last_probe_at),
+        }
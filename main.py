@@ -43,7 +43,7 @@ class BotApplication:
                 return False
             
             # Создаем веб-приложение с ботом
-            self.web_app = create_app(self.bot)
+            self.web_app = create_app(self.bot, self.scheduler)
             
             # Запускаем планировщик подписок
             await self.scheduler.start()
@@ -145,7 +145,20 @@ class BotApplication:
                     pass
                 except Exception as e:
                     logger.error(f"❌ Ошибка при отмене задачи {task.get_name()}: {e}")
-        
+
+        # Задачи отменены - соединения с LLM больше не нужны
+        try:
+            await self.bot.llm_client.aclose()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при закрытии клиента LLM: {e}")
+
+        # Закрываем базы: фоновые записи дописываются до закрытия соединений
+        try:
+            await asyncio.to_thread(self.bot.subscription_manager.close)
+            await asyncio.to_thread(self.bot.usage_tracker.close)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при закрытии баз данных: {e}")
+
         logger.info("✅ Корректное завершение работы завершено")
 
 async def main():
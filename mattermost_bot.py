@@ -18,6 +18,7 @@ from urllib.parse import urlparse
 from config import Config
 from llm_client import LLMClient
 from subscription_manager import SubscriptionManager
+from usage_tracker import LLMQuotaExceeded, UsageTracker
 
 logger = logging.getLogger(__name__)
 
@@ -32,11 +33,16 @@ class MattermostBot:
         self.token = None
         self.bot_user_id = None
         self.bot_username = None
-        self.llm_client = LLMClient()
+        self.usage_tracker = UsageTracker(daily_quota=Config.LLM_USER_DAILY_TOKEN_QUOTA)
+        self.llm_client = LLMClient(usage_tracker=self.usage_tracker)
         self.subscription_manager = SubscriptionManager()
         self._running = False
         self._websocket = None
         self._session_requests = requests.Session()
+        # Подписки выполняются параллельно - пул соединений не меньше лимита планировщика
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, Config.SCHEDULER_CONCURRENCY))
+        self._session_requests.mount('http://', adapter)
+        self._session_requests.mount('https://', adapter)
         
         # Состояния пользователей для обработки команд
         self._user_states = {}
@@ -89,12 +95,16 @@ class MattermostBot:
             # Получаем список каналов, в которых уже находится бот
             await self._load_existing_channels()
             
-            # Тестируем соединение с LLM
-            llm_ok = await self.llm_client.test_connection()
+            # Проверяем доступность LLM (без генерации), прогреваем соединения и запускаем фоновую пробу
+            if Config.LLM_WARMUP_ENABLED:
+                llm_ok = await self.llm_client.warm_up()
+            else:
+                llm_ok = await self.llm_client.probe()
             if llm_ok:
                 logger.info("✅ Соединение с LLM установлено")
             else:
                 logger.warning("⚠️ Проблемы с соединением с LLM")
+            self.llm_client.start_health_probe()
             
             return True
             
@@ -314,6 +324,8 @@ class MattermostBot:
                 await self._handle_user_added_event(event)
             elif event_type == 'channel_member_added':
                 await self._handle_channel_member_added_event(event)
+            elif event_type in ('channel_deleted', 'channel_updated', 'user_removed'):
+                await self._handle_channel_change_event(event)
             elif event_type == 'hello':
                 logger.debug("💬 Получен hello от WebSocket")
             else:
@@ -362,7 +374,7 @@ class MattermostBot:
             # Логируем только команды саммари в каналах
             if self._is_summary_command(message):
                 logger.info(f"📝 Получена команда /summary в канале {channel_id}")
-                await self._handle_summary_command(channel_id, root_id, post_id)
+                await self._handle_summary_command(channel_id, root_id, post_id, user_id)
                 
         except Exception as e:
             logger.error(f"❌ Ошибка обработки события поста: {e}")
@@ -397,6 +409,33 @@ class MattermostBot:
         except Exception as e:
             logger.error(f"❌ Ошибка обработки события channel_member_added: {e}")
     
+    async def _handle_channel_change_event(self, event: Dict[str, Any]):
+        """Удаление и переименование каналов, исключение бота из канала - обновляем каналы подписок"""
+        try:
+            event_type = event.get('event')
+            data = event.get('data', {})
+            broadcast = event.get('broadcast', {})
+            
+            if event_type == 'channel_updated':
+                channel = json.loads(data.get('channel') or '{}')
+                if channel.get('id') and channel.get('display_name'):
+                    updated = await self.subscription_manager.rename_channel(channel['id'], channel['display_name'])
+                    if updated:
+                        logger.info(f"✏️ Канал {channel['id']} переименован в подписках: {channel['display_name']}")
+                return
+            
+            channel_id = data.get('channel_id') or broadcast.get('channel_id')
+            if event_type == 'user_removed' and (data.get('user_id') or broadcast.get('user_id')) != self.bot_user_id:
+                return
+            if channel_id:
+                forgotten = await self.subscription_manager.forget_channel(channel_id)
+                if forgotten:
+                    logger.info(f"🔄 Канал {channel_id} недоступен ({event_type}), "
+                                f"подписок затронуто: {forgotten}")
+                
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки события {event.get('event')}: {e}")
+    
     async def _initialize_in_channel(self, channel_id: str):
         """Инициализация бота в новом канале"""
         try:
@@ -500,9 +539,9 @@ class MattermostBot:
             if self._is_help_command(cleaned_message):
                 await self._send_bot_help(channel_id, root_id)
             elif self._is_thread_summary_command(cleaned_message):
-                await self._handle_thread_summary_by_id(channel_id, cleaned_message, root_id)
+                await self._handle_thread_summary_by_id(channel_id, cleaned_message, root_id, user_id)
             elif self._is_channel_summary_command(cleaned_message):
-                await self._handle_channel_summary_command(channel_id, cleaned_message, root_id)
+                await self._handle_channel_summary_command(channel_id, cleaned_message, root_id, user_id)
             elif self._is_search_command(cleaned_message):
                 await self._handle_search_command(channel_id, cleaned_message, root_id)
             else:
@@ -554,7 +593,8 @@ class MattermostBot:
         help_keywords = ['help', 'справка', 'помощь', 'команды']
         return not message_lower or any(keyword in message_lower for keyword in help_keywords)
     
-    async def _handle_thread_summary_by_id(self, channel_id: str, message: str, root_id: str):
+    async def _handle_thread_summary_by_id(self, channel_id: str, message: str, root_id: str,
+                                          user_id: Optional[str] = None):
         """Обработка команды саммари треда по ID"""
         try:
             # Извлекаем ID треда из сообщения
@@ -597,7 +637,10 @@ class MattermostBot:
                 return
             
             # Генерируем саммари
-            summary = await self.llm_client.generate_thread_summary(thread_messages)
+            summary = await self.llm_client.generate_thread_summary(
+                thread_messages,
+                usage_context={'user_id': user_id, 'channel_id': channel_id, 'command': 'thread_summary'}
+            )
             
             if summary:
                 await self._send_message(
@@ -612,6 +655,8 @@ class MattermostBot:
                     root_id=root_id
                 )
                 
+        except LLMQuotaExceeded as e:
+            await self._send_quota_exceeded_message(channel_id, e, root_id)
         except Exception as e:
             logger.error(f"❌ Ошибка обработки саммари треда по ID: {e}")
             await self._send_message(
@@ -620,7 +665,8 @@ class MattermostBot:
                 root_id=root_id
             )
     
-    async def _handle_channel_summary_command(self, channel_id: str, message: str, root_id: str):
+    async def _handle_channel_summary_command(self, channel_id: str, message: str, root_id: str,
+                                              user_id: Optional[str] = None):
         """Обработка команды саммари канала"""
         try:
             await self._send_message(
@@ -653,7 +699,10 @@ class MattermostBot:
                 return
             
             # Генерируем саммари канала
-            summary = await self.llm_client.generate_channel_summary(channel_messages)
+            summary = await self.llm_client.generate_channel_summary(
+                channel_messages,
+                usage_context={'user_id': user_id, 'channel_id': channel_id, 'command': 'channel_summary'}
+            )
             
             if summary:
                 period_text = self._format_period_text(hours)
@@ -669,6 +718,8 @@ class MattermostBot:
                     root_id=root_id
                 )
                 
+        except LLMQuotaExceeded as e:
+            await self._send_quota_exceeded_message(channel_id, e, root_id)
         except Exception as e:
             logger.error(f"❌ Ошибка обработки саммари канала: {e}")
             await self._send_message(
@@ -905,7 +956,9 @@ class MattermostBot:
                         'username': username,
                         'message': post.get('message', ''),
                         'create_at': post.get('create_at', 0),
-                        'user_id': user_id
+                        'user_id': user_id,
+                        'from_bot': self._is_bot_post(post),
+                        'files': self._post_file_names(post)
                     })
             
             # Сортируем по времени
@@ -917,7 +970,8 @@ class MattermostBot:
             logger.error(f"❌ Ошибка получения сообщений канала за период: {e}")
             return []
     
-    async def _handle_summary_command(self, channel_id: str, thread_id: str, message_id: str):
+    async def _handle_summary_command(self, channel_id: str, thread_id: str, message_id: str,
+                                      user_id: Optional[str] = None):
         """Обработка команды создания саммари"""
         try:
             # Проверяем разрешения в канале
@@ -955,7 +1009,10 @@ class MattermostBot:
             logger.info(f"📊 Обрабатываю {len(thread_messages)} сообщений в треде")
             
             # Генерируем саммари
-            summary = await self.llm_client.generate_thread_summary(thread_messages)
+            summary = await self.llm_client.generate_thread_summary(
+                thread_messages,
+                usage_context={'user_id': user_id, 'channel_id': channel_id, 'command': 'summary'}
+            )
             
             if summary:
                 # Отправляем саммари
@@ -968,6 +1025,8 @@ class MattermostBot:
                     root_id=thread_id
                 )
             
+        except LLMQuotaExceeded as e:
+            await self._send_quota_exceeded_message(channel_id, e, thread_id)
         except Exception as e:
             logger.error(f"❌ Ошибка при создании саммари: {e}")
             try:
@@ -980,6 +1039,14 @@ class MattermostBot:
                 # Если даже отправка сообщения об ошибке не удалась
                 logger.error("❌ Критическая ошибка: не удалось отправить сообщение об ошибке")
     
+    async def _send_quota_exceeded_message(self, channel_id: str, error: LLMQuotaExceeded, root_id: str):
+        """Сообщает пользователю об исчерпанном дневном лимите токенов"""
+        await self._send_message(
+            channel_id,
+            f"⛔ Дневной лимит токенов исчерпан ({error.used}/{error.quota}). Попробуйте завтра.",
+            root_id=root_id
+        )
+    
     async def _get_thread_messages(self, thread_id: str) -> List[Dict[str, Any]]:
         """Получает все сообщения треда"""
         try:
@@ -1048,7 +1115,9 @@ class MattermostBot:
                     'username': username,
                     'message': post.get('message', ''),
                     'create_at': post.get('create_at', 0),
-                    'user_id': user_id
+                    'user_id': user_id,
+                    'from_bot': self._is_bot_post(post),
+                    'files': self._post_file_names(post)
                 })
             
             return messages
@@ -1057,6 +1126,22 @@ class MattermostBot:
             logger.error(f"❌ Ошибка получения сообщений треда: {e}")
             return []
     
+    def _is_bot_post(self, post: Dict[str, Any]) -> bool:
+        """
+        Проверяет, что пост создан самим ботом (его сводки и ответы)
+        
+        Посты интеграций и вебхуков (алерты, CI) - содержимое канала, они остаются в промпте.
+        """
+        return bool(self.bot_user_id) and post.get('user_id') == self.bot_user_id
+    
+    @staticmethod
+    def _post_file_names(post: Dict[str, Any]) -> List[str]:
+        """Имена вложений поста (или их ID, если метаданные не пришли)"""
+        files = (post.get('metadata') or {}).get('files') or []
+        if files:
+            return [file_info.get('name', file_info.get('id', '')) for file_info in files]
+        return list(post.get('file_ids') or [])
+    
     async def _send_message(self, channel_id: str, message: str, root_id: Optional[str] = None) -> bool:
         """Отправляет сообщение в канал"""
         try:
@@ -1089,6 +1174,7 @@ class MattermostBot:
         """Остановка бота"""
         logger.info("🛑 Остановка бота...")
         self._running = False
+        self.llm_client.stop_health_probe()
         
         if self._websocket:
             try:
@@ -1129,11 +1215,9 @@ class MattermostBot:
         except:
             status['mattermost_connected'] = False
         
-        # Проверяем соединение с LLM
-        try:
-            status['llm_connected'] = await self.llm_client.test_connection()
-        except:
-            status['llm_connected'] = False
+        # Состояние LLM берем из кеша: его обновляют реальные запросы и фоновая проба
+        status['llm_connected'] = self.llm_client.is_healthy()
+        status['llm_health'] = self.llm_client.health.snapshot()
         
         return status
     
@@ -1210,36 +1294,59 @@ class MattermostBot:
         try:
             # Конвертируем время в миллисекунды (формат Mattermost)
             since_timestamp = int(since_time.timestamp() * 1000)
-            
-            # Получаем сообщения из канала
-            response = await self._http_get(
-                f"{self.base_url}/api/v4/channels/{channel_id}/posts",
-                params={
-                    'since': since_timestamp,
-                    'per_page': 200  # Максимум сообщений
-                },
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"❌ Ошибка получения сообщений канала {channel_id}: {response.status_code}")
-                return []
-            
-            posts_data = response.json()
-            posts = posts_data.get('posts', {})
-            order = posts_data.get('order', [])
+            per_page = 200
+            
+            # Название канала получаем один раз на весь запрос
+            channel_name = 'unknown'
+            channel_data = await self._get_channel_info(channel_id)
+            if channel_data:
+                channel_name = channel_data.get('name', 'unknown')
+            
+            # Листаем историю от новых к старым, пока не дойдем до начала периода
+            posts = {}
+            order = []
+            for page in range(Config.MATTERMOST_MAX_HISTORY_PAGES):
+                response = await self._http_get(
+                    f"{self.base_url}/api/v4/channels/{channel_id}/posts",
+                    params={
+                        'page': page,
+                        'per_page': per_page
+                    },
+                    timeout=30
+                )
+                
+                if response.status_code != 200:
+                    logger.error(f"❌ Ошибка получения сообщений канала {channel_id}: {response.status_code}")
+                    if page == 0:
+                        return []
+                    break
+                
+                posts_data = response.json()
+                page_posts = posts_data.get('posts', {})
+                page_order = posts_data.get('order', [])
+                posts.update(page_posts)
+                order.extend(page_order)
+                
+                oldest = min((page_posts[pid].get('create_at', 0) for pid in page_order if pid in page_posts),
+                             default=0)
+                if len(page_order) < per_page or oldest < since_timestamp:
+                    break
+            else:
+                logger.warning(f"⚠️ История канала {channel_id} обрезана до {len(order)} сообщений")
             
             # Кешируем пользователей
             user_cache = {}
             messages = []
+            seen_posts = set()
             
             for post_id in order:
-                if post_id in posts:
+                if post_id in posts and post_id not in seen_posts:
+                    seen_posts.add(post_id)
                     post = posts[post_id]
                     user_id = post.get('user_id')
                     
-                    # Пропускаем сообщения от самого бота
-                    if user_id == self.bot_user_id:
+                    # Пропускаем сообщения от самого бота и вне периода
+                    if user_id == self.bot_user_id or post.get('create_at', 0) < since_timestamp:
                         continue
                     
                     # Получаем имя пользователя (с кешированием)
@@ -1259,25 +1366,15 @@ class MattermostBot:
                     
                     username = user_cache[user_id]
                     
-                    # Получаем информацию о канале для названия
-                    channel_name = None
-                    try:
-                        channel_response = await self._http_get(
-                            f"{self.base_url}/api/v4/channels/{channel_id}",
-                            timeout=5
-                        )
-                        if channel_response.status_code == 200:
-                            channel_data = channel_response.json()
-                            channel_name = channel_data.get('name', 'unknown')
-                    except:
-                        channel_name = 'unknown'
-                    
                     messages.append({
                         'username': username,
                         'message': post.get('message', ''),
                         'create_at': post.get('create_at', 0),
                         'user_id': user_id,
-                        'channel_name': channel_name
+                        'channel_id': channel_id,
+                        'channel_name': channel_name,
+                        'from_bot': self._is_bot_post(post),
+                        'files': self._post_file_names(post)
                     })
             
             # Сортируем по времени создания
@@ -1453,7 +1550,7 @@ class MattermostBot:
     async def _show_subscriptions(self, channel_id: str, user_id: str):
         """Показать текущие подписки пользователя"""
         try:
-            subscriptions = self.subscription_manager.get_user_subscriptions(user_id)
+            subscriptions = await self.subscription_manager.get_user_subscriptions(user_id)
             
             if not subscriptions:
                 message = """
@@ -1572,7 +1669,7 @@ class MattermostBot:
     async def _delete_subscription_dialog(self, channel_id: str, user_id: str):
         """Диалог удаления подписки - показывает список для выбора"""
         try:
-            subscriptions = self.subscription_manager.get_user_subscriptions(user_id)
+            subscriptions = await self.subscription_manager.get_user_subscriptions(user_id)
             
             if not subscriptions:
                 await self._send_message(channel_id, """
@@ -1643,7 +1740,7 @@ class MattermostBot:
                 choice_num = int(message_lower)
                 if 1 <= choice_num <= len(subscriptions):
                     subscription = subscriptions[choice_num - 1]
-                    success = self.subscription_manager.delete_subscription(user_id, subscription['id'])
+                    success = await self.subscription_manager.delete_subscription(user_id, subscription['id'])
                     
                     if success:
                         channels = ", ".join(f"~{ch}" for ch in subscription['channels'])
@@ -1679,7 +1776,7 @@ class MattermostBot:
     async def _delete_all_subscriptions(self, channel_id: str, user_id: str):
         """Удаление всех подписок пользователя"""
         try:
-            success = self.subscription_manager.delete_subscription(user_id)
+            success = await self.subscription_manager.delete_subscription(user_id)
             
             if success:
                 message = """
@@ -1914,6 +2011,7 @@ general,random ~ 09:00 ~ daily
             # Проверяем доступность каналов
             not_found_channels = []
             no_access_channels = []
+            resolved_channels = {}
             
             for channel_name in channels:
                 logger.info(f"🔍 Проверяем канал: {channel_name}")
@@ -1931,6 +2029,7 @@ general,random ~ 09:00 ~ daily
                     no_access_channels.append(channel_name)
                 else:
                     logger.info(f"✅ Доступ к каналу подтвержден: {channel_name}")
+                    resolved_channels[channel_name] = channel_info
             
             # Формируем сообщения об ошибках
             if not_found_channels or no_access_channels:
@@ -1966,8 +2065,9 @@ general,random ~ 09:00 ~ daily
                 user_timezone = "Europe/Moscow"
             
             # Создаем подписку
-            success = self.subscription_manager.create_subscription(
-                user_id, username, channels, time_str, frequency, weekday, user_timezone
+            success = await self.subscription_manager.create_subscription(
+                user_id, username, channels, time_str, frequency, weekday, user_timezone,
+                resolved_channels=resolved_channels
             )
             
             if success:
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Выбор модели LLM по размеру запроса и его типу
+
+Уровни (tiers):
+    fast         - небольшие интерактивные запросы (саммари треда)
+    throughput   - плановые сводки по подпискам
+    long_context - запросы, не помещающиеся в контекст обычной модели
+    default      - модель пула (LLM_MODEL / LLM_MODELS)
+
+Модель уровня, для которого ничего не настроено, берется из default.
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from prompt_compaction import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+SCHEDULED = 'scheduled'
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """Оценка размера промпта chat.completions в токенах"""
+    return sum(estimate_tokens(message.get('content') or '') for message in messages)
+
+
+class ModelRouter:
+    """Политика маршрутизации запросов между моделями и статистика по уровням"""
+
+    def __init__(self, enabled: bool = False, fast_model: str = '', throughput_model: str = '',
+                 long_context_model: str = '', fast_max_tokens: int = 2000,
+                 long_context_min_tokens: int = 24000, ewma_alpha: float = 0.3):
+        self.enabled = enabled
+        self.models = {
+            'fast': fast_model,
+            'throughput': throughput_model,
+            'long_context': long_context_model,
+        }
+        self.fast_max_tokens = fast_max_tokens
+        self.long_context_min_tokens = long_context_min_tokens
+        self.ewma_alpha = ewma_alpha
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_config(cls) -> 'ModelRouter':
+        """Создает маршрутизатор с настройками из Config"""
+        return cls(
+            enabled=Config.LLM_ROUTING_ENABLED,
+            fast_model=Config.LLM_FAST_MODEL,
+            throughput_model=Config.LLM_THROUGHPUT_MODEL,
+            long_context_model=Config.LLM_LONG_CONTEXT_MODEL,
+            fast_max_tokens=Config.LLM_ROUTING_FAST_MAX_TOKENS,
+            long_context_min_tokens=Config.LLM_ROUTING_LONG_CONTEXT_MIN_TOKENS,
+        )
+
+    def route(self, estimated_tokens: int, kind: str = INTERACTIVE) -> Tuple[str, Optional[str]]:
+        """
+        Выбирает уровень для запроса
+
+        Returns:
+            (уровень, модель) - модель None означает модель пула по умолчанию
+        """
+        if not self.enabled:
+            return 'default', None
+
+        if estimated_tokens >= self.long_context_min_tokens:
+            tier = 'long_context'
+        elif kind == SCHEDULED:
+            tier = 'throughput'
+        elif estimated_tokens <= self.fast_max_tokens:
+            tier = 'fast'
+        else:
+            tier = 'default'
+
+        model = self.models.get(tier) or None
+        if model is None:
+            tier = 'default'
+
+        logger.info(f"🧭 Маршрут LLM: ~{estimated_tokens} токенов, {kind} → {tier} ({model or 'модель по умолчанию'})")
+        return tier, model
+
+    def record(self, tier: str, model: str, estimated_tokens: int, latency: float, success: bool = True):
+        """Учитывает результат запроса, отправленного по маршруту"""
+        stats = self._stats.setdefault(tier, {
+            'requests': 0, 'failures': 0, 'prompt_tokens': 0, 'ewma_latency': None,
+        })
+        stats['requests'] += 1
+        stats['prompt_tokens'] += estimated_tokens
+        if not success:
+            stats['failures'] += 1
+        elif stats['ewma_latency'] is None:
+            stats['ewma_latency'] = latency
+        else:
+            stats['ewma_latency'] = self.ewma_alpha * latency + (1 - self.ewma_alpha) * stats['ewma_latency']
+
+        status = "✅" if success else "❌"
+        logger.info(f"🧭 {status} {tier} ({model}): ~{estimated_tokens} токенов за {latency:.2f}с")
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        """Статистика по уровням маршрутизации"""
+        return {
+            tier: {
+                **stats,
+                'ewma_latency': round(stats['ewma_latency'], 3) if stats['ewma_latency'] is not None else None,
+            }
+            for tier, stats in self._stats.items()
+        }
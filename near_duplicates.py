@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Схлопывание почти одинаковых сообщений (MinHash + LSH)
+
+Алерты и CI-уведомления отличаются только числами и идентификаторами,
+поэтому такие сообщения заменяются одним представителем со счетчиком.
+"""
+
+import re
+import zlib
+from typing import List, Dict, Any
+
+import numpy as np
+
+HEX_ID_RE = re.compile(r'\b[0-9a-f]{7,}\b', re.IGNORECASE)
+NUMBER_RE = re.compile(r'\d+')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Простое число больше 2^32: (a * h + b) mod P не переполняет uint64 при a < 2^31
+HASH_PRIME = np.uint64(4294967311)
+
+
+def _normalize(text: str) -> List[str]:
+    """Приводит текст к словам, заменяя числа и хеши на плейсхолдеры"""
+    text = HEX_ID_RE.sub(' HEX ', text.lower())
+    text = NUMBER_RE.sub('0', text)
+    return WORD_RE.findall(text)
+
+
+def _shingle_hashes(text: str, size: int = 3) -> np.ndarray:
+    """Хеши словесных k-грамм сообщения"""
+    words = _normalize(text)
+    if len(words) < size:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.array([zlib.crc32(s.encode('utf-8')) for s in set(shingles)], dtype=np.uint64)
+
+
+def minhash_signatures(texts: List[str], num_perm: int = 64, seed: int = 1) -> np.ndarray:
+    """Матрица MinHash-сигнатур (строка на текст)"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 31, size=num_perm, dtype=np.uint64)
+
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        hashes = _shingle_hashes(text)
+        permuted = (a[:, None] * hashes[None, :] + b[:, None]) % HASH_PRIME
+        signatures[row] = permuted.min(axis=1)
+    return signatures
+
+
+def collapse_near_duplicates(messages: List[Dict[str, Any]], threshold: float = 0.8,
+                             num_perm: int = 64, bands: int = 16) -> List[Dict[str, Any]]:
+    """
+    Заменяет кластеры почти одинаковых сообщений одним представителем
+
+    Представитель - самое раннее сообщение кластера; у него появляются поля
+    duplicate_count (размер кластера) и last_create_at. Порядок сохраняется.
+    """
+    if len(messages) < 2:
+        return messages
+
+    signatures = minhash_signatures([msg.get('message', '') for msg in messages], num_perm)
+    rows = num_perm // bands
+
+    parent = list(range(len(messages)))
+
+    def find(index: int) -> int:
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    # LSH: сообщения с совпадающей полосой сигнатуры - кандидаты в дубликаты
+    for band in range(bands):
+        buckets: Dict[bytes, int] = {}
+        band_values = signatures[:, band * rows:(band + 1) * rows]
+        for index in range(len(messages)):
+            key = band_values[index].tobytes()
+            first = buckets.setdefault(key, index)
+            if first == index:
+                continue
+            root_a, root_b = find(first), find(index)
+            if root_a == root_b:
+                continue
+            # Подтверждаем кандидата оценкой сходства Жаккара по всей сигнатуре
+            similarity = np.count_nonzero(signatures[first] == signatures[index]) / num_perm
+            if similarity >= threshold:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters: Dict[int, List[int]] = {}
+    for index in range(len(messages)):
+        clusters.setdefault(find(index), []).append(index)
+
+    collapsed = []
+    for root in sorted(clusters):
+        members = clusters[root]
+        representative = messages[members[0]]
+        if len(members) == 1:
+            collapsed.append(representative)
+            continue
+        collapsed.append({
+            **representative,
+            'duplicate_count': sum(messages[i].get('duplicate_count', 1) for i in members),
+            'last_create_at': max(messages[i].get('create_at', 0) for i in members),
+        })
+    return collapsed
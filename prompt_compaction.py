@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Сжатие сообщений перед отправкой в LLM
+"""
+
+import logging
+import re
+from typing import List, Dict, Any, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Блок кода начинается с новой строки после ```язык; ```make test``` в строке остается как есть
+CODE_BLOCK_RE = re.compile(r'```([^\n`]*)\n(.*?)(?:```|$)', re.DOTALL)
+URL_RE = re.compile(r'<?https?://([^\s/?#<>()\[\]]+)[^\s<>()\[\]]*>?')
+QUOTE_LINE_RE = re.compile(r'^\s*>.*(?:\n|$)', re.MULTILINE)
+EMOJI_ONLY_RE = re.compile(
+    r'^(?:\s|:[a-z0-9_+\-]+:|[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D])+$',
+    re.IGNORECASE
+)
+LOG_LINE_RE = re.compile(
+    r'^\s*(?:'
+    r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}'            # 2024-01-01 12:00 ...
+    r'|\[?\d{2}:\d{2}:\d{2}'                       # [12:00:00] ...
+    r'|at [\w$.<>]+\('                             # Java stack frame
+    r'|File ".*", line \d+'                        # Python stack frame
+    r'|Traceback \(most recent call last\)'
+    r'|[\w.]+(?:Error|Exception)(?::|$)'           # ValueError: boom
+    r'|\[(?:TRACE|DEBUG|INFO|WARN|WARNING|ERROR|FATAL|CRITICAL)\]'
+    r'|(?:TRACE|DEBUG|INFO|WARN|WARNING|ERROR|FATAL|CRITICAL):'
+    r')'
+)
+WHITESPACE_RE = re.compile(r'[ \t]+')
+BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительная оценка числа токенов (~4 символа на токен)"""
+    if not text:
+        return 0
+    return tokens_for_length(len(text))
+
+
+def tokens_for_length(length: int) -> int:
+    """Оценка токенов по длине текста - когда сама строка еще не собрана"""
+    return (length + 3) // 4
+
+
+class PromptCompactor:
+    """Конвейер сжатия сообщений: код, логи, цитаты, ссылки, дубли, реакции"""
+
+    def __init__(self, enabled: bool = True, max_message_chars: int = 1500, min_log_lines: int = 3,
+                 drop_bot_posts: bool = True):
+        self.enabled = enabled
+        self.max_message_chars = max_message_chars
+        self.min_log_lines = min_log_lines
+        self.drop_bot_posts = drop_bot_posts
+
+    @classmethod
+    def from_config(cls) -> 'PromptCompactor':
+        """Создает компактор с настройками из Config"""
+        return cls(
+            enabled=Config.PROMPT_COMPACTION_ENABLED,
+            max_message_chars=Config.PROMPT_MAX_MESSAGE_CHARS,
+            drop_bot_posts=Config.PROMPT_DROP_BOT_POSTS,
+        )
+
+    def compact(self, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        Сжимает список сообщений
+
+        Returns:
+            (сжатые сообщения, статистика с полями tokens_before/tokens_after/tokens_saved и др.)
+        """
+        stats = {
+            'messages_before': len(messages),
+            'messages_after': 0,
+            'tokens_before': 0,
+            'tokens_after': 0,
+            'tokens_saved': 0,
+            'dropped_duplicates': 0,
+            'dropped_reactions': 0,
+            'dropped_bots': 0,
+        }
+
+        compacted = []
+        seen = {}
+
+        for msg in messages:
+            text = (msg.get('message') or '').strip()
+            stats['tokens_before'] += estimate_tokens(text)
+
+            if not self.enabled:
+                if text:
+                    compacted.append(msg)
+                    stats['tokens_after'] += estimate_tokens(text)
+                continue
+
+            if self.drop_bot_posts and msg.get('from_bot'):
+                stats['dropped_bots'] += 1
+                continue
+
+            if not text:
+                continue
+
+            if EMOJI_ONLY_RE.match(text):
+                stats['dropped_reactions'] += 1
+                continue
+
+            # Дубли ищем по исходному тексту: после сжатия разные ссылки и фрагменты кода совпадают
+            key = (msg.get('channel_name'), ' '.join(text.lower().split()))
+            kept = seen.get(key)
+            if kept is not None:
+                kept['duplicate_count'] = kept.get('duplicate_count', 1) + msg.get('duplicate_count', 1)
+                stats['dropped_duplicates'] += 1
+                continue
+
+            text = self.compact_text(text)
+            if not text:
+                continue
+
+            seen[key] = {**msg, 'message': text}
+            compacted.append(seen[key])
+            stats['tokens_after'] += estimate_tokens(text)
+
+        stats['messages_after'] = len(compacted)
+        stats['tokens_saved'] = stats['tokens_before'] - stats['tokens_after']
+
+        if self.enabled and messages:
+            logger.info(
+                f"🗜️ Сжатие промпта: {stats['messages_before']} → {stats['messages_after']} сообщений, "
+                f"~{stats['tokens_before']} → ~{stats['tokens_after']} токенов "
+                f"(сэкономлено ~{stats['tokens_saved']})"
+            )
+
+        return compacted, stats
+
+    def compact_text(self, text: str) -> str:
+        """Сжимает текст одного сообщения"""
+        text = CODE_BLOCK_RE.sub(self._code_placeholder, text)
+        text = QUOTE_LINE_RE.sub('', text)
+        text = URL_RE.sub(lambda m: f"[{m.group(1).lower()}]", text)
+        text = self._collapse_log_lines(text)
+        text = WHITESPACE_RE.sub(' ', text)
+        text = BLANK_LINES_RE.sub('\n', text).strip()
+
+        if len(text) > self.max_message_chars:
+            text = text[:self.max_message_chars].rstrip() + " … [обрезано]"
+
+        return text
+
+    @staticmethod
+    def _code_placeholder(match: re.Match) -> str:
+        language = match.group(1).strip()
+        lines = len([line for line in match.group(2).splitlines() if line.strip()])
+        label = f"код {language}" if language else "код"
+        return f"[{label}: {lines} строк]"
+
+    def _collapse_log_lines(self, text: str) -> str:
+        """Заменяет подряд идущие строки логов и стектрейсов на плейсхолдер"""
+        lines = text.split('\n')
+        if len(lines) < self.min_log_lines:
+            return text
+
+        result = []
+        run = []
+
+        def flush():
+            if len(run) >= self.min_log_lines:
+                first = run[0].strip()[:120]
+                result.append(f"{first} [лог: {len(run)} строк]")
+            else:
+                result.extend(run)
+            run.clear()
+
+        for line in lines:
+            # Строки с отступом внутри блока лога считаем его продолжением
+            if LOG_LINE_RE.match(line) or (run and line[:1] in (' ', '\t') and line.strip()):
+                run.append(line)
+            else:
+                flush()
+                result.append(line)
+        flush()
+
+        return '\n'.join(result)
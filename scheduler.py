@@ -4,11 +4,21 @@
 """
 
 import asyncio
+import heapq
 import logging
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, TYPE_CHECKING
+from functools import partial
+from typing import Awaitable, Callable, Iterable, List, Dict, Any, Optional, Tuple, TYPE_CHECKING
 
 from subscription_manager import SubscriptionManager
+from config import Config
+from extractive_ranker import ExtractiveSelector
+from near_duplicates import collapse_near_duplicates
+from usage_tracker import LLMQuotaExceeded
+from channel_stats import compute_channel_stats, format_stats_header
+from digest_graph import WaveWorkGraph, compose_digest
 import pytz
 
 if TYPE_CHECKING:
@@ -16,6 +26,30 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# Через сколько секунд повторить запуски, если волну или расписание не удалось прочитать из базы
+SCHEDULER_RETRY_DELAY = 60
+
+
+async def gather_limited(limit: int, factories: Iterable[Callable[[], Awaitable[Any]]]) -> List[Any]:
+    """
+    asyncio.gather не более чем для limit задач одновременно
+
+    Принимает фабрики, а не корутины: работа начинается только после
+    получения слота. Порядок результатов совпадает с порядком фабрик.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(factory):
+        async with semaphore:
+            return await factory()
+
+    return await asyncio.gather(*(run(factory) for factory in factories))
+
+
+def _create_at(message: Dict[str, Any]) -> int:
+    return message.get('create_at', 0)
+
+
 class SubscriptionScheduler:
     """Планировщик для автоматической отправки сводок"""
     
@@ -24,6 +58,23 @@ class SubscriptionScheduler:
         self.subscription_manager = subscription_manager
         self._running = False
         self._task = None
+        self._compaction_task = None
+        self.extractive = ExtractiveSelector.from_config()
+        # Мин-куча (next_run_at UTC, id подписки); устаревшие записи отсеивает запрос к базе
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._loop = None
+        subscription_manager.add_change_listener(self.wake_up)
+        # Общий лимит параллельных подписок и лимит одновременных выборок истории одного канала
+        self._semaphore = asyncio.Semaphore(Config.SCHEDULER_CONCURRENCY)
+        self._channel_semaphores = defaultdict(lambda: asyncio.Semaphore(Config.SCHEDULER_CHANNEL_CONCURRENCY))
+        self.last_wave: Optional[Dict[str, Any]] = None
+        # Предрасчет сводок: куча (время старта, next_run_at, id) и заранее заполненные графы волн по next_run_at;
+        # у предрасчета свой, меньший лимит - слоты доставок он не занимает
+        self._precompute_semaphore = asyncio.Semaphore(max(1, Config.DIGEST_PRECOMPUTE_CONCURRENCY))
+        self._precompute_heap = []
+        self._precomputed: Dict[datetime, WaveWorkGraph] = {}
+        self._precompute_tasks = set()
     
     async def start(self):
         """Запуск планировщика"""
@@ -31,27 +82,103 @@ class SubscriptionScheduler:
             return
         
         self._running = True
+        self._loop = asyncio.get_running_loop()
         self._task = asyncio.create_task(self._scheduler_loop())
+        if Config.DELIVERY_LOG_RETENTION_DAYS > 0 or Config.USAGE_RETENTION_DAYS > 0:
+            self._compaction_task = asyncio.create_task(self._compaction_loop())
         logger.info("✅ Планировщик подписок запущен")
     
     async def stop(self):
         """Остановка планировщика"""
         self._running = False
-        if self._task:
-            self._task.cancel()
-            try:
-                await self._task
-            except asyncio.CancelledError:
-                pass
+        for task in (self._task, self._compaction_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        for task in list(self._precompute_tasks):
+            task.cancel()
+        self.extractive.shutdown()
         logger.info("⏹️ Планировщик подписок остановлен")
     
+    async def _compaction_loop(self):
+        """Фоновая очистка старых сырых записей журнала доставок и учета токенов"""
+        usage_tracker = getattr(self.bot, 'usage_tracker', None)
+        while self._running:
+            await self.subscription_manager.compact_delivery_log(
+                Config.DELIVERY_LOG_RETENTION_DAYS, Config.DELIVERY_LOG_COMPACTION_BATCH
+            )
+            if usage_tracker is not None:
+                await usage_tracker.prune(Config.USAGE_RETENTION_DAYS, Config.DELIVERY_LOG_COMPACTION_BATCH)
+            await asyncio.sleep(Config.DELIVERY_LOG_COMPACTION_INTERVAL)
+    
+    def wake_up(self):
+        """Будит планировщик после изменения подписок (можно вызывать из любого потока)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+    
+    async def _rebuild_heap(self):
+        """Загружает расписание всех активных подписок"""
+        self._heap = await self.subscription_manager.get_next_runs()
+        heapq.heapify(self._heap)
+        self._precompute_heap = []
+        for run_at, subscription_id in self._heap:
+            self._push_precompute(run_at, subscription_id)
+    
+    @staticmethod
+    def _precompute_enabled() -> bool:
+        return Config.DIGEST_PRECOMPUTE_LEAD > 0 and Config.DIGEST_SHARED_ENABLED
+    
+    @staticmethod
+    def _precompute_start(run_at: datetime, subscription_id: int) -> datetime:
+        """
+        Время старта предрасчета подписки
+        
+        Старты одной волны равномерно распределены по первой половине окна
+        DIGEST_PRECOMPUTE_LEAD, чтобы запросы к LLM не приходили одновременно.
+        """
+        lead = Config.DIGEST_PRECOMPUTE_LEAD
+        spread = (subscription_id * 0.6180339887) % 1 * lead / 2
+        return run_at - timedelta(seconds=lead - spread)
+    
+    def _push_precompute(self, run_at: datetime, subscription_id: int):
+        if self._precompute_enabled():
+            heapq.heappush(self._precompute_heap,
+                           (self._precompute_start(run_at, subscription_id), run_at, subscription_id))
+    
+    def _seconds_until_next_run(self) -> float:
+        """Сколько спать до ближайшего запуска или предрасчета (не дольше SCHEDULER_MAX_SLEEP)"""
+        heads = [heap[0][0] for heap in (self._heap, self._precompute_heap) if heap]
+        if not heads:
+            return Config.SCHEDULER_MAX_SLEEP
+        delay = (min(heads) - datetime.utcnow()).total_seconds()
+        return min(max(delay, 0.0), Config.SCHEDULER_MAX_SLEEP)
+    
     async def _scheduler_loop(self):
-        """Основной цикл планировщика"""
+        """Основной цикл планировщика: спит до ближайшего next_run_at или до изменения подписок"""
+        try:
+            await self._rebuild_heap()
+        except Exception as e:
+            # Перечитаем расписание на первом проходе цикла
+            logger.error(f"❌ Не удалось загрузить расписание подписок: {e}")
+            self._wakeup.set()
         while self._running:
             try:
-                # Проверяем подписки каждую минуту
-                await self._check_subscriptions()
-                await asyncio.sleep(60)  # Проверка каждые 60 секунд
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_until_next_run())
+                except asyncio.TimeoutError:
+                    pass
+                
+                if self._wakeup.is_set():
+                    self._wakeup.clear()
+                    await self._rebuild_heap()
+                    continue
+                
+                current_time = datetime.utcnow()
+                await self._start_precomputes(current_time)
+                await self._fire_due(current_time)
                 
             except asyncio.CancelledError:
                 break
@@ -59,27 +186,473 @@ class SubscriptionScheduler:
                 logger.error(f"❌ Ошибка в планировщике: {e}")
                 await asyncio.sleep(60)
     
-    async def _check_subscriptions(self):
-        """Проверка и выполнение подписок"""
+    async def _fire_due(self, current_time: datetime):
+        """
+        Выполняет волну наступивших запусков и возвращает сработавшие подписки в кучу
+        
+        Если волну или новое расписание не удалось прочитать из базы, подписки
+        возвращаются в кучу на SCHEDULER_RETRY_DELAY вперед: прошедшее время
+        запуска заставило бы цикл крутиться без сна, опрашивая базу.
+        """
+        fired = []
+        while self._heap and self._heap[0][0] <= current_time:
+            fired.append(heapq.heappop(self._heap)[1])
+        if not fired:
+            return
+        
+        runs = None
+        if await self._check_subscriptions(current_time):
+            try:
+                runs = await self.subscription_manager.get_next_runs(fired)
+            except Exception:
+                pass  # ошибка уже в логе менеджера подписок
+        
+        retry_at = current_time + timedelta(seconds=SCHEDULER_RETRY_DELAY)
+        if runs is None:
+            logger.warning(f"⏳ Повторю {len(fired)} запусков через {SCHEDULER_RETRY_DELAY}s")
+            runs = [(retry_at, subscription_id) for subscription_id in fired]
+        
+        # Возвращаем в кучу новое время запуска сработавших подписок (удаленных в ответе нет)
+        for run_at, subscription_id in runs:
+            if run_at <= current_time:
+                # Подписка не перенесена - например, волна прервалась до ее выборки
+                run_at = retry_at
+            heapq.heappush(self._heap, (run_at, subscription_id))
+            if run_at != retry_at:
+                self._push_precompute(run_at, subscription_id)
+    
+    async def _start_precomputes(self, current_time: datetime):
+        """Запускает в фоне предрасчет подписок, у которых наступило время старта"""
+        pending = {}
+        while self._precompute_heap and self._precompute_heap[0][0] <= current_time:
+            _, run_at, subscription_id = heapq.heappop(self._precompute_heap)
+            # Наступившие запуски выполнит обычная волна
+            if run_at > current_time:
+                pending[subscription_id] = run_at
+        if not pending:
+            return
+        
+        for subscription in await self.subscription_manager.get_scheduled_subscriptions(list(pending)):
+            run_at = subscription['next_run_at']
+            # Подписку перенесли после того, как запись попала в кучу
+            if run_at != pending[subscription['id']]:
+                continue
+            graph = self._precomputed.get(run_at)
+            if graph is None:
+                cutoff = (run_at - timedelta(seconds=Config.DIGEST_PRECOMPUTE_LEAD)).replace(tzinfo=pytz.UTC)
+                graph = self._precomputed[run_at] = WaveWorkGraph(cutoff=cutoff)
+            task = asyncio.create_task(self._precompute_subscription(subscription, graph))
+            self._precompute_tasks.add(task)
+            task.add_done_callback(self._precompute_tasks.discard)
+    
+    async def _precompute_subscription(self, subscription: Dict[str, Any], graph: WaveWorkGraph):
+        """Заранее готовит каналы, сообщения до границы предрасчета и их частичные сводки"""
+        async with self._precompute_semaphore:
+            try:
+                await asyncio.wait_for(self._collect_subscription(subscription, graph, precompute=True),
+                                       timeout=Config.SCHEDULER_SUBSCRIPTION_TIMEOUT)
+                logger.info(f"🧮 Сводка подписки ID={subscription['id']} предрасчитана к "
+                            f"{subscription['next_run_at'].strftime('%H:%M')} UTC")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # При доставке недостающая работа будет выполнена заново
+                logger.warning(f"⚠️ Ошибка предрасчета подписки ID={subscription['id']}: {e!r}")
+    
+    async def _check_subscriptions(self, current_time: Optional[datetime] = None) -> bool:
+        """
+        Выполнение наступивших подписок и перенос их на следующий запуск
+        
+        Returns:
+            False, если волну не удалось выполнить (например, база недоступна)
+        """
         try:
-            current_time = datetime.utcnow()
+            current_time = current_time or datetime.utcnow()
             logger.info(f"🔍 Проверка подписок в {current_time.strftime('%Y-%m-%d %H:%M:%S')} UTC")
             
-            due_subscriptions = self.subscription_manager.get_due_subscriptions(current_time)
+            due_subscriptions = await self.subscription_manager.get_due_subscriptions(
+                current_time, Config.SCHEDULER_MISSED_RUN_GRACE
+            )
             
             if due_subscriptions:
                 logger.info(f"📋 Найдено {len(due_subscriptions)} подписок для выполнения")
                 
+                started = time.perf_counter()
+                # Общая работа волны по времени запуска; предрасчитанные графы переходят к доставке
+                graphs = {}
+                precomputed = 0
                 for subscription in due_subscriptions:
-                    await self._execute_subscription(subscription)
+                    run_at = subscription.get('next_run_at')
+                    if run_at not in graphs:
+                        graph = self._precomputed.pop(run_at, None)
+                        if graph is not None:
+                            graph.forget_failed()
+                        graphs[run_at] = graph or WaveWorkGraph()
+                    if graphs[run_at].cutoff is not None:
+                        precomputed += 1
+                
+                results = await asyncio.gather(
+                    *(self._run_subscription(subscription, current_time, graphs[subscription.get('next_run_at')])
+                      for subscription in due_subscriptions),
+                    return_exceptions=True
+                )
+                self.last_wave = self._wave_stats(results, time.perf_counter() - started, current_time)
+                for key in ('tasks', 'hits'):
+                    self.last_wave[f'shared_{key}'] = sum(graph.stats()[key] for graph in graphs.values())
+                self.last_wave['precomputed'] = precomputed
+                logger.info(
+                    f"🌊 Волна рассылки: {self.last_wave['subscriptions']} подписок за "
+                    f"{self.last_wave['duration_seconds']:.1f}s, опоздание p50 {self.last_wave['lateness_p50_seconds']:.1f}s, "
+                    f"макс. {self.last_wave['lateness_max_seconds']:.1f}s, таймаутов {self.last_wave['timeouts']}, "
+                    f"общих задач {self.last_wave['shared_tasks']} (переиспользовано {self.last_wave['shared_hits']}), "
+                    f"предрасчитано {precomputed}"
+                )
             else:
                 logger.info("📋 Нет подписок для выполнения")
+            
+            # Предрасчеты запусков, которые так и не наступили (подписку удалили или перенесли)
+            stale = current_time - timedelta(seconds=Config.SCHEDULER_MISSED_RUN_GRACE)
+            for run_at in [run_at for run_at in self._precomputed if run_at < stale]:
+                del self._precomputed[run_at]
+            return True
         
         except Exception as e:
             logger.error(f"❌ Ошибка проверки подписок: {e}")
+            return False
+    
+    async def _run_subscription(self, subscription: Dict[str, Any], current_time: datetime,
+                                graph: Optional[WaveWorkGraph] = None) -> Dict[str, Any]:
+        """
+        Выполняет подписку под общим лимитом параллельности и с таймаутом
+
+        Returns:
+            Опоздание доставки относительно запланированного времени (секунды) и признак таймаута
+        """
+        timed_out = False
+        async with self._semaphore:
+            try:
+                await asyncio.wait_for(
+                    self._execute_subscription(subscription, graph),
+                    timeout=Config.SCHEDULER_SUBSCRIPTION_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                timed_out = True
+                logger.error(f"⏰ Подписка ID={subscription['id']} не уложилась в "
+                             f"{Config.SCHEDULER_SUBSCRIPTION_TIMEOUT}s")
+                await self.subscription_manager.log_delivery(
+                    subscription['id'], 'error', 0,
+                    f"Превышено время выполнения ({Config.SCHEDULER_SUBSCRIPTION_TIMEOUT}s)"
+                )
+            finally:
+                await self.subscription_manager.reschedule(subscription, current_time)
+        
+        scheduled_at = subscription.get('next_run_at') or current_time
+        lateness = (datetime.utcnow() - scheduled_at).total_seconds()
+        logger.info(f"⏱️ Подписка ID={subscription['id']} обработана, опоздание {lateness:.1f}s")
+        return {'lateness': lateness, 'timed_out': timed_out}
+    
+    @staticmethod
+    def _wave_stats(results: List[Any], duration: float, current_time: datetime) -> Dict[str, Any]:
+        """Сводка по волне рассылки: длительность, опоздания, таймауты и ошибки"""
+        finished = [result for result in results if isinstance(result, dict)]
+        lateness = sorted(result['lateness'] for result in finished)
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error(f"❌ Ошибка выполнения подписки в волне: {result}")
+        return {
+            'started_at': current_time.isoformat(timespec='seconds'),
+            'subscriptions': len(results),
+            'duration_seconds': round(duration, 3),
+            'lateness_p50_seconds': round(lateness[len(lateness) // 2], 3) if lateness else 0.0,
+            'lateness_max_seconds': round(lateness[-1], 3) if lateness else 0.0,
+            'timeouts': sum(1 for result in finished if result['timed_out']),
+            'errors': len(results) - len(finished),
+        }
+    
+    async def _resolve_channel(self, channel_name: str) -> Optional[Dict[str, Any]]:
+        """Канал по имени, если бот имеет к нему доступ"""
+        channel_info = await self.bot.get_channel_by_name(channel_name)
+        if channel_info and await self.bot._check_channel_permissions(channel_info['id']):
+            return channel_info
+        return None
     
-    async def _execute_subscription(self, subscription: Dict[str, Any]):
-        """Выполнение конкретной подписки"""
+    async def _resolve_subscription_channel(self, channel_name: str,
+                                            stored: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Канал подписки: по сохраненному ID - одной проверкой доступа, без поиска по имени
+        
+        Если канал по сохраненному ID недоступен (удален, бота исключили, 404),
+        он ищется по имени заново.
+        """
+        if stored and stored.get('id'):
+            if await self.bot._check_channel_permissions(stored['id']):
+                return {
+                    'id': stored['id'],
+                    'name': channel_name,
+                    'display_name': stored.get('display_name') or channel_name,
+                }
+            logger.info(f"🔄 Канал {channel_name} ({stored['id']}) недоступен по сохраненному ID, ищу по имени")
+        return await self._resolve_channel(channel_name)
+    
+    async def _fetch_period(self, channel_id: str, since_time: datetime, until_time: datetime) -> List[Dict[str, Any]]:
+        """Сообщения канала за отрезок [since_time, until_time)"""
+        async with self._channel_semaphores[channel_id]:
+            messages = await self.bot.get_channel_messages_since(channel_id, since_time)
+        
+        # Фильтруем сообщения по периоду
+        filtered_messages = []
+        for msg in messages or []:
+            msg_time = datetime.fromtimestamp(msg.get('create_at', 0) / 1000, tz=pytz.UTC)
+            if since_time <= msg_time < until_time:
+                filtered_messages.append(msg)
+        return filtered_messages
+    
+    def _period_messages(self, graph: WaveWorkGraph, channel_id: str, since_time: datetime, until_time: datetime):
+        return graph.run(('period', channel_id, since_time, until_time),
+                         partial(self._fetch_period, channel_id, since_time, until_time))
+    
+    async def _prepare_channel(self, graph: WaveWorkGraph, channel_name: str, channel_id: str,
+                               channel_info: Dict[str, Any], since_time: datetime, until_time: datetime,
+                               timezone: str) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+        """
+        Сообщения канала за период: статистика, схлопывание дубликатов и отбор
+        
+        Returns:
+            (отобранные сообщения, описание канала) или None, если сообщений нет
+        """
+        filtered_messages = await self._period_messages(graph, channel_id, since_time, until_time)
+        
+        if not filtered_messages:
+            return None
+        
+        # Статистику считаем по всем сообщениям периода, до схлопывания и отбора
+        stats = compute_channel_stats(filtered_messages, timezone)
+        
+        # Схлопываем почти одинаковые сообщения (алерты, CI) в одно со счетчиком
+        if Config.DEDUP_ENABLED and len(filtered_messages) >= Config.DEDUP_MIN_MESSAGES:
+            collapsed = await self.extractive.run_in_pool(
+                collapse_near_duplicates, filtered_messages, Config.DEDUP_THRESHOLD
+            )
+            logger.info(f"🧹 Дубликаты в канале {channel_name}: {len(filtered_messages)} → {len(collapsed)}")
+            filtered_messages = collapsed
+        
+        # Для больших окон отбираем самые информативные сообщения
+        selected_messages = await self.extractive.select(filtered_messages)
+        return selected_messages, {
+            'channel_name': channel_name,
+            'channel_id': channel_id,
+            'message_count': sum(m.get('duplicate_count', 1) for m in filtered_messages),
+            'display_name': channel_info.get('display_name', channel_name),
+            'stats': stats
+        }
+    
+    @staticmethod
+    def _segments(graph: WaveWorkGraph, since_time: datetime, until_time: datetime,
+                  precompute: bool = False) -> List[Tuple[datetime, datetime]]:
+        """
+        Отрезки окна подписки
+        
+        Если граф предрасчитан, окно делится границей предрасчета: первая часть
+        готовится заранее, вторая докачивается при доставке. Предрасчет без
+        такой границы невозможен - сообщения окна еще не написаны.
+        """
+        cutoff = graph.cutoff
+        if cutoff is None or not since_time < cutoff < until_time:
+            return [] if precompute else [(since_time, until_time)]
+        if precompute:
+            return [(since_time, cutoff)]
+        return [(since_time, cutoff), (cutoff, until_time)]
+    
+    async def _merge_channel_summary(self, graph: WaveWorkGraph, channel_id: str,
+                                     segments: List[Tuple[datetime, datetime]], timezone: str,
+                                     summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Описание канала за все окно по его отрезкам (статистика пересчитывается по всем сообщениям)"""
+        messages = []
+        for since_time, until_time in segments:
+            messages.extend(await self._period_messages(graph, channel_id, since_time, until_time))
+        return dict(
+            summaries[0],
+            message_count=sum(summary['message_count'] for summary in summaries),
+            stats=compute_channel_stats(messages, timezone)
+        )
+    
+    async def _collect_channel(self, graph: WaveWorkGraph, channel_name: str, channel_id: str,
+                               channel_info: Dict[str, Any], segments: List[Tuple[datetime, datetime]],
+                               timezone: str) -> Optional[Tuple[Dict[str, Any], List[tuple]]]:
+        """
+        Сообщения канала по отрезкам окна
+        
+        Returns:
+            (описание канала за окно, [(отобранные сообщения, описание отрезка, ключ отрезка)])
+            или None, если сообщений нет
+        """
+        prepared_segments = await asyncio.gather(*(
+            graph.run(
+                ('messages', channel_id, since_time, until_time, timezone),
+                partial(self._prepare_channel, graph, channel_name, channel_id, channel_info,
+                        since_time, until_time, timezone)
+            )
+            for since_time, until_time in segments
+        ))
+        parts = [
+            prepared + ((since_time, until_time, timezone),)
+            for (since_time, until_time), prepared in zip(segments, prepared_segments)
+            if prepared
+        ]
+        
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0][1], parts
+        
+        channel_summary = await graph.run(
+            ('summary', channel_id, segments[0][0], segments[-1][1], timezone),
+            partial(self._merge_channel_summary, graph, channel_id, segments, timezone, [part[1] for part in parts])
+        )
+        return channel_summary, parts
+    
+    async def _collect_subscription(self, subscription: Dict[str, Any], graph: WaveWorkGraph,
+                                    precompute: bool = False) -> Tuple[List[str], List[tuple], List[tuple]]:
+        """
+        Каналы подписки и их сообщения за окно
+        
+        При предрасчете готовятся только сообщения до границы предрасчета и их
+        частичные сводки; при доставке к ним добавляются сообщения после границы.
+        
+        Returns:
+            (недоступные каналы, доступные каналы, [(описание канала, части по отрезкам окна)])
+        """
+        timezone = subscription.get('timezone') or 'Europe/Moscow'
+        
+        # Проверяем наличие бота в каналах: поиск и проверка прав по всем каналам параллельно
+        missing_channels = []
+        available_channels = []
+        resolved = subscription.get('resolved_channels') or {}
+        
+        channel_infos = await gather_limited(Config.SCHEDULER_FETCH_CONCURRENCY, (
+            partial(
+                graph.run,
+                ('channel', channel_name, (resolved.get(channel_name) or {}).get('id')),
+                partial(self._resolve_subscription_channel, channel_name, resolved.get(channel_name))
+            )
+            for channel_name in subscription['channels']
+        ))
+        changed = []
+        for position, (channel_name, channel_info) in enumerate(zip(subscription['channels'], channel_infos)):
+            if channel_info:
+                available_channels.append((channel_name, channel_info['id'], channel_info))
+            else:
+                missing_channels.append(channel_name)
+            
+            # Сохраняем найденные заново или пропавшие ID каналов
+            stored = resolved.get(channel_name) or {}
+            channel_id = channel_info['id'] if channel_info else None
+            display_name = channel_info.get('display_name') if channel_info else None
+            if (channel_id, display_name) != (stored.get('id'), stored.get('display_name')):
+                changed.append((position, channel_name, channel_id, display_name))
+        await self.subscription_manager.save_channel_resolutions(subscription['id'], changed)
+        
+        if missing_channels or not available_channels:
+            return missing_channels, available_channels, []
+        
+        # Период считаем от запланированного времени запуска: у подписчиков с одинаковым
+        # расписанием окно совпадает, и выборка канала делается один раз на волну
+        since_time, until_time = self.subscription_manager.get_message_collection_period(
+            subscription, subscription.get('next_run_at')
+        )
+        segments = self._segments(graph, since_time, until_time, precompute)
+        
+        # Выборка и отбор сообщений всех каналов параллельно: время - как у самого медленного канала
+        collected_channels = await gather_limited(Config.SCHEDULER_FETCH_CONCURRENCY, (
+            partial(self._collect_channel, graph, channel_name, channel_id, channel_info, segments, timezone)
+            for channel_name, channel_id, channel_info in available_channels
+        ))
+        channels = []
+        for (channel_name, _, _), collected in zip(available_channels, collected_channels):
+            if collected:
+                channel_summary, parts = collected
+                channels.append((dict(channel_summary, channel_name=channel_name), parts))
+        
+        if precompute:
+            await asyncio.gather(
+                *(self._channel_digest(graph, parts, subscription['frequency']) for _, parts in channels),
+                return_exceptions=True
+            )
+        return missing_channels, available_channels, channels
+    
+    async def _partial_summary(self, selected_messages: List[Dict[str, Any]], segment_summary: Dict[str, Any],
+                               frequency: str) -> Optional[Tuple[str, int]]:
+        """Раздел сводки по отрезку канала и израсходованные на него токены"""
+        usage_context = {
+            'channel_id': segment_summary['channel_id'],
+            'command': f'digest_{frequency}_shared',
+            'spent_tokens': 0,
+        }
+        summary = await self.bot.llm_client.generate_channel_section(
+            selected_messages, segment_summary, frequency, usage_context=usage_context
+        )
+        return (summary, usage_context['spent_tokens']) if summary else None
+    
+    async def _channel_digest(self, graph: WaveWorkGraph, parts: List[tuple],
+                              frequency: str) -> Optional[Tuple[str, int]]:
+        """
+        Сводка канала: часть до границы предрасчета и дополнение по сообщениям после нее
+        
+        Returns:
+            (сводка канала, токены на ее частичные сводки) или None
+        """
+        results = await asyncio.gather(*(
+            graph.run(
+                ('partial', segment_summary['channel_id']) + segment_key + (frequency,),
+                partial(self._partial_summary, selected_messages, segment_summary, frequency)
+            )
+            for selected_messages, segment_summary, segment_key in parts
+        ))
+        
+        if not results[0]:
+            return None
+        digest, tokens = results[0]
+        for (_, _, (since_time, _, timezone)), result in zip(parts[1:], results[1:]):
+            if result:
+                summary, spent_tokens = result
+                local_time = since_time.astimezone(pytz.timezone(timezone)).strftime('%H:%M')
+                digest += f"\n\n**🆕 Новое с {local_time}:**\n\n{summary}"
+                tokens += spent_tokens
+        return digest, tokens
+    
+    async def _generate_shared_digest(self, graph: WaveWorkGraph, channels: List[tuple],
+                                      frequency: str) -> Tuple[Optional[str], int]:
+        """
+        Сводка из частичных сводок каналов, общих для всех подписчиков волны
+        
+        Частичная сводка канала генерируется один раз на (канал, окно), поэтому
+        число запросов к LLM растет с числом разных каналов, а не подписчиков.
+        
+        Returns:
+            (сводка или None, токены частичных сводок, вошедших в нее)
+        """
+        results = await asyncio.gather(
+            *(self._channel_digest(graph, parts, frequency) for _, parts in channels),
+            return_exceptions=True
+        )
+        
+        partials = []
+        tokens = 0
+        for (channel_summary, _), result in zip(channels, results):
+            if isinstance(result, BaseException) or not result:
+                logger.error(f"❌ Не удалось сформировать сводку канала {channel_summary['display_name']}: {result}")
+                partials.append((channel_summary['display_name'], "❌ Не удалось сформировать сводку канала."))
+            else:
+                partials.append((channel_summary['display_name'], result[0]))
+                tokens += result[1]
+        
+        if all(isinstance(result, BaseException) or not result for result in results):
+            return None, tokens
+        return compose_digest(partials), tokens
+    
+    async def _execute_subscription(self, subscription: Dict[str, Any], graph: Optional[WaveWorkGraph] = None):
+        """Выполнение конкретной подписки (graph - общая работа волны рассылки)"""
+        graph = graph or WaveWorkGraph()
         try:
             user_id = subscription['user_id']
             username = subscription['username']
@@ -89,25 +662,14 @@ class SubscriptionScheduler:
             
             logger.info(f"📤 Выполняю подписку для {username} на каналы: {channels}")
             
-            # Проверяем наличие бота в каналах
-            missing_channels = []
-            available_channels = []
-            
-            for channel_name in channels:
-                channel_info = await self.bot.get_channel_by_name(channel_name)
-                if channel_info:
-                    channel_id = channel_info['id']
-                    if await self.bot._check_channel_permissions(channel_id):
-                        available_channels.append((channel_name, channel_id, channel_info))
-                    else:
-                        missing_channels.append(channel_name)
-                else:
-                    missing_channels.append(channel_name)
+            missing_channels, available_channels, collected_channels = await self._collect_subscription(
+                subscription, graph
+            )
             
             if missing_channels:
                 # Уведомляем пользователя о недоступных каналах
                 await self._send_channel_access_error(user_id, missing_channels)
-                self.subscription_manager.log_delivery(
+                await self.subscription_manager.log_delivery(
                     subscription_id, 
                     'error', 
                     0, 
@@ -118,7 +680,7 @@ class SubscriptionScheduler:
             if not available_channels:
                 # Нет доступных каналов
                 await self._send_no_channels_error(user_id)
-                self.subscription_manager.log_delivery(
+                await self.subscription_manager.log_delivery(
                     subscription_id, 
                     'error', 
                     0, 
@@ -126,61 +688,67 @@ class SubscriptionScheduler:
                 )
                 return
             
-            # Определяем период для сбора сообщений с учетом дня недели
-            since_time, until_time = self.subscription_manager.get_message_collection_period(subscription)
-            
-            # Собираем сообщения из всех каналов
-            all_messages = []
-            channel_summaries = []
-            
-            for channel_name, channel_id, channel_info in available_channels:
-                messages = await self.bot.get_channel_messages_since(channel_id, since_time)
-                if messages:
-                    # Фильтруем сообщения по периоду
-                    filtered_messages = []
-                    for msg in messages:
-                        msg_time = datetime.fromtimestamp(msg.get('create_at', 0) / 1000, tz=pytz.UTC)
-                        if since_time <= msg_time <= until_time:
-                            filtered_messages.append(msg)
-                    
-                    if filtered_messages:
-                        all_messages.extend(filtered_messages)
-                        channel_summaries.append({
-                            'channel_name': channel_name,
-                            'channel_id': channel_id,
-                            'message_count': len(filtered_messages),
-                            'display_name': channel_info.get('display_name', channel_name)
-                        })
+            # Собираем сообщения из всех каналов: каждая часть уже отсортирована по времени, сливаем без пересортировки
+            all_messages = list(heapq.merge(
+                *(selected for _, parts in collected_channels for selected, _, _ in parts), key=_create_at
+            ))
+            channel_summaries = [channel_summary for channel_summary, _ in collected_channels]
             
             if not all_messages:
                 # Нет новых сообщений
                 await self._send_no_messages_summary(user_id, channel_summaries, frequency)
-                self.subscription_manager.log_delivery(subscription_id, 'success', 0)
+                await self.subscription_manager.log_delivery(subscription_id, 'success', 0)
                 return
             
             # Генерируем сводку
-            summary = await self.bot.llm_client.generate_channels_summary(
-                all_messages, channel_summaries, frequency
-            )
+            if Config.DIGEST_SHARED_ENABLED:
+                # Частичные сводки общие, но дневной лимит подписчика по-прежнему действует
+                await self.bot.usage_tracker.check_quota(user_id)
+                summary, shared_tokens = await self._generate_shared_digest(graph, collected_channels, frequency)
+                # Запросы частичных сводок записаны без пользователя: относим их токены на
+                # каждого получателя, иначе общие дайджесты не расходуют его лимит
+                self.bot.usage_tracker.charge({
+                    'user_id': user_id,
+                    'channel_id': channel_summaries[0]['channel_id'] if len(channel_summaries) == 1 else None,
+                    'subscription_id': subscription_id,
+                    'command': f'digest_{frequency}',
+                }, shared_tokens)
+            else:
+                summary = await self.bot.llm_client.generate_channels_summary(
+                    all_messages, channel_summaries, frequency,
+                    usage_context={
+                        'user_id': user_id,
+                        # Канал указываем только для сводки по одному каналу
+                        'channel_id': channel_summaries[0]['channel_id'] if len(channel_summaries) == 1 else None,
+                        'subscription_id': subscription_id,
+                        'command': f'digest_{frequency}',
+                    }
+                )
             
             if summary:
                 # Отправляем сводку в личные сообщения
                 await self._send_summary_to_user(user_id, summary, channel_summaries, frequency)
-                self.subscription_manager.log_delivery(subscription_id, 'success', len(all_messages))
+                await self.subscription_manager.log_delivery(subscription_id, 'success', len(all_messages))
                 logger.info(f"✅ Сводка для {username} отправлена ({len(all_messages)} сообщений)")
             else:
                 # Ошибка генерации сводки
                 await self._send_summary_generation_error(user_id, channel_summaries)
-                self.subscription_manager.log_delivery(
+                await self.subscription_manager.log_delivery(
                     subscription_id, 
                     'error', 
                     len(all_messages), 
                     "Ошибка генерации сводки"
                 )
                 
+        except LLMQuotaExceeded as e:
+            await self.bot.send_direct_message(
+                user_id,
+                f"⛔ Сводка не сформирована: дневной лимит токенов исчерпан ({e.used}/{e.quota})."
+            )
+            await self.subscription_manager.log_delivery(subscription_id, 'error', 0, str(e))
         except Exception as e:
             logger.error(f"❌ Ошибка выполнения подписки: {e}")
-            self.subscription_manager.log_delivery(
+            await self.subscription_manager.log_delivery(
                 subscription_id, 
                 'error', 
                 0, 
@@ -201,7 +769,7 @@ class SubscriptionScheduler:
             
             # Добавляем информацию о каналах
             channels_info = "\n".join([
-                f"• **{cs['display_name']}** ({cs['message_count']} сообщений)"
+                format_stats_header(cs['display_name'], cs.get('stats'), cs['message_count'])
                 for cs in channel_summaries
             ])
             
@@ -3,385 +3,896 @@
 Менеджер подписок для Mattermost Summary Bot
 """
 
-import sqlite3
+import asyncio
 import json
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import pytz
 
+from db import Database
+
 logger = logging.getLogger(__name__)
 
+# Формат next_run_at в базе - как у CURRENT_TIMESTAMP (UTC), строки сравниваются лексикографически.
+# Читается datetime.fromisoformat - на волне из тысяч подписок strptime заметно медленнее
+RUN_AT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Сколько id подставлять в один запрос IN (...) - лимит параметров SQLite
+QUERY_CHUNK_SIZE = 500
+
+# Последняя успешная доставка каждой из подписок - одним запросом по индексу idx_delivery_log_success
+LAST_SUCCESS_QUERY = '''
+    SELECT subscription_id, MAX(delivered_at) FROM delivery_log
+    WHERE status = 'success' AND subscription_id IN ({placeholders})
+    GROUP BY subscription_id
+'''
+
+# Сырые записи журнала доставок нужны проверке повторной отправки за неделю - храним не меньше
+MIN_DELIVERY_LOG_RETENTION_DAYS = 8
+
+# Поля подписки в списках (get_all_subscriptions и поиск по каналу отдают одинаковую форму)
+SUBSCRIPTION_LIST_COLUMNS = ('id', 'user_id', 'username', 'channels', 'schedule_time', 'frequency',
+                             'weekday', 'timezone', 'created_at', 'updated_at')
+
+
+def normalize_channel_label(label: str) -> str:
+    """Имя канала без пробелов по краям и префиксов ~ / # (как его пишут в чате)"""
+    return label.strip().lstrip('~#').strip()
+
+
+def _subscription_from_row(row: tuple) -> Dict[str, Any]:
+    subscription = dict(zip(SUBSCRIPTION_LIST_COLUMNS, row))
+    subscription['channels'] = json.loads(subscription['channels'])
+    return subscription
+
+
+def _localize(tz, naive: datetime) -> datetime:
+    """
+    Локальное время расписания в часовом поясе с учетом перехода на летнее время
+
+    Несуществующее время (перевод часов вперед) сдвигается на час позже,
+    из неоднозначного (перевод назад) берется первое.
+    """
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.exceptions.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=True)
+    except pytz.exceptions.NonExistentTimeError:
+        return tz.localize(naive + timedelta(hours=1), is_dst=True)
+
+
+def compute_next_run_at(schedule_time: str, frequency: str, weekday: Optional[int],
+                        timezone: str, after: datetime) -> datetime:
+    """
+    Ближайшее время запуска подписки строго после after
+
+    Args:
+        schedule_time: время HH:MM в часовом поясе пользователя
+        frequency: daily или weekly
+        weekday: день недели для weekly (0 = понедельник; None - любой день)
+        timezone: часовой пояс пользователя
+        after: момент отсчета (UTC, без tzinfo)
+
+    Returns:
+        Время запуска в UTC без tzinfo
+    """
+    tz = pytz.timezone(timezone)
+    hour, minute = map(int, schedule_time.split(':'))
+    local_date = after.replace(tzinfo=pytz.UTC).astimezone(tz).date()
+
+    for offset in range(0, 9):
+        day = local_date + timedelta(days=offset)
+        if frequency == 'weekly' and weekday is not None and day.weekday() != weekday:
+            continue
+        candidate = _localize(tz, datetime(day.year, day.month, day.day, hour, minute))
+        candidate = candidate.astimezone(pytz.UTC).replace(tzinfo=None)
+        if candidate > after:
+            return candidate
+
+    raise ValueError(f"Не удалось вычислить время запуска: {schedule_time} ({frequency}, {timezone})")
+
+
 class SubscriptionManager:
     """Менеджер для управления подписками пользователей на каналы"""
     
     def __init__(self, db_path: str = "subscriptions.db"):
         self.db_path = db_path
+        self._change_listeners: List[Callable[[], None]] = []
+        self.db = Database(db_path)
         self._init_database()
     
+    def close(self):
+        """Закрывает соединение с базой"""
+        self.db.close()
+    
+    def add_change_listener(self, callback: Callable[[], None]):
+        """Уведомление об изменении расписания (создание и удаление подписок)"""
+        self._change_listeners.append(callback)
+    
+    def _notify_change(self):
+        for callback in self._change_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"❌ Ошибка уведомления об изменении подписок: {e}")
+    
     def _init_database(self):
         """Инициализация базы данных"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Создаем таблицу подписок
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS subscriptions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id TEXT NOT NULL,
-                        username TEXT NOT NULL,
-                        channels TEXT NOT NULL,
-                        schedule_time TEXT NOT NULL,
-                        frequency TEXT NOT NULL,
-                        weekday INTEGER DEFAULT NULL,
-                        timezone TEXT DEFAULT 'Europe/Moscow',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        is_active BOOLEAN DEFAULT 1
-                    )
-                ''')
-                
-                # Добавляем поле weekday, если его нет (миграция)
-                cursor.execute("PRAGMA table_info(subscriptions)")
-                columns = [column[1] for column in cursor.fetchall()]
-                if 'weekday' not in columns:
-                    cursor.execute('ALTER TABLE subscriptions ADD COLUMN weekday INTEGER DEFAULT NULL')
-                    logger.info("✅ Добавлено поле weekday в таблицу subscriptions")
-                
-                # Создаем таблицу для логов отправки
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS delivery_log (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        subscription_id INTEGER NOT NULL,
-                        delivered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        status TEXT NOT NULL,
-                        message_count INTEGER DEFAULT 0,
-                        error_message TEXT,
-                        FOREIGN KEY (subscription_id) REFERENCES subscriptions (id)
-                    )
-                ''')
-                
-                # Миграция: добавляем столбец delivered_at если его нет
-                cursor.execute("PRAGMA table_info(delivery_log)")
-                log_columns = [column[1] for column in cursor.fetchall()]
-                if 'delivered_at' not in log_columns:
-                    cursor.execute('ALTER TABLE delivery_log ADD COLUMN delivered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
-                    logger.info("✅ Добавлен столбец delivered_at в таблицу delivery_log")
-                
-                conn.commit()
-                logger.info("✅ База данных подписок инициализирована")
-                
+            self.db.call(self._create_schema)
+            logger.info("✅ База данных подписок инициализирована")
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации базы данных: {e}")
             raise
     
-    def create_subscription(self, user_id: str, username: str, channels: List[str], 
-                           schedule_time: str, frequency: str, weekday: int = None, timezone: str = "Europe/Moscow") -> bool:
-        """Создание новой подписки"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Проверяем, не существует ли уже подписка для этого пользователя
+    def _create_schema(self, conn):
+        cursor = conn.cursor()
+        
+        # Создаем таблицу подписок
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                username TEXT NOT NULL,
+                channels TEXT NOT NULL,
+                schedule_time TEXT NOT NULL,
+                frequency TEXT NOT NULL,
+                weekday INTEGER DEFAULT NULL,
+                timezone TEXT DEFAULT 'Europe/Moscow',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+        
+        # Добавляем поле weekday, если его нет (миграция)
+        cursor.execute("PRAGMA table_info(subscriptions)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'weekday' not in columns:
+            cursor.execute('ALTER TABLE subscriptions ADD COLUMN weekday INTEGER DEFAULT NULL')
+            logger.info("✅ Добавлено поле weekday в таблицу subscriptions")
+        
+        # Миграция: время следующего запуска (UTC) и индекс для выборки наступивших подписок
+        if 'next_run_at' not in columns:
+            cursor.execute('ALTER TABLE subscriptions ADD COLUMN next_run_at TEXT DEFAULT NULL')
+            logger.info("✅ Добавлено поле next_run_at в таблицу subscriptions")
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_subscriptions_next_run
+            ON subscriptions (is_active, next_run_at)
+        ''')
+        self._backfill_next_run_at(cursor)
+        
+        # Каналы подписок с найденными ID: планировщик не ищет канал по имени при каждом запуске
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS subscription_channels (
+                subscription_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                channel_label TEXT NOT NULL,
+                channel_id TEXT DEFAULT NULL,
+                display_name TEXT DEFAULT NULL,
+                resolved_at TIMESTAMP DEFAULT NULL,
+                PRIMARY KEY (subscription_id, channel_label),
+                FOREIGN KEY (subscription_id) REFERENCES subscriptions (id)
+            )
+        ''')
+        # Обратный поиск: какие подписки включают канал (по ID или по имени из подписки)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_subscription_channels_channel
+            ON subscription_channels (channel_id, subscription_id)
+        ''')
+        # Имена каналов в Mattermost не зависят от регистра - ищем без учета регистра (ASCII)
+        cursor.execute('DROP INDEX IF EXISTS idx_subscription_channels_label')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_subscription_channels_label_nocase
+            ON subscription_channels (channel_label COLLATE NOCASE, subscription_id)
+        ''')
+        self._normalize_channel_labels(cursor)
+        self._backfill_subscription_channels(cursor)
+        
+        # Создаем таблицу для логов отправки
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS delivery_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subscription_id INTEGER NOT NULL,
+                delivered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT NOT NULL,
+                message_count INTEGER DEFAULT 0,
+                error_message TEXT,
+                FOREIGN KEY (subscription_id) REFERENCES subscriptions (id)
+            )
+        ''')
+        
+        # Миграция: добавляем столбец delivered_at если его нет
+        cursor.execute("PRAGMA table_info(delivery_log)")
+        log_columns = [column[1] for column in cursor.fetchall()]
+        if 'delivered_at' not in log_columns:
+            cursor.execute('ALTER TABLE delivery_log ADD COLUMN delivered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+            logger.info("✅ Добавлен столбец delivered_at в таблицу delivery_log")
+        # Проверка повторной доставки: последняя успешная отправка подписки без сканирования журнала
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_delivery_log_success
+            ON delivery_log (subscription_id, status, delivered_at)
+        ''')
+        
+        # Дневные агрегаты доставок: остаются после очистки сырых записей, из них читают дашборд и API
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'delivery_log_daily'")
+        rollups_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS delivery_log_daily (
+                day TEXT NOT NULL,
+                subscription_id INTEGER NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                successes INTEGER DEFAULT 0,
+                errors INTEGER DEFAULT 0,
+                message_count INTEGER DEFAULT 0,
+                last_delivered_at TIMESTAMP DEFAULT NULL,
+                PRIMARY KEY (day, subscription_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_delivery_log_daily_subscription
+            ON delivery_log_daily (subscription_id, day)
+        ''')
+        if not rollups_exist:
+            # Миграция: агрегаты по уже накопленному журналу
+            cursor.execute('''
+                INSERT INTO delivery_log_daily (day, subscription_id, attempts, successes, errors,
+                                                message_count, last_delivered_at)
+                SELECT date(delivered_at), subscription_id, COUNT(*), SUM(status = 'success'),
+                       SUM(status != 'success'), SUM(COALESCE(message_count, 0)), MAX(delivered_at)
+                FROM delivery_log
+                GROUP BY date(delivered_at), subscription_id
+            ''')
+            if cursor.rowcount > 0:
+                logger.info(f"✅ Построены дневные агрегаты журнала доставок: {cursor.rowcount} строк")
+    
+    def _backfill_next_run_at(self, cursor):
+        """Заполняет next_run_at у подписок, созданных до появления поля"""
+        cursor.execute('''
+            SELECT id, schedule_time, frequency, weekday, timezone
+            FROM subscriptions
+            WHERE is_active = 1 AND next_run_at IS NULL
+        ''')
+        rows = cursor.fetchall()
+        now = datetime.utcnow()
+        for sub_id, schedule_time, frequency, weekday, timezone in rows:
+            next_run_at = compute_next_run_at(schedule_time, frequency, weekday, timezone, now)
+            cursor.execute('UPDATE subscriptions SET next_run_at = ? WHERE id = ?',
+                           (next_run_at.strftime(RUN_AT_FORMAT), sub_id))
+        if rows:
+            logger.info(f"✅ Рассчитано время следующего запуска для {len(rows)} подписок")
+    
+    def _backfill_subscription_channels(self, cursor):
+        """Переносит каналы из JSON-поля channels в subscription_channels для подписок без строк в таблице"""
+        cursor.execute('''
+            SELECT id, channels FROM subscriptions
+            WHERE NOT EXISTS (SELECT 1 FROM subscription_channels WHERE subscription_id = subscriptions.id)
+        ''')
+        rows = cursor.fetchall()
+        for sub_id, channels in rows:
+            channels = json.loads(channels)
+            labels = [normalize_channel_label(label) for label in channels]
+            if labels != channels:
+                cursor.execute('UPDATE subscriptions SET channels = ? WHERE id = ?', (json.dumps(labels), sub_id))
+            self._write_subscription_channels(cursor, sub_id, labels)
+        if rows:
+            logger.info(f"✅ Каналы {len(rows)} подписок перенесены в таблицу subscription_channels")
+    
+    def _normalize_channel_labels(self, cursor):
+        """Приводит к normalize_channel_label имена каналов, сохраненные до нормализации при записи"""
+        cursor.execute('''
+            SELECT DISTINCT subscription_id FROM subscription_channels
+            WHERE substr(channel_label, 1, 1) IN ('~', '#')
+               OR trim(channel_label, ' ' || char(9, 10, 13)) != channel_label
+        ''')
+        sub_ids = [row[0] for row in cursor.fetchall()]
+        for sub_id in sub_ids:
+            cursor.execute('SELECT channels FROM subscriptions WHERE id = ?', (sub_id,))
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            labels = [normalize_channel_label(label) for label in json.loads(row[0])]
+            # Найденные ID каналов сохраняем: ~general и general после нормализации - одна строка
+            cursor.execute('''
+                SELECT channel_label, channel_id, display_name FROM subscription_channels
+                WHERE subscription_id = ? AND channel_id IS NOT NULL
+            ''', (sub_id,))
+            resolved = {
+                normalize_channel_label(label): {'id': channel_id, 'display_name': display_name}
+                for label, channel_id, display_name in cursor.fetchall()
+            }
+            cursor.execute('UPDATE subscriptions SET channels = ? WHERE id = ?', (json.dumps(labels), sub_id))
+            self._write_subscription_channels(cursor, sub_id, labels, resolved)
+        if sub_ids:
+            logger.info(f"✅ Имена каналов нормализованы в {len(sub_ids)} подписках")
+    
+    async def create_subscription(self, user_id: str, username: str, channels: List[str],
+                                  schedule_time: str, frequency: str, weekday: int = None,
+                                  timezone: str = "Europe/Moscow",
+                                  resolved_channels: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        """
+        Создание новой подписки
+        
+        resolved_channels - уже найденные каналы {имя из подписки: информация о канале},
+        их ID сохраняются, чтобы не искать каналы по имени при каждом запуске.
+        Имена каналов сохраняются нормализованными (normalize_channel_label).
+        """
+        channels = [normalize_channel_label(label) for label in channels]
+        resolved_channels = {
+            normalize_channel_label(label): channel_info for label, channel_info in (resolved_channels or {}).items()
+        }
+        
+        def upsert(conn):
+            cursor = conn.cursor()
+            
+            # Проверяем, не существует ли уже подписка для этого пользователя
+            cursor.execute('''
+                SELECT id FROM subscriptions 
+                WHERE user_id = ? AND is_active = 1
+            ''', (user_id,))
+            
+            existing = cursor.fetchone()
+            if existing:
+                # Обновляем существующую подписку
                 cursor.execute('''
-                    SELECT id FROM subscriptions 
+                    UPDATE subscriptions 
+                    SET channels = ?, schedule_time = ?, frequency = ?, 
+                        weekday = ?, timezone = ?, next_run_at = ?, updated_at = CURRENT_TIMESTAMP
                     WHERE user_id = ? AND is_active = 1
-                ''', (user_id,))
-                
-                existing = cursor.fetchone()
-                if existing:
-                    # Обновляем существующую подписку
-                    cursor.execute('''
-                        UPDATE subscriptions 
-                        SET channels = ?, schedule_time = ?, frequency = ?, 
-                            weekday = ?, timezone = ?, updated_at = CURRENT_TIMESTAMP
-                        WHERE user_id = ? AND is_active = 1
-                    ''', (json.dumps(channels), schedule_time, frequency, weekday, timezone, user_id))
-                    logger.info(f"✅ Подписка для пользователя {username} обновлена")
-                else:
-                    # Создаем новую подписку
-                    cursor.execute('''
-                        INSERT INTO subscriptions (user_id, username, channels, schedule_time, frequency, weekday, timezone)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (user_id, username, json.dumps(channels), schedule_time, frequency, weekday, timezone))
-                    logger.info(f"✅ Создана новая подписка для пользователя {username}")
-                
-                conn.commit()
-                return True
+                ''', (json.dumps(channels), schedule_time, frequency, weekday, timezone, next_run_at, user_id))
+                subscription_id = existing[0]
+                logger.info(f"✅ Подписка для пользователя {username} обновлена")
+            else:
+                # Создаем новую подписку
+                cursor.execute('''
+                    INSERT INTO subscriptions (user_id, username, channels, schedule_time, frequency, weekday,
+                                               timezone, next_run_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, username, json.dumps(channels), schedule_time, frequency, weekday, timezone,
+                      next_run_at))
+                subscription_id = cursor.lastrowid
+                logger.info(f"✅ Создана новая подписка для пользователя {username}")
+            
+            self._write_subscription_channels(cursor, subscription_id, channels, resolved_channels)
+        
+        try:
+            next_run_at = compute_next_run_at(
+                schedule_time, frequency, weekday, timezone, datetime.utcnow()
+            ).strftime(RUN_AT_FORMAT)
+            await self.db.run(upsert)
+            
+            self._notify_change()
+            return True
                 
         except Exception as e:
             logger.error(f"❌ Ошибка создания подписки: {e}")
             return False
     
-    def get_user_subscriptions(self, user_id: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _write_subscription_channels(cursor, subscription_id: int, channels: List[str],
+                                     resolved_channels: Optional[Dict[str, Dict[str, Any]]] = None):
+        """Заменяет каналы подписки в таблице subscription_channels (имена уже нормализованы)"""
+        resolved_channels = resolved_channels or {}
+        resolved_at = datetime.utcnow().strftime(RUN_AT_FORMAT)
+        cursor.execute('DELETE FROM subscription_channels WHERE subscription_id = ?', (subscription_id,))
+        rows = []
+        for position, label in enumerate(channels):
+            channel_info = resolved_channels.get(label) or {}
+            channel_id = channel_info.get('id')
+            rows.append((subscription_id, position, label, channel_id,
+                         channel_info.get('display_name') if channel_id else None,
+                         resolved_at if channel_id else None))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO subscription_channels
+                (subscription_id, position, channel_label, channel_id, display_name, resolved_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+    
+    async def save_channel_resolutions(self, subscription_id: int,
+                                       resolutions: List[Tuple[int, str, Optional[str], Optional[str]]]):
+        """
+        Сохраняет найденные (или переставшие находиться) ID каналов подписки
+        
+        Args:
+            resolutions: (позиция, имя из подписки, ID канала или None, отображаемое имя)
+        """
+        if not resolutions:
+            return
+        
+        resolved_at = datetime.utcnow().strftime(RUN_AT_FORMAT)
+        rows = [
+            (subscription_id, position, normalize_channel_label(label), channel_id,
+             display_name if channel_id else None, resolved_at if channel_id else None)
+            for position, label, channel_id, display_name in resolutions
+        ]
+        
+        def upsert(conn):
+            conn.executemany('''
+                INSERT INTO subscription_channels
+                    (subscription_id, position, channel_label, channel_id, display_name, resolved_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (subscription_id, channel_label) DO UPDATE SET
+                    channel_id = excluded.channel_id,
+                    display_name = excluded.display_name,
+                    resolved_at = excluded.resolved_at
+            ''', rows)
+        
+        try:
+            await self.db.run(upsert)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения каналов подписки {subscription_id}: {e}")
+    
+    @staticmethod
+    def _attach_resolved_channels(cursor, subscriptions: List[Dict[str, Any]]):
+        """Добавляет к подпискам сохраненные ID каналов: resolved_channels = {имя: {id, display_name}}"""
+        by_id = {}
+        for subscription in subscriptions:
+            subscription['resolved_channels'] = {}
+            by_id[subscription['id']] = subscription
+        ids = list(by_id)
+        for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+            chunk = ids[start:start + QUERY_CHUNK_SIZE]
+            cursor.execute(f'''
+                SELECT subscription_id, channel_label, channel_id, display_name
+                FROM subscription_channels
+                WHERE channel_id IS NOT NULL AND subscription_id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            for subscription_id, label, channel_id, display_name in cursor.fetchall():
+                by_id[subscription_id]['resolved_channels'][label] = {'id': channel_id, 'display_name': display_name}
+    
+    async def _find_subscriptions_by(self, condition: str, value: str) -> List[Dict[str, Any]]:
+        """
+        Активные подписки, включающие канал, - поиск по индексу subscription_channels
+        
+        Форма записей та же, что у get_all_subscriptions.
+        """
+        def query(conn):
+            cursor = conn.execute(f'''
+                SELECT {', '.join(SUBSCRIPTION_LIST_COLUMNS)}
+                FROM subscriptions
+                WHERE is_active = 1 AND id IN (
+                    SELECT subscription_id FROM subscription_channels WHERE {condition}
+                )
+                ORDER BY created_at DESC, id DESC
+            ''', (value,))
+            return [_subscription_from_row(row) for row in cursor.fetchall()]
+        
+        try:
+            return await self.db.run(query)
+        except Exception as e:
+            logger.error(f"❌ Ошибка поиска подписок по каналу {value}: {e}")
+            return []
+    
+    async def get_subscriptions_by_channel(self, channel_id: str) -> List[Dict[str, Any]]:
+        """Активные подписки, включающие канал с данным ID"""
+        return await self._find_subscriptions_by('channel_id = ?', channel_id)
+    
+    async def get_subscriptions_by_channel_label(self, channel_label: str) -> List[Dict[str, Any]]:
+        """Активные подписки, в которых канал указан под данным именем (general, ~general и #General - одно имя)"""
+        return await self._find_subscriptions_by('channel_label = ? COLLATE NOCASE',
+                                                 normalize_channel_label(channel_label))
+    
+    async def forget_channel(self, channel_id: str) -> int:
+        """
+        Сбрасывает сохраненный ID канала (канал удален или бот исключен из него)
+        
+        При следующем запуске подписки канал будет найден по имени заново.
+        Returns:
+            Сколько строк подписок затронуто
+        """
+        def update(conn):
+            return conn.execute('''
+                UPDATE subscription_channels
+                SET channel_id = NULL, display_name = NULL, resolved_at = NULL
+                WHERE channel_id = ?
+            ''', (channel_id,)).rowcount
+        
+        try:
+            return await self.db.run(update)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сброса канала {channel_id} в подписках: {e}")
+            return 0
+    
+    async def rename_channel(self, channel_id: str, display_name: str) -> int:
+        """Обновляет отображаемое имя канала во всех подписках (канал переименован)"""
+        def update(conn):
+            return conn.execute('''
+                UPDATE subscription_channels SET display_name = ?
+                WHERE channel_id = ? AND display_name IS NOT ?
+            ''', (display_name, channel_id, display_name)).rowcount
+        
+        try:
+            return await self.db.run(update)
+        except Exception as e:
+            logger.error(f"❌ Ошибка переименования канала {channel_id} в подписках: {e}")
+            return 0
+    
+    async def get_user_subscriptions(self, user_id: str) -> List[Dict[str, Any]]:
         """Получение подписок пользователя"""
+        def query(conn):
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, channels, schedule_time, frequency, weekday, timezone, created_at, updated_at
+                FROM subscriptions 
+                WHERE user_id = ? AND is_active = 1
+            ''', (user_id,))
+            
+            subscriptions = []
+            for row in cursor.fetchall():
+                subscriptions.append({
+                    'id': row[0],
+                    'channels': json.loads(row[1]),
+                    'schedule_time': row[2],
+                    'frequency': row[3],
+                    'weekday': row[4],
+                    'timezone': row[5],
+                    'created_at': row[6],
+                    'updated_at': row[7]
+                })
+            
+            return subscriptions
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT id, channels, schedule_time, frequency, weekday, timezone, created_at, updated_at
-                    FROM subscriptions 
-                    WHERE user_id = ? AND is_active = 1
-                ''', (user_id,))
-                
-                subscriptions = []
-                for row in cursor.fetchall():
-                    subscriptions.append({
-                        'id': row[0],
-                        'channels': json.loads(row[1]),
-                        'schedule_time': row[2],
-                        'frequency': row[3],
-                        'weekday': row[4],
-                        'timezone': row[5],
-                        'created_at': row[6],
-                        'updated_at': row[7]
-                    })
-                
-                return subscriptions
-                
+            return await self.db.run(query)
         except Exception as e:
             logger.error(f"❌ Ошибка получения подписок: {e}")
             return []
     
-    def delete_subscription(self, user_id: str, subscription_id: Optional[int] = None) -> bool:
+    async def delete_subscription(self, user_id: str, subscription_id: Optional[int] = None) -> bool:
         """Удаление подписки"""
+        def update(conn):
+            if subscription_id:
+                # Удаляем конкретную подписку
+                conn.execute('''
+                    UPDATE subscriptions 
+                    SET is_active = 0, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND user_id = ?
+                ''', (subscription_id, user_id))
+            else:
+                # Удаляем все подписки пользователя
+                conn.execute('''
+                    UPDATE subscriptions 
+                    SET is_active = 0, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                ''', (user_id,))
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                if subscription_id:
-                    # Удаляем конкретную подписку
-                    cursor.execute('''
-                        UPDATE subscriptions 
-                        SET is_active = 0, updated_at = CURRENT_TIMESTAMP
-                        WHERE id = ? AND user_id = ?
-                    ''', (subscription_id, user_id))
-                else:
-                    # Удаляем все подписки пользователя
-                    cursor.execute('''
-                        UPDATE subscriptions 
-                        SET is_active = 0, updated_at = CURRENT_TIMESTAMP
-                        WHERE user_id = ?
-                    ''', (user_id,))
-                
-                conn.commit()
-                return True
+            await self.db.run(update)
+            
+            self._notify_change()
+            return True
                 
         except Exception as e:
             logger.error(f"❌ Ошибка удаления подписки: {e}")
             return False
     
-    def get_due_subscriptions(self, current_time: datetime = None) -> List[Dict[str, Any]]:
-        """Получение подписок, которые нужно выполнить"""
+    async def get_due_subscriptions(self, current_time: datetime = None,
+                                    missed_run_grace: int = 3600) -> List[Dict[str, Any]]:
+        """
+        Получение подписок, которые нужно выполнить
+        
+        Выбираются только подписки с наступившим next_run_at (по индексу).
+        Запуски, пропущенные дольше чем на missed_run_grace секунд (бот был
+        остановлен), и уже доставленные в этом периоде сводки не выполняются -
+        у таких подписок сразу пересчитывается next_run_at. Последние доставки
+        всех кандидатов читаются одним запросом, все делается одним обращением
+        к потоку базы.
+        
+        Ошибка базы пробрасывается: пустой список означал бы "ничего не наступило",
+        и планировщик не узнал бы, что подписки не перенесены.
+        """
         if current_time is None:
             current_time = datetime.utcnow()
         
+        def query(conn):
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, user_id, username, channels, schedule_time, frequency, weekday, timezone, next_run_at
+                FROM subscriptions 
+                WHERE is_active = 1 AND next_run_at <= ?
+                ORDER BY next_run_at
+            ''', (current_time.strftime(RUN_AT_FORMAT),))
+            
+            subscriptions = [self._scheduled_subscription(row) for row in cursor.fetchall()]
+            self._attach_resolved_channels(cursor, subscriptions)
+            last_successes = self._last_successes(cursor, [subscription['id'] for subscription in subscriptions])
+            
+            due_subscriptions = []
+            skipped = []
+            
+            for subscription in subscriptions:
+                lateness = (current_time - subscription['next_run_at']).total_seconds()
+                if lateness > missed_run_grace:
+                    logger.warning(f"⏭️ Подписка ID={subscription['id']} пропущена: запуск просрочен на {lateness:.0f}s")
+                    skipped.append(subscription)
+                    continue
+                
+                # Защита от повторной отправки за день/неделю
+                if self._delivered_in_period(subscription, last_successes.get(subscription['id']), current_time):
+                    logger.info(f"📊 Подписка ID={subscription['id']} уже доставлена в этом периоде")
+                    skipped.append(subscription)
+                    continue
+                
+                due_subscriptions.append(subscription)
+            
+            self._reschedule(cursor, skipped, current_time)
+            logger.info(f"📊 Наступило подписок: {len(subscriptions)}, к выполнению: {len(due_subscriptions)}")
+            return due_subscriptions
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT id, user_id, username, channels, schedule_time, frequency, weekday, timezone
-                    FROM subscriptions 
-                    WHERE is_active = 1
-                ''')
-                
-                all_subscriptions = cursor.fetchall()
-                logger.info(f"📊 Найдено {len(all_subscriptions)} активных подписок")
-                
-                due_subscriptions = []
-                
-                for row in all_subscriptions:
-                    subscription = {
-                        'id': row[0],
-                        'user_id': row[1],
-                        'username': row[2],
-                        'channels': json.loads(row[3]),
-                        'schedule_time': row[4],
-                        'frequency': row[5],
-                        'weekday': row[6],
-                        'timezone': row[7]
-                    }
-                    
-                    logger.info(f"🔍 Проверка подписки ID={subscription['id']}, user={subscription['username']}, time={subscription['schedule_time']}, freq={subscription['frequency']}")
-                    
-                    # Проверяем, нужно ли выполнить эту подписку
-                    if self._should_execute_subscription(subscription, current_time):
-                        logger.info(f"✅ Подписка ID={subscription['id']} готова к выполнению")
-                        due_subscriptions.append(subscription)
-                    else:
-                        logger.info(f"⏳ Подписка ID={subscription['id']} не готова к выполнению")
-                
-                return due_subscriptions
-                
+            return await self.db.run(query)
         except Exception as e:
             logger.error(f"❌ Ошибка получения подписок для выполнения: {e}")
+            raise
+    
+    @staticmethod
+    def _scheduled_subscription(row: tuple) -> Dict[str, Any]:
+        """Подписка из строки (id, user_id, username, channels, schedule_time, frequency, weekday, timezone, next_run_at)"""
+        return {
+            'id': row[0],
+            'user_id': row[1],
+            'username': row[2],
+            'channels': json.loads(row[3]),
+            'schedule_time': row[4],
+            'frequency': row[5],
+            'weekday': row[6],
+            'timezone': row[7],
+            'next_run_at': datetime.fromisoformat(row[8])
+        }
+    
+    async def get_scheduled_subscriptions(self, subscription_ids: List[int]) -> List[Dict[str, Any]]:
+        """Активные подписки с расписанием по списку id (для предрасчета сводок)"""
+        if not subscription_ids:
+            return []
+        
+        def query(conn):
+            cursor = conn.cursor()
+            subscriptions = []
+            for start in range(0, len(subscription_ids), QUERY_CHUNK_SIZE):
+                chunk = subscription_ids[start:start + QUERY_CHUNK_SIZE]
+                cursor.execute(f'''
+                    SELECT id, user_id, username, channels, schedule_time, frequency, weekday, timezone, next_run_at
+                    FROM subscriptions
+                    WHERE is_active = 1 AND next_run_at IS NOT NULL AND id IN ({','.join('?' * len(chunk))})
+                ''', chunk)
+                subscriptions.extend(self._scheduled_subscription(row) for row in cursor.fetchall())
+            self._attach_resolved_channels(cursor, subscriptions)
+            return subscriptions
+        
+        try:
+            return await self.db.run(query)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения подписок по списку: {e}")
             return []
     
-    def _should_execute_subscription(self, subscription: Dict[str, Any], current_time: datetime) -> bool:
-        """Проверяет, нужно ли выполнить подписку"""
+    @staticmethod
+    def _reschedule(cursor, subscriptions: List[Dict[str, Any]], after: datetime) -> List[datetime]:
+        """Пересчитывает next_run_at подписок одним executemany"""
+        next_runs = [
+            # Не раньше текущего запланированного времени, чтобы не повторить тот же запуск
+            compute_next_run_at(
+                subscription['schedule_time'], subscription['frequency'], subscription.get('weekday'),
+                subscription['timezone'], max(after, subscription.get('next_run_at') or after)
+            )
+            for subscription in subscriptions
+        ]
+        cursor.executemany('UPDATE subscriptions SET next_run_at = ? WHERE id = ?', [
+            (next_run_at.strftime(RUN_AT_FORMAT), subscription['id'])
+            for next_run_at, subscription in zip(next_runs, subscriptions)
+        ])
+        return next_runs
+    
+    async def reschedule(self, subscription: Dict[str, Any], after: datetime) -> Optional[datetime]:
+        """Переносит next_run_at подписки на ближайший запуск после after (UTC)"""
         try:
-            sub_id = subscription['id']
-            logger.info(f"🔍 Проверка подписки ID={sub_id}")
-            
-            # Конвертируем время в нужный часовой пояс
-            user_tz = pytz.timezone(subscription['timezone'])
-            # Сначала устанавливаем timezone как UTC, затем конвертируем в пользовательский часовой пояс
-            user_time = current_time.replace(tzinfo=pytz.UTC).astimezone(user_tz)
-            logger.info(f"🕐 Текущее время пользователя: {user_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            
-            # Парсим время из подписки (формат HH:MM)
-            schedule_time_str = subscription['schedule_time']
-            hour, minute = map(int, schedule_time_str.split(':'))
-            logger.info(f"⏰ Время подписки: {schedule_time_str} ({hour}:{minute})")
-            
-            # Создаем время выполнения на сегодня
-            schedule_time = user_time.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            logger.info(f"📅 Время выполнения: {schedule_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            
-            # Проверяем, что время подошло (с точностью до минуты)
-            time_diff = abs((user_time - schedule_time).total_seconds())
-            logger.info(f"⏱️ Разница во времени: {time_diff:.1f} секунд")
-            
-            if time_diff > 60:  # Больше минуты разница
-                logger.info(f"⏸️ Время ещё не подошло (разница {time_diff:.1f}s > 60s)")
-                return False
-            
-            logger.info(f"✅ Время подошло! Разница: {time_diff:.1f} секунд")
-            
-            # Проверяем частоту выполнения
-            frequency = subscription['frequency']
-            weekday = subscription.get('weekday')
-            logger.info(f"🔄 Частота: {frequency}, день недели: {weekday}")
-            
-            if frequency == 'daily':
-                # Проверяем, была ли уже отправка сегодня
-                was_delivered = self._was_delivered_today(subscription['id'], user_time)
-                logger.info(f"📊 Была ли отправка сегодня: {was_delivered}")
-                return not was_delivered
-            elif frequency == 'weekly':
-                # Для еженедельных подписок проверяем день недели
-                if weekday is not None:
-                    # Проверяем, что сегодня именно тот день недели
-                    # weekday: 0 = понедельник, 6 = воскресенье
-                    current_weekday = user_time.weekday()
-                    logger.info(f"📅 Сегодня: {current_weekday}, требуется: {weekday}")
-                    if current_weekday != weekday:
-                        logger.info(f"⏸️ Не тот день недели ({current_weekday} != {weekday})")
-                        return False
-                
-                # Проверяем, была ли отправка на этой неделе
-                was_delivered = self._was_delivered_this_week(subscription['id'], user_time)
-                logger.info(f"📊 Была ли отправка на этой неделе: {was_delivered}")
-                return not was_delivered
+            return (await self.db.run(lambda conn: self._reschedule(conn.cursor(), [subscription], after)))[0]
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересчета времени запуска подписки {subscription.get('id')}: {e}")
+            return None
+    
+    async def get_next_runs(self, subscription_ids: Optional[List[int]] = None) -> List[Tuple[datetime, int]]:
+        """Пары (next_run_at, id) активных подписок - всех или только указанных (ошибка базы пробрасывается)"""
+        if subscription_ids is not None and not subscription_ids:
+            return []
+        
+        def query(conn):
+            cursor = conn.cursor()
             
-            logger.info(f"❌ Неизвестная частота: {frequency}")
-            return False
+            query = '''
+                SELECT next_run_at, id FROM subscriptions
+                WHERE is_active = 1 AND next_run_at IS NOT NULL
+            '''
+            if subscription_ids is None:
+                chunks = [()]
+            else:
+                chunks = [tuple(subscription_ids[start:start + QUERY_CHUNK_SIZE])
+                          for start in range(0, len(subscription_ids), QUERY_CHUNK_SIZE)]
             
+            runs = []
+            for chunk in chunks:
+                chunk_query = query + f" AND id IN ({','.join('?' * len(chunk))})" if chunk else query
+                cursor.execute(chunk_query, chunk)
+                runs.extend((datetime.fromisoformat(run_at), sub_id) for run_at, sub_id in cursor.fetchall())
+            return runs
+        
+        try:
+            return await self.db.run(query)
         except Exception as e:
-            logger.error(f"❌ Ошибка проверки выполнения подписки: {e}")
+            logger.error(f"❌ Ошибка получения расписания подписок: {e}")
+            raise
+    
+    @staticmethod
+    def _last_successes(cursor, subscription_ids: List[int]) -> Dict[int, str]:
+        """Время последней успешной доставки (UTC, как в delivered_at) для каждой подписки из списка"""
+        last_successes = {}
+        for start in range(0, len(subscription_ids), QUERY_CHUNK_SIZE):
+            chunk = subscription_ids[start:start + QUERY_CHUNK_SIZE]
+            cursor.execute(LAST_SUCCESS_QUERY.format(placeholders=','.join('?' * len(chunk))), chunk)
+            last_successes.update(cursor.fetchall())
+        return last_successes
+    
+    @staticmethod
+    def _delivered_in_period(subscription: Dict[str, Any], last_success: Optional[str],
+                             current_time: datetime) -> bool:
+        """
+        Была ли успешная доставка сегодня (daily) или на этой неделе (weekly)
+        
+        delivered_at хранится в UTC в формате CURRENT_TIMESTAMP; день и неделя
+        считаются по часовому поясу подписки.
+        """
+        if not last_success:
             return False
+        tz = pytz.timezone(subscription['timezone'])
+        user_today = current_time.replace(tzinfo=pytz.UTC).astimezone(tz).date()
+        delivered_day = datetime.fromisoformat(last_success[:19]).replace(tzinfo=pytz.UTC).astimezone(tz).date()
+        
+        period_start = user_today
+        if subscription['frequency'] != 'daily':
+            # Начало недели (понедельник)
+            period_start -= timedelta(days=user_today.weekday())
+        return period_start <= delivered_day <= user_today
     
-    def _was_delivered_today(self, subscription_id: int, current_time: datetime) -> bool:
-        """Проверяет, была ли отправка сегодня"""
+    async def log_delivery(self, subscription_id: int, status: str, message_count: int = 0, 
+                           error_message: Optional[str] = None):
+        """Логирование доставки сводки (сырая запись и дневной агрегат в одной транзакции)"""
+        delivered_at = datetime.utcnow().strftime(RUN_AT_FORMAT)
+        
+        def insert(conn):
+            conn.execute('''
+                INSERT INTO delivery_log (subscription_id, status, message_count, error_message, delivered_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (subscription_id, status, message_count, error_message, delivered_at))
+            success = 1 if status == 'success' else 0
+            conn.execute('''
+                INSERT INTO delivery_log_daily (day, subscription_id, attempts, successes, errors,
+                                                message_count, last_delivered_at)
+                VALUES (?, ?, 1, ?, ?, ?, ?)
+                ON CONFLICT (day, subscription_id) DO UPDATE SET
+                    attempts = attempts + 1,
+                    successes = successes + excluded.successes,
+                    errors = errors + excluded.errors,
+                    message_count = message_count + excluded.message_count,
+                    last_delivered_at = excluded.last_delivered_at
+            ''', (delivered_at[:10], subscription_id, success, 1 - success, message_count or 0, delivered_at))
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                today_start = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
-                today_end = current_time.replace(hour=23, minute=59, second=59, microsecond=999999)
-                
-                cursor.execute('''
-                    SELECT id FROM delivery_log 
-                    WHERE subscription_id = ? AND status = 'success' 
-                    AND delivered_at >= ? AND delivered_at <= ?
-                ''', (subscription_id, today_start.isoformat(), today_end.isoformat()))
-                
-                return cursor.fetchone() is not None
-                
+            await self.db.run(insert)
         except Exception as e:
-            logger.error(f"❌ Ошибка проверки отправки за сегодня: {e}")
-            return False
+            logger.error(f"❌ Ошибка логирования доставки: {e}")
     
-    def _was_delivered_this_week(self, subscription_id: int, current_time: datetime) -> bool:
-        """Проверяет, была ли отправка на этой неделе"""
+    async def get_delivery_stats(self, days: int = 7,
+                                 subscription_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Статистика доставок за последние days суток (UTC) из дневных агрегатов
+        
+        Returns:
+            totals - суммы по всем подпискам, subscriptions - по каждой подписке
+        """
+        since = (datetime.utcnow() - timedelta(days=max(days, 1) - 1)).strftime('%Y-%m-%d')
+        
+        def query(conn):
+            params = [since]
+            condition = 'day >= ?'
+            if subscription_id is not None:
+                condition += ' AND subscription_id = ?'
+                params.append(subscription_id)
+            cursor = conn.execute(f'''
+                SELECT subscription_id, SUM(attempts), SUM(successes), SUM(errors), SUM(message_count),
+                       MAX(last_delivered_at)
+                FROM delivery_log_daily
+                WHERE {condition}
+                GROUP BY subscription_id
+                ORDER BY subscription_id
+            ''', params)
+            return [
+                {
+                    'subscription_id': row[0],
+                    'attempts': row[1],
+                    'successes': row[2],
+                    'errors': row[3],
+                    'message_count': row[4],
+                    'last_delivered_at': row[5],
+                }
+                for row in cursor.fetchall()
+            ]
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Начало недели (понедельник)
-                week_start = current_time - timedelta(days=current_time.weekday())
-                week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
-                
-                cursor.execute('''
-                    SELECT id FROM delivery_log 
-                    WHERE subscription_id = ? AND status = 'success' 
-                    AND delivered_at >= ?
-                ''', (subscription_id, week_start.isoformat()))
-                
-                return cursor.fetchone() is not None
-                
+            subscriptions = await self.db.run(query)
         except Exception as e:
-            logger.error(f"❌ Ошибка проверки отправки за неделю: {e}")
-            return False
+            logger.error(f"❌ Ошибка получения статистики доставок: {e}")
+            subscriptions = []
+        
+        totals = {key: sum(item[key] for item in subscriptions)
+                  for key in ('attempts', 'successes', 'errors', 'message_count')}
+        return {'days': days, 'totals': totals, 'subscriptions': subscriptions}
     
-    def log_delivery(self, subscription_id: int, status: str, message_count: int = 0, 
-                    error_message: Optional[str] = None):
-        """Логирование доставки сводки"""
+    async def compact_delivery_log(self, retention_days: int, batch_size: int = 500) -> int:
+        """
+        Удаляет сырые записи журнала доставок старше retention_days суток
+        
+        Удаление идет пачками по batch_size строк, каждая пачка - отдельная
+        короткая транзакция: между ними поток базы успевает выполнить остальные
+        запросы. Дневные агрегаты за удаленные дни остаются.
+        
+        Returns:
+            Сколько записей удалено
+        """
+        if retention_days <= 0:
+            return 0
+        retention_days = max(retention_days, MIN_DELIVERY_LOG_RETENTION_DAYS)
+        cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime(RUN_AT_FORMAT)
+        
+        def delete_batch(conn):
+            # Старые записи лежат в начале таблицы: обход по id заканчивается, как только набрана пачка
+            return conn.execute('''
+                DELETE FROM delivery_log WHERE id IN (
+                    SELECT id FROM delivery_log WHERE delivered_at < ? ORDER BY id LIMIT ?
+                )
+            ''', (cutoff, batch_size)).rowcount
+        
+        deleted = 0
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT INTO delivery_log (subscription_id, status, message_count, error_message)
-                    VALUES (?, ?, ?, ?)
-                ''', (subscription_id, status, message_count, error_message))
-                
-                conn.commit()
-                
+            while True:
+                removed = await self.db.run(delete_batch)
+                deleted += removed
+                if removed < batch_size:
+                    break
+                await asyncio.sleep(0)
         except Exception as e:
-            logger.error(f"❌ Ошибка логирования доставки: {e}")
+            logger.error(f"❌ Ошибка очистки журнала доставок: {e}")
+        
+        if deleted:
+            logger.info(f"🧹 Из журнала доставок удалено {deleted} записей старше {retention_days} дней")
+        return deleted
     
-    def get_all_subscriptions(self) -> List[Dict[str, Any]]:
+    async def get_all_subscriptions(self) -> List[Dict[str, Any]]:
         """Получение всех активных подписок"""
+        def query(conn):
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                SELECT {', '.join(SUBSCRIPTION_LIST_COLUMNS)}
+                FROM subscriptions 
+                WHERE is_active = 1
+                ORDER BY created_at DESC, id DESC
+            ''')
+            
+            return [_subscription_from_row(row) for row in cursor.fetchall()]
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT id, user_id, username, channels, schedule_time, frequency, weekday, timezone, 
-                           created_at, updated_at
-                    FROM subscriptions 
-                    WHERE is_active = 1
-                    ORDER BY created_at DESC
-                ''')
-                
-                subscriptions = []
-                for row in cursor.fetchall():
-                    subscriptions.append({
-                        'id': row[0],
-                        'user_id': row[1],
-                        'username': row[2],
-                        'channels': json.loads(row[3]),
-                        'schedule_time': row[4],
-                        'frequency': row[5],
-                        'weekday': row[6],
-                        'timezone': row[7],
-                        'created_at': row[8],
-                        'updated_at': row[9]
-                    })
-                
-                return subscriptions
-                
+            return await self.db.run(query)
         except Exception as e:
             logger.error(f"❌ Ошибка получения всех подписок: {e}")
             return []
     
-    def get_message_collection_period(self, subscription: Dict[str, Any]) -> tuple:
+    def get_message_collection_period(self, subscription: Dict[str, Any],
+                                      current_time: Optional[datetime] = None) -> tuple:
         """
         Определяет период сбора сообщений для подписки с учетом дня недели
+        current_time - момент запуска (UTC, без tzinfo), по умолчанию - сейчас
         Возвращает (start_time, end_time) в UTC
         """
         try:
@@ -395,7 +906,7 @@ class SubscriptionManager:
             
             # Получаем текущее время в часовом поясе пользователя
             user_tz = pytz.timezone(timezone)
-            current_time = datetime.utcnow().replace(tzinfo=pytz.UTC).astimezone(user_tz)
+            current_time = (current_time or datetime.utcnow()).replace(tzinfo=pytz.UTC).astimezone(user_tz)
             
             if frequency == 'daily':
                 # Для ежедневных подписок - с вчерашнего времени до сейчас
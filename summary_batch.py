@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Пакетная суммаризация выгруженных данных Mattermost
+
+Читает bulk-export (JSONL) или каталог JSON-файлов с тредами, прогоняет их
+через тот же конвейер (сжатие, форматирование, LLMClient) и пишет саммари в
+JSONL. Подходит для заполнения архивов и регрессионной проверки промптов.
+
+Разбор выполняется в пуле процессов, запросы к LLM - параллельно в цикле
+событий. Сжатие делает LLMClient, как и в боте: статистика канала считается
+по исходным сообщениям, а дубли ищутся по всему элементу (треду или дню
+канала). message_count - число исходных сообщений элемента. Повторный запуск с тем же --output пропускает уже готовые
+саммари (ошибочные записи обрабатываются заново). Файл, который не удалось
+разобрать, попадает в выход записью с error; при фатальной ошибке процесс
+завершается с кодом 1.
+
+В режиме channels разобранные части сначала складываются во временную
+SQLite-базу, затем дни читаются с диска по мере суммаризации.
+
+Запуск:
+    python -m summary_batch export.jsonl --output summaries.jsonl
+    python -m summary_batch threads_dir/ --output summaries.jsonl --concurrency 32
+    python -m summary_batch export.jsonl --mode channels --output channels.jsonl
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from config import Config
+from llm_client import LLMClient
+
+logger = logging.getLogger(__name__)
+
+# Строк bulk-export на одну задачу пула процессов
+CHUNK_LINES = 2000
+
+
+def _item_id(*parts: Any) -> str:
+    return hashlib.sha1("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+
+
+def _export_message(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Сообщение bulk-export в формате бота"""
+    return {
+        'username': data.get('user') or 'Неизвестный пользователь',
+        'message': data.get('message') or '',
+        'create_at': data.get('create_at') or 0,
+        'files': [os.path.basename(item.get('path', '')) for item in data.get('attachments') or []],
+    }
+
+
+def parse_export_chunk(lines: List[str], mode: str, min_messages: int) -> List[Dict[str, Any]]:
+    """
+    Разбирает часть bulk-export (выполняется в пуле процессов)
+
+    mode=threads - по элементу на тред (пост с ответами);
+    mode=channels - сообщения, сгруппированные по каналу и дню (UTC).
+    """
+    items: Dict[str, Dict[str, Any]] = {}
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(record, dict) or record.get('type') not in ('post', 'direct_post'):
+            continue
+
+        post = record.get(record['type']) or {}
+        channel = post.get('channel') or ",".join(post.get('channel_members') or []) or 'unknown'
+        root = _export_message(post)
+        replies = [_export_message(reply) for reply in post.get('replies') or []]
+
+        if mode == 'threads':
+            if 1 + len(replies) < min_messages:
+                continue
+            item_id = _item_id(post.get('team'), channel, root['username'], root['create_at'])
+            items[item_id] = {
+                'id': item_id,
+                'kind': 'thread',
+                'channel': channel,
+                'messages': [root] + sorted(replies, key=lambda msg: msg['create_at']),
+            }
+        else:
+            for msg in [root] + replies:
+                day = datetime.fromtimestamp(msg['create_at'] / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+                item_id = _item_id(post.get('team'), channel, day)
+                item = items.setdefault(item_id, {
+                    'id': item_id, 'kind': 'channel', 'channel': channel, 'day': day, 'messages': [],
+                })
+                item['messages'].append(msg)
+
+    result = []
+    for item in items.values():
+        item['message_count'] = len(item['messages'])
+        result.append(item)
+    return result
+
+
+def parse_thread_file(path: str, min_messages: int) -> Optional[Dict[str, Any]]:
+    """
+    Разбирает JSON-файл треда (выполняется в пуле процессов)
+
+    Поддерживаются список сообщений или объект {"id", "channel", "messages": [...]};
+    у сообщений поля username (или user), message, create_at.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        raw_messages = data.get('messages') or data.get('posts') or []
+        item_id = str(data.get('id') or data.get('thread_id') or os.path.splitext(os.path.basename(path))[0])
+        channel = data.get('channel') or data.get('channel_name') or ''
+    else:
+        raw_messages = data
+        item_id = os.path.splitext(os.path.basename(path))[0]
+        channel = ''
+
+    messages = [
+        {
+            'username': msg.get('username') or msg.get('user') or 'Неизвестный пользователь',
+            'message': msg.get('message') or '',
+            'create_at': msg.get('create_at') or 0,
+            'from_bot': bool(msg.get('from_bot')),
+        }
+        for msg in raw_messages
+    ]
+    if len(messages) < min_messages:
+        return None
+
+    messages.sort(key=lambda msg: msg['create_at'])
+    return {
+        'id': item_id,
+        'kind': 'thread',
+        'channel': channel,
+        'message_count': len(messages),
+        'messages': messages,
+    }
+
+
+def _file_error_item(path: str, error: Exception) -> Dict[str, Any]:
+    """Элемент с ошибкой разбора файла - пишется в выход вместо саммари"""
+    return {
+        'id': os.path.splitext(os.path.basename(path))[0],
+        'kind': 'thread',
+        'channel': None,
+        'message_count': 0,
+        'source': path,
+        'error': f"{type(error).__name__}: {error}",
+    }
+
+
+def load_done_ids(output_path: str) -> Set[str]:
+    """ID элементов, для которых в выходном файле уже есть саммари"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # недописанная строка после прерванного запуска
+            if record.get('summary') and not record.get('error'):
+                done.add(record['id'])
+    return done
+
+
+def _read_chunks(path: str) -> Iterator[List[str]]:
+    with open(path, encoding='utf-8') as f:
+        chunk = []
+        for line in f:
+            chunk.append(line)
+            if len(chunk) >= CHUNK_LINES:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class _ChannelDaySpool:
+    """
+    Временное хранилище сообщений каналов по дням (SQLite на диске)
+
+    Канал за день может встречаться в любых частях выгрузки (bulk-export не
+    упорядочен по дням), поэтому части складываются на диск и читаются
+    обратно по одному дню - в памяти не держится вся выгрузка.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='summary_batch_', suffix='.db')
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('''
+            CREATE TABLE items (
+                id TEXT PRIMARY KEY,
+                channel TEXT,
+                day TEXT,
+                message_count INTEGER NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE TABLE messages (item_id TEXT NOT NULL, create_at INTEGER, message TEXT)')
+
+    def add(self, items: List[Dict[str, Any]]):
+        with self.conn:
+            self.conn.executemany('''
+                INSERT INTO items (id, channel, day, message_count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET message_count = message_count + excluded.message_count
+            ''', [(item['id'], item['channel'], item['day'], item['message_count']) for item in items])
+            self.conn.executemany(
+                'INSERT INTO messages (item_id, create_at, message) VALUES (?, ?, ?)',
+                [(item['id'], msg['create_at'], json.dumps(msg, ensure_ascii=False))
+                 for item in items for msg in item['messages']]
+            )
+
+    def batches(self, min_messages: int, size: int = 100) -> Iterator[asyncio.Future]:
+        """Готовые элементы порциями - читаются с диска по мере обработки"""
+        self.conn.execute('CREATE INDEX idx_messages_item ON messages (item_id, create_at)')
+        rows = self.conn.execute(
+            'SELECT id, channel, day, message_count FROM items WHERE message_count >= ? ORDER BY day, id',
+            (min_messages,)
+        ).fetchall()
+        for start in range(0, len(rows), size):
+            batch = []
+            for item_id, channel, day, message_count in rows[start:start + size]:
+                messages = [
+                    json.loads(message) for message, in self.conn.execute(
+                        'SELECT message FROM messages WHERE item_id = ? ORDER BY create_at, rowid', (item_id,)
+                    )
+                ]
+                batch.append({
+                    'id': item_id, 'kind': 'channel', 'channel': channel, 'day': day,
+                    'message_count': message_count, 'messages': messages,
+                })
+            yield _ready(batch)
+
+    def close(self):
+        self.conn.close()
+        os.remove(self.path)
+
+
+async def _ready(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return items
+
+
+class BatchSummarizer:
+    """Параллельная суммаризация элементов с записью результатов в JSONL"""
+
+    def __init__(self, llm_client: LLMClient, output_path: str, concurrency: int = 16, prefetch: int = 4):
+        self.llm_client = llm_client
+        self.output_path = output_path
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.prefetch = max(1, prefetch)
+        self.done_ids = load_done_ids(output_path)
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.messages = 0
+        self._output = None
+        self._tasks = set()
+        self._last_report = self.started
+
+    async def run(self, batches: Iterator[Any]):
+        """
+        Обрабатывает элементы по мере разбора входных данных
+
+        Разбор следующих prefetch частей идет в пуле процессов, пока
+        обрабатываются уже разобранные элементы.
+        """
+        self._output = open(self.output_path, 'a', encoding='utf-8')
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(asyncio.ensure_future(batch))
+                if len(pending) >= self.prefetch:
+                    await self._dispatch(await pending.popleft())
+            while pending:
+                await self._dispatch(await pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+            # Уже начатые саммари дописываем и при фатальной ошибке разбора
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._output.close()
+        self.report(final=True)
+
+    async def _dispatch(self, items: List[Optional[Dict[str, Any]]]):
+        for item in items:
+            if item is None:
+                continue
+            if item['id'] in self.done_ids:
+                self.skipped += 1
+                continue
+            if item.get('error'):
+                logger.warning(f"⚠️ Пропускаю {item.get('source') or item['id']}: {item['error']}")
+                self.failed += 1
+                self._write({
+                    'id': item['id'],
+                    'kind': item['kind'],
+                    'source': item.get('source'),
+                    'message_count': item['message_count'],
+                    'summary': None,
+                    'error': item['error'],
+                    'created_at': datetime.now(timezone.utc).isoformat(),
+                })
+                continue
+            await self.semaphore.acquire()
+            task = asyncio.create_task(self._summarize(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, item: Dict[str, Any]):
+        started = time.monotonic()
+        record = {
+            'id': item['id'],
+            'kind': item['kind'],
+            'channel': item.get('channel'),
+            'day': item.get('day'),
+            'message_count': item['message_count'],
+        }
+        try:
+            if item['kind'] == 'thread':
+                summary = await self.llm_client.generate_thread_summary(item['messages'])
+            else:
+                summary = await self.llm_client.generate_channel_summary(item['messages'])
+            failed = not summary or summary.startswith("❌")
+            record['summary'] = None if failed else summary
+            record['error'] = summary if failed else None
+        except Exception as e:
+            failed = True
+            record['summary'] = None
+            record['error'] = str(e)
+        finally:
+            self.semaphore.release()
+
+        record['latency'] = round(time.monotonic() - started, 3)
+        record['created_at'] = datetime.now(timezone.utc).isoformat()
+        self._write(record)
+
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+            self.messages += item['message_count']
+        if time.monotonic() - self._last_report >= 10:
+            self.report()
+
+    def _write(self, record: Dict[str, Any]):
+        self._output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._output.flush()
+
+    def report(self, final: bool = False):
+        """Пишет в лог прогресс и пропускную способность"""
+        self._last_report = time.monotonic()
+        elapsed = max(self._last_report - self.started, 1e-9)
+        prefix = "🏁 Готово" if final else "⏳ Прогресс"
+        logger.info(
+            f"{prefix}: {self.completed} саммари, {self.failed} ошибок, {self.skipped} пропущено "
+            f"за {elapsed:.1f}с ({self.completed / elapsed:.2f} саммари/с, {self.messages / elapsed:.1f} сообщений/с)"
+        )
+
+
+async def _parse_thread_files(loop: asyncio.AbstractEventLoop, pool: ProcessPoolExecutor,
+                              paths: List[str], min_messages: int) -> List[Optional[Dict[str, Any]]]:
+    """Разбирает файлы тредов; ошибка одного файла не прерывает остальные"""
+    futures = [loop.run_in_executor(pool, parse_thread_file, path, min_messages) for path in paths]
+    items = []
+    for path, result in zip(paths, await asyncio.gather(*futures, return_exceptions=True)):
+        if isinstance(result, BrokenProcessPool):
+            raise result
+        items.append(_file_error_item(path, result) if isinstance(result, Exception) else result)
+    return items
+
+
+def _submit_batches(loop: asyncio.AbstractEventLoop, pool: ProcessPoolExecutor,
+                    args: argparse.Namespace) -> Iterator[asyncio.Future]:
+    """Задачи разбора входных данных в пуле процессов (по мере чтения)"""
+    if os.path.isdir(args.input):
+        paths = sorted(
+            os.path.join(args.input, name) for name in os.listdir(args.input) if name.endswith('.json')
+        )
+        for start in range(0, len(paths), 100):
+            yield _parse_thread_files(loop, pool, paths[start:start + 100], args.min_messages)
+    else:
+        for chunk in _read_chunks(args.input):
+            yield loop.run_in_executor(pool, parse_export_chunk, chunk, args.mode, args.min_messages)
+
+
+async def _spool_channel_days(loop: asyncio.AbstractEventLoop, pool: ProcessPoolExecutor,
+                             args: argparse.Namespace, spool: _ChannelDaySpool):
+    """Разбирает выгрузку в пуле процессов и складывает дни каналов на диск"""
+    pending = deque()
+    for chunk in _read_chunks(args.input):
+        pending.append(loop.run_in_executor(pool, parse_export_chunk, chunk, args.mode, args.min_messages))
+        if len(pending) >= args.workers * 2:
+            spool.add(await pending.popleft())
+    while pending:
+        spool.add(await pending.popleft())
+
+
+async def run(args: argparse.Namespace):
+    llm_client = LLMClient()
+    summarizer = BatchSummarizer(llm_client, args.output, args.concurrency, prefetch=args.workers * 2)
+    if summarizer.done_ids:
+        logger.info(f"↩️ Продолжаю: {len(summarizer.done_ids)} саммари уже есть в {args.output}")
+
+    loop = asyncio.get_running_loop()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            if args.mode == 'channels' and not os.path.isdir(args.input):
+                spool = _ChannelDaySpool()
+                try:
+                    await _spool_channel_days(loop, pool, args, spool)
+                    await summarizer.run(spool.batches(args.min_messages))
+                finally:
+                    spool.close()
+            else:
+                await summarizer.run(_submit_batches(loop, pool, args))
+    finally:
+        await llm_client.aclose()
+
+
+def main():
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Пакетная суммаризация выгрузки Mattermost")
+    parser.add_argument('input', help="bulk-export JSONL или каталог JSON-файлов тредов")
+    parser.add_argument('--output', required=True, help="JSONL с результатами (дописывается)")
+    parser.add_argument('--mode', choices=('threads', 'channels'), default='threads',
+                        help="для bulk-export: саммари тредов или каналов по дням")
+    parser.add_argument('--concurrency', type=int, default=16, help="одновременных запросов к LLM")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="процессов для разбора")
+    parser.add_argument('--min-messages', type=int, default=2, help="минимум сообщений в элементе")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        parser.error(f"не найден {args.input}")
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        logger.info("📝 Прервано, готовые саммари сохранены - повторный запуск продолжит работу")
+        sys.exit(130)
+    except Exception as e:
+        logger.error(f"❌ Пакетная суммаризация прервана: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import unittest
+
+from benchmarks.run import compare_results, percentile
+
+
+class TestBenchmarkRun(unittest.TestCase):
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+
+        self.assertAlmostEqual(percentile(values, 50), 50.5)
+        self.assertAlmostEqual(percentile(values, 99), 99.01)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_compare_flags_regressions_by_direction(self):
+        baseline = {
+            'ingest': {'events': 100, 'events_per_second': 1000.0},
+            'summary_thread_10': {'p50_ms': 50.0, 'p99_ms': 80.0},
+            'dashboard': {'p50_ms': 1.0},
+        }
+        results = {
+            'ingest': {'events': 500, 'events_per_second': 700.0},
+            'summary_thread_10': {'p50_ms': 40.0, 'p99_ms': 120.0},
+            'dashboard': {'p50_ms': 1.5},
+        }
+
+        regressions = compare_results(results, baseline, threshold=0.2)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('ingest.events_per_second'))
+        self.assertTrue(regressions[1].startswith('summary_thread_10.p99_ms'))
+
+    def test_compare_reports_metrics_missing_on_either_side(self):
+        baseline = {
+            'digest_wave_1000': {'subscriptions': 1000, 'seconds': 10.0},
+            'dashboard': {'p50_ms': 5.0, 'p99_ms': 9.0},
+        }
+        results = {
+            'digest_wave_10': {'subscriptions': 10, 'seconds': 1.0},
+            'dashboard': {'p50_ms': 5.0, 'mean_ms': 5.0},
+        }
+
+        regressions = compare_results(results, baseline)
+
+        self.assertEqual(regressions, [
+            'digest_wave_1000: нет в прогоне',
+            'digest_wave_10: нет в базовом прогоне',
+            'dashboard.p99_ms: нет в прогоне',
+            'dashboard.mean_ms: нет в базовом прогоне',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from channel_stats import compute_channel_stats, format_stats_header, format_stats_table
+
+HOUR_MS = 3_600_000
+
+
+class TestChannelStats(unittest.TestCase):
+    def setUp(self):
+        self.messages = [
+            {'username': 'alice', 'message': 'Дизайн тут https://figma.com/file/1.', 'create_at': 10 * HOUR_MS},
+            {'username': 'alice', 'message': 'И еще https://figma.com/file/1', 'create_at': 10 * HOUR_MS + 60_000},
+            {'username': 'bob', 'message': 'Лог во вложении', 'create_at': 12 * HOUR_MS, 'files': ['app.log']},
+        ]
+
+    def test_counts_users_links_files_and_hours(self):
+        stats = compute_channel_stats(self.messages, timezone='UTC')
+
+        self.assertEqual(stats['top_participants'], [('alice', 2), ('bob', 1)])
+        self.assertEqual(stats['top_urls'], [('https://figma.com/file/1', 2)])
+        self.assertEqual(stats['files'], ['app.log'])
+        self.assertEqual(stats['busiest_hours'][0], 10)
+        self.assertEqual(stats['messages_per_hour'], 1.5)
+
+    def test_table_and_header(self):
+        stats = compute_channel_stats(self.messages, timezone='UTC')
+
+        table = format_stats_table([{'display_name': 'Дизайн', 'stats': stats}])
+        self.assertIn("Дизайн | 3 | 2 | 1.5 | 10:00, 12:00 | 2 | 1", table)
+        self.assertIn("https://figma.com/file/1 (×2)", table)
+
+        header = format_stats_header('Дизайн', stats, 3)
+        self.assertTrue(header.startswith("• **Дизайн** (3 сообщений, 2 участников, 🔗 2, 📎 1, пик 10:00)"))
+
+
+if __name__ == "__main__":
+    unittest.main()
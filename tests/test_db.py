@@ -0,0 +1,44 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from db import Database
+
+
+class TestDatabase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.db = Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+        self.db.call(lambda conn: conn.execute('CREATE TABLE items (value INTEGER)'))
+
+    def tearDown(self):
+        self.db.close()
+
+    async def test_runs_on_dedicated_thread_in_wal_mode(self):
+        journal_mode, thread_name = await self.db.run(
+            lambda conn: (conn.execute('PRAGMA journal_mode').fetchone()[0], threading.current_thread().name)
+        )
+        self.assertEqual(journal_mode, 'wal')
+        self.assertTrue(thread_name.startswith('sqlite'))
+        self.assertNotEqual(thread_name, threading.current_thread().name)
+
+    async def test_background_writes_are_ordered_before_reads(self):
+        for value in range(5):
+            self.db.submit(lambda conn, value: conn.execute('INSERT INTO items VALUES (?)', (value,)), value)
+
+        values = await self.db.run(lambda conn: [row[0] for row in conn.execute('SELECT value FROM items')])
+        self.assertEqual(values, list(range(5)))
+
+    async def test_failed_call_is_rolled_back(self):
+        def insert_and_fail(conn):
+            conn.execute('INSERT INTO items VALUES (1)')
+            raise sqlite3.IntegrityError('boom')
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            await self.db.run(insert_and_fail)
+        self.assertEqual(await self.db.run(lambda conn: conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
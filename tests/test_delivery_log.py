@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from subscription_manager import RUN_AT_FORMAT, SubscriptionManager
+
+
+def _ago(days: int) -> str:
+    return (datetime.utcnow() - timedelta(days=days)).strftime(RUN_AT_FORMAT)
+
+
+class TestDeliveryLog(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+
+    async def asyncTearDown(self):
+        self.manager.close()
+
+    async def test_deliveries_are_rolled_up_per_day(self):
+        await self.manager.log_delivery(1, 'success', 10)
+        await self.manager.log_delivery(1, 'error', 0, 'boom')
+        await self.manager.log_delivery(2, 'success', 5)
+
+        stats = await self.manager.get_delivery_stats(days=1)
+        self.assertEqual(stats['totals'], {'attempts': 3, 'successes': 2, 'errors': 1, 'message_count': 15})
+        first = stats['subscriptions'][0]
+        self.assertEqual((first['subscription_id'], first['attempts'], first['successes'], first['errors']),
+                         (1, 2, 1, 1))
+        self.assertEqual([item['subscription_id'] for item in
+                          (await self.manager.get_delivery_stats(subscription_id=2))['subscriptions']], [2])
+
+    async def test_compaction_keeps_rollups_and_recent_rows(self):
+        with sqlite3.connect(self.manager.db_path) as conn:
+            conn.executemany('''
+                INSERT INTO delivery_log (subscription_id, status, message_count, delivered_at)
+                VALUES (1, 'success', 1, ?)
+            ''', [(_ago(40),)] * 25 + [(_ago(2),)] * 3)
+        # Агрегаты по уже накопленному журналу строятся при миграции
+        with sqlite3.connect(self.manager.db_path) as conn:
+            conn.execute('DROP TABLE delivery_log_daily')
+        self.manager.close()
+        self.manager = SubscriptionManager(self.manager.db_path)
+
+        self.assertEqual(await self.manager.compact_delivery_log(retention_days=30, batch_size=10), 25)
+        # Меньше недели не храним: иначе проверка повторной доставки потеряет записи
+        self.assertEqual(await self.manager.compact_delivery_log(retention_days=1, batch_size=10), 0)
+
+        with sqlite3.connect(self.manager.db_path) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM delivery_log').fetchone()[0], 3)
+        stats = await self.manager.get_delivery_stats(days=60)
+        self.assertEqual(stats['totals']['successes'], 28)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from digest_budget import allocate_token_budget, select_messages_within_budget
+from llm_client import LLMClient
+
+
+class TestDigestBudget(unittest.TestCase):
+    def test_quiet_channels_keep_floor_and_surplus_goes_to_busy_ones(self):
+        budgets = allocate_token_budget(
+            demands={'busy': 10000, 'medium': 3000, 'quiet': 50},
+            weights={'busy': 900, 'medium': 90, 'quiet': 10},
+            total_budget=4000,
+            floor=300,
+        )
+
+        self.assertEqual(budgets['quiet'], 50)
+        self.assertGreaterEqual(budgets['medium'], 300)
+        self.assertGreater(budgets['busy'], budgets['medium'])
+        self.assertLessEqual(sum(budgets.values()), 4000)
+        self.assertGreater(sum(budgets.values()), 3900)
+
+    def test_prefers_ranked_then_recent_messages(self):
+        items = [({'create_at': t, 'rank_score': score}, 10) for t, score in [(1, 0.9), (2, 0.1), (3, 0.5)]]
+        selected = select_messages_within_budget(items, 20)
+        self.assertEqual([msg['create_at'] for msg, _ in selected], [1, 3])
+
+        items = [({'create_at': t}, 10) for t in (1, 2, 3)]
+        selected = select_messages_within_budget(items, 20)
+        self.assertEqual([msg['create_at'] for msg, _ in selected], [2, 3])
+
+    def test_chatty_channel_does_not_crowd_out_others(self):
+        messages = [
+            {'channel_id': 'c1', 'channel_name': 'flood', 'username': 'a', 'message': f'сообщение номер {i} ' * 10,
+             'create_at': i}
+            for i in range(2000)
+        ]
+        messages.append({'channel_id': 'c2', 'channel_name': 'team', 'username': 'b',
+                         'message': 'Релиз переносим на пятницу', 'create_at': 5})
+        summaries = [
+            {'channel_name': 'Флуд', 'channel_id': 'c1', 'display_name': 'Флуд', 'message_count': 2000},
+            {'channel_name': 'team', 'channel_id': 'c2', 'display_name': 'Команда', 'message_count': 1},
+        ]
+
+        prompt = LLMClient()._format_channels_for_llm(messages, summaries)
+
+        self.assertIn('Релиз переносим на пятницу', prompt)
+        self.assertIn('[пропущено сообщений:', prompt)
+        self.assertLess(len(prompt) / 4, 13000)
+
+    def test_prompt_lines_are_written_without_copying_messages(self):
+        messages = [
+            {'channel_id': 'c1', 'username': 'ci', 'message': '  Build failed  ', 'create_at': 1, 'duplicate_count': 3},
+            {'channel_id': 'c1', 'username': 'anna', 'message': 'Смотрю', 'create_at': 2},
+        ]
+        summaries = [{'channel_name': 'ci', 'channel_id': 'c1', 'display_name': 'CI', 'message_count': 2}]
+
+        prompt = LLMClient()._format_channels_for_llm(messages, summaries)
+
+        self.assertIn("ci: Build failed (×3)\nanna: Смотрю\n", prompt)
+        self.assertNotIn('line', messages[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,291 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from config import Config
+
+from digest_graph import WaveWorkGraph, compose_digest
+from scheduler import SubscriptionScheduler, gather_limited
+from subscription_manager import SubscriptionManager
+from usage_tracker import LLMQuotaExceeded, UsageTracker
+
+
+class FakeBot:
+    def __init__(self, now: datetime, minutes_ago=(1, 2, 3), fetch_delay=0.01):
+        self.now = int(now.replace(tzinfo=timezone.utc).timestamp() * 1000)
+        self.minutes_ago = minutes_ago
+        self.fetch_delay = fetch_delay
+        self.calls = {'channel': 0, 'fetch': 0, 'llm': 0}
+        self.sent = {}
+        self.llm_messages = []
+        self.renamed = {}
+        self.denied = set()
+        self.llm_client = SimpleNamespace(generate_channels_summary=self.generate_channels_summary,
+                                          generate_channel_section=self.generate_channel_section)
+        self.usage_tracker = SimpleNamespace(check_quota=self._check_quota, charge=lambda context, tokens: None)
+
+    @staticmethod
+    async def _check_quota(user_id):
+        return None
+
+    async def get_channel_by_name(self, name):
+        self.calls['channel'] += 1
+        channel_id = self.renamed.get(name, f'id-{name}')
+        return {'id': channel_id, 'name': name, 'display_name': name.title()}
+
+    async def _check_channel_permissions(self, channel_id):
+        return channel_id not in self.denied
+
+    async def get_channel_messages_since(self, channel_id, since_time):
+        self.calls['fetch'] += 1
+        await asyncio.sleep(self.fetch_delay)
+        # Сдвиг по каналу, чтобы сообщения разных каналов чередовались во времени
+        shift = sum(map(ord, channel_id)) % 7 * 1000
+        return [{'username': 'alice', 'message': f'{channel_id} news {i}', 'channel_id': channel_id,
+                 'create_at': self.now - 60_000 * i - shift}
+                for i in sorted(self.minutes_ago, reverse=True)]
+
+    async def generate_channels_summary(self, messages, channel_summaries, frequency, usage_context=None):
+        self.calls['llm'] += 1
+        self.llm_messages.append(messages)
+        return f"summary of {channel_summaries[0]['display_name']} ({len(messages)})"
+
+    async def generate_channel_section(self, messages, channel_summary, frequency, usage_context=None):
+        # Как LLMClient._record_usage: токены запроса добавляются к счетчику контекста
+        usage_context['spent_tokens'] += 100
+        return await self.generate_channels_summary(messages, [channel_summary], frequency)
+
+    async def send_direct_message(self, user_id, message):
+        self.sent[user_id] = message
+        return True
+
+
+class TestSharedDigests(unittest.IsolatedAsyncioTestCase):
+    async def test_channel_work_is_shared_between_subscribers(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        for index in range(4):
+            channels = ['general', 'random'] if index < 3 else ['general']
+            await manager.create_subscription(f'u{index}', f'user{index}', channels, '09:00', 'daily', timezone='UTC')
+        run_at = (await manager.get_next_runs())[0][0]
+        bot = FakeBot(run_at)
+        scheduler = SubscriptionScheduler(bot, manager)
+
+        await scheduler._check_subscriptions(run_at)
+        scheduler.extractive.shutdown()
+
+        self.assertEqual(bot.calls, {'channel': 2, 'fetch': 2, 'llm': 2})
+        self.assertEqual(len(bot.sent), 4)
+        self.assertIn("### 📢 General", bot.sent['u0'])
+        self.assertIn("summary of Random", bot.sent['u0'])
+        self.assertNotIn("summary of Random", bot.sent['u3'])
+        self.assertEqual(scheduler.last_wave['shared_tasks'], 8)
+
+    async def test_shared_digest_tokens_count_against_each_subscriber(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        await manager.create_subscription('u0', 'user0', ['general', 'random'], '09:00', 'daily', timezone='UTC')
+        await manager.create_subscription('u1', 'user1', ['general'], '09:00', 'daily', timezone='UTC')
+        run_at = (await manager.get_next_runs())[0][0]
+        bot = FakeBot(run_at)
+        bot.usage_tracker = tracker = UsageTracker(os.path.join(tempfile.mkdtemp(), 'usage.db'), daily_quota=150)
+        self.addCleanup(tracker.close)
+
+        with patch.object(Config, 'DIGEST_SHARED_ENABLED', True):
+            scheduler = SubscriptionScheduler(bot, manager)
+            await scheduler._check_subscriptions(run_at)
+            scheduler.extractive.shutdown()
+
+        self.assertEqual(bot.calls['llm'], 2)
+        self.assertEqual(await tracker.tokens_used_today('u0'), 200)
+        self.assertEqual(await tracker.tokens_used_today('u1'), 100)
+        usage = {item['key']: item for item in await tracker.get_usage('subscription_id')}
+        self.assertEqual((usage['1']['total_tokens'], usage['1']['requests']), (200, 0))
+        with self.assertRaises(LLMQuotaExceeded):
+            await tracker.check_quota('u0')
+        await tracker.check_quota('u1')
+
+    async def test_precomputed_digest_is_topped_up_at_delivery(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        for index in range(3):
+            await manager.create_subscription(f'u{index}', f'user{index}', ['general'], '09:00', 'daily', timezone='UTC')
+        run_at = (await manager.get_next_runs())[0][0]
+        # Два сообщения до границы предрасчета (за 10 минут до запуска) и одно после нее
+        bot = FakeBot(run_at, minutes_ago=(1, 30, 60))
+
+        with patch.object(Config, 'DIGEST_PRECOMPUTE_LEAD', 600), patch.object(Config, 'DIGEST_SHARED_ENABLED', True):
+            scheduler = SubscriptionScheduler(bot, manager)
+            await scheduler._rebuild_heap()
+            self.assertEqual(len(scheduler._precompute_heap), 3)
+            starts = sorted(start for start, _, _ in scheduler._precompute_heap)
+            self.assertGreaterEqual(starts[0], run_at - timedelta(minutes=10))
+            self.assertLess(starts[-1], run_at - timedelta(minutes=5))
+
+            await scheduler._start_precomputes(run_at - timedelta(seconds=1))
+            await asyncio.gather(*scheduler._precompute_tasks)
+            self.assertEqual(bot.calls, {'channel': 1, 'fetch': 1, 'llm': 1})
+
+            await scheduler._check_subscriptions(run_at)
+            scheduler.extractive.shutdown()
+
+        # При доставке докачиваются и суммируются только сообщения после границы
+        self.assertEqual(bot.calls, {'channel': 1, 'fetch': 2, 'llm': 2})
+        self.assertEqual(scheduler.last_wave['precomputed'], 3)
+        self.assertEqual(len(bot.sent), 3)
+        self.assertIn("summary of General (2)", bot.sent['u0'])
+        self.assertIn("**🆕 Новое с 08:50:**\n\nsummary of General (1)", bot.sent['u0'])
+        self.assertIn("(3 сообщений", bot.sent['u0'])
+        self.assertEqual(scheduler._precomputed, {})
+
+
+    async def test_channels_are_fetched_in_parallel_and_merged_by_time(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        channels = ['general', 'random', 'dev', 'ops']
+        await manager.create_subscription('u0', 'user0', channels, '09:00', 'daily', timezone='UTC')
+        run_at = (await manager.get_next_runs())[0][0]
+        bot = FakeBot(run_at, fetch_delay=0.2)
+
+        with patch.object(Config, 'DIGEST_SHARED_ENABLED', False):
+            scheduler = SubscriptionScheduler(bot, manager)
+            started = time.perf_counter()
+            await scheduler._check_subscriptions(run_at)
+            elapsed = time.perf_counter() - started
+            scheduler.extractive.shutdown()
+
+        self.assertEqual(bot.calls['fetch'], 4)
+        self.assertLess(elapsed, 0.6)
+        messages = bot.llm_messages[0]
+        self.assertEqual(len(messages), 12)
+        # Сообщения каналов слиты по времени, а не идут блоками по каналам
+        self.assertEqual([m['create_at'] for m in messages], sorted(m['create_at'] for m in messages))
+
+
+class TestPrecomputeLimit(unittest.IsolatedAsyncioTestCase):
+    async def test_delivery_starts_while_precompute_limit_is_saturated(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        await manager.create_subscription('u0', 'user0', ['general'], '09:00', 'daily', timezone='UTC')
+        subscription = (await manager.get_scheduled_subscriptions([1]))[0]
+        release = asyncio.Event()
+        delivered = []
+
+        async def slow_collect(subscription, graph, precompute=False):
+            await release.wait()
+
+        async def execute(subscription, graph=None):
+            delivered.append(subscription['id'])
+
+        with patch.object(Config, 'SCHEDULER_CONCURRENCY', 2), \
+                patch.object(Config, 'DIGEST_PRECOMPUTE_CONCURRENCY', 2):
+            scheduler = SubscriptionScheduler(FakeBot(subscription['next_run_at']), manager)
+        scheduler._collect_subscription = slow_collect
+        scheduler._execute_subscription = execute
+        precomputes = [asyncio.create_task(scheduler._precompute_subscription(subscription, WaveWorkGraph()))
+                       for _ in range(5)]
+        await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(scheduler._run_subscription(subscription, subscription['next_run_at']), timeout=0.5)
+        self.assertEqual(delivered, [1])
+        self.assertTrue(scheduler._precompute_semaphore.locked())
+
+        release.set()
+        await asyncio.gather(*precomputes)
+        scheduler.extractive.shutdown()
+
+
+class TestStoredChannelIds(unittest.IsolatedAsyncioTestCase):
+    async def test_ids_are_stored_and_refreshed_when_channel_disappears(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        await manager.create_subscription('u0', 'user0', ['general', 'random'], '09:00', 'daily', timezone='UTC',
+                                          resolved_channels={'general': {'id': 'id-general', 'display_name': 'General'}})
+        run_at = (await manager.get_next_runs())[0][0]
+        bot = FakeBot(run_at)
+        scheduler = SubscriptionScheduler(bot, manager)
+
+        subscription = (await manager.get_scheduled_subscriptions([1]))[0]
+        self.assertEqual(subscription['resolved_channels'], {'general': {'id': 'id-general', 'display_name': 'General'}})
+
+        # Первый запуск: general берется по сохраненному ID, random ищется по имени и сохраняется
+        await scheduler._collect_subscription(subscription, WaveWorkGraph())
+        self.assertEqual(bot.calls['channel'], 1)
+        subscription = (await manager.get_scheduled_subscriptions([1]))[0]
+        self.assertEqual(subscription['resolved_channels']['random'], {'id': 'id-random', 'display_name': 'Random'})
+
+        await scheduler._collect_subscription(subscription, WaveWorkGraph())
+        self.assertEqual(bot.calls['channel'], 1)
+
+        # Канал пересоздан: старый ID недоступен, ищем по имени заново и запоминаем новый ID
+        bot.denied.add('id-general')
+        bot.renamed['general'] = 'id-general-2'
+        missing, available, _ = await scheduler._collect_subscription(subscription, WaveWorkGraph())
+        scheduler.extractive.shutdown()
+        self.assertEqual(missing, [])
+        self.assertEqual([channel_id for _, channel_id, _ in available], ['id-general-2', 'id-random'])
+        self.assertEqual(bot.calls['channel'], 2)
+        subscription = (await manager.get_scheduled_subscriptions([1]))[0]
+        self.assertEqual(subscription['resolved_channels']['general']['id'], 'id-general-2')
+
+
+class TestGatherLimited(unittest.IsolatedAsyncioTestCase):
+    async def test_limits_concurrency_and_keeps_order(self):
+        running = []
+        peak = []
+
+        async def work(value):
+            running.append(value)
+            peak.append(len(running))
+            await asyncio.sleep(0.01 * (5 - value))
+            running.remove(value)
+            return value * 10
+
+        results = await gather_limited(2, (lambda value=value: work(value) for value in range(5)))
+        self.assertEqual(results, [0, 10, 20, 30, 40])
+        self.assertEqual(max(peak), 2)
+
+
+class TestWaveWorkGraph(unittest.IsolatedAsyncioTestCase):
+    async def test_memoizes_and_survives_cancellation(self):
+        graph = WaveWorkGraph()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 42
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(graph.run('key', work), timeout=0.01)
+        self.assertEqual(await graph.run('key', work), 42)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(graph.stats(), {'tasks': 1, 'hits': 1})
+
+    async def test_forget_failed(self):
+        graph = WaveWorkGraph()
+
+        async def fail():
+            raise RuntimeError('llm down')
+
+        async def empty():
+            return None
+
+        async def ok():
+            return 'done'
+
+        for key, work in (('fail', fail), ('empty', empty), ('ok', ok)):
+            try:
+                await graph.run(key, work)
+            except RuntimeError:
+                pass
+        graph.forget_failed()
+        self.assertEqual(graph.stats()['tasks'], 1)
+        self.assertEqual(await graph.run('fail', ok), 'done')
+
+    def test_compose_digest(self):
+        self.assertEqual(compose_digest([('A', 'x')]), 'x')
+        self.assertEqual(compose_digest([('A', 'x'), ('B', 'y')]), "### 📢 A\n\nx\n\n### 📢 B\n\ny")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from extractive_ranker import rank_texts, select_ranked_messages
+
+
+class TestExtractiveRanker(unittest.TestCase):
+    def test_central_message_outranks_outlier(self):
+        texts = [
+            "релиз сборка деплой сервера",
+            "деплой сервера после релиза",
+            "сборка релиза и деплой сервера прошли",
+            "котики смешные картинки",
+        ]
+
+        scores = rank_texts(texts)
+
+        self.assertEqual(len(scores), 4)
+        self.assertLess(scores[3], min(scores[:3]))
+
+    def test_selection_respects_budget_and_keeps_order(self):
+        messages = [{'message': 'x' * 40, 'create_at': i} for i in range(5)]
+        scores = [0.1, 0.5, 0.2, 0.9, 0.3]
+
+        selected = select_ranked_messages(messages, scores, token_budget=20)
+
+        self.assertEqual([m['create_at'] for m in selected], [1, 3])
+        self.assertEqual(selected[1]['rank_score'], 0.9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+import asyncio
+import time
+import unittest
+
+from openai import APIConnectionError
+
+from llm_client import LLMClient
+from llm_endpoints import HedgePolicy, LLMEndpoint, LLMEndpointPool, LLMHealth
+
+
+class _Completions:
+    def __init__(self, error=None, delay=0.0):
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return f"ok:{kwargs['model']}"
+
+
+class _Chat:
+    def __init__(self, error=None, delay=0.0):
+        self.completions = _Completions(error, delay)
+
+
+class _Client:
+    def __init__(self, error=None, delay=0.0):
+        self.chat = _Chat(error, delay)
+
+
+class TestLLMEndpointPool(unittest.TestCase):
+    def test_least_requests_prefers_idle_endpoint(self):
+        busy = LLMEndpoint("http://a", "m", None)
+        idle = LLMEndpoint("http://b", "m", None)
+        busy.in_flight = 3
+        pool = LLMEndpointPool([busy, idle])
+
+        self.assertIs(pool.acquire(), idle)
+
+    def test_endpoint_ejected_after_consecutive_failures(self):
+        bad = LLMEndpoint("http://a", "m", None)
+        good = LLMEndpoint("http://b", "m", None)
+        pool = LLMEndpointPool([bad, good], eject_failures=2, eject_seconds=60)
+
+        for _ in range(2):
+            pool.release(pool.acquire(exclude=[good]), failed=True)
+
+        self.assertFalse(bad.is_available(time.monotonic()))
+        self.assertEqual([pool.acquire() for _ in range(3)], [good, good, good])
+
+
+class TestLLMClientFailover(unittest.IsolatedAsyncioTestCase):
+    async def test_connection_error_fails_over_to_next_endpoint(self):
+        client = LLMClient()
+        broken = LLMEndpoint("http://a", "m1", _Client(APIConnectionError(request=None)))
+        healthy = LLMEndpoint("http://b", "m2", _Client())
+        healthy.ewma_latency = 1.0  # первым выбирается "быстрый", но недоступный эндпоинт
+        client.pool = LLMEndpointPool([broken, healthy])
+
+        response, endpoint = await client._create_completion([{"role": "user", "content": "hi"}])
+
+        self.assertEqual(response, "ok:m2")
+        self.assertIs(endpoint, healthy)
+        self.assertEqual(broken.total_failures, 1)
+        self.assertEqual(broken.in_flight, 0)
+
+
+class TestLLMClientHedging(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_request_is_hedged_and_loser_cancelled(self):
+        client = LLMClient()
+        slow = LLMEndpoint("http://a", "slow", _Client(delay=5))
+        fast = LLMEndpoint("http://b", "fast", _Client())
+        fast.ewma_latency = 1.0  # основной запрос уходит на медленный эндпоинт
+        client.pool = LLMEndpointPool([slow, fast])
+        client.hedge_policy = HedgePolicy(min_delay=0.01, max_ratio=1.0, min_samples=0)
+
+        response, endpoint = await client._create_completion([{"role": "user", "content": "hi"}])
+        await asyncio.sleep(0)
+
+        self.assertIs(endpoint, fast)
+        self.assertEqual(response, "ok:fast")
+        self.assertEqual(client.hedge_policy.hedges_won, 1)
+        self.assertEqual(slow.in_flight, 0)
+        # Отмененный основной запрос попадает в окно прошедшим временем
+        self.assertEqual(len(client.hedge_policy.latencies), 1)
+        self.assertGreaterEqual(client.hedge_policy.latencies.percentile(100), 0.01)
+
+    async def test_failed_primary_is_not_recorded_as_latency(self):
+        client = LLMClient()
+        client.pool = LLMEndpointPool([LLMEndpoint("http://a", "m", _Client(error=APIConnectionError(request=None)))])
+        client.hedge_policy = HedgePolicy(min_samples=0)
+
+        with self.assertRaises(APIConnectionError):
+            await client._create_completion([{"role": "user", "content": "hi"}])
+        await asyncio.sleep(0)
+
+        self.assertEqual(len(client.hedge_policy.latencies), 0)
+
+    def test_hedge_budget_limits_ratio(self):
+        policy = HedgePolicy(max_ratio=0.1, burst=1.0)
+        hedged = 0
+        for _ in range(100):
+            policy.on_request()
+            hedged += policy.try_hedge()
+
+        self.assertLessEqual(hedged, 10)
+        self.assertGreaterEqual(hedged, 9)
+
+
+class TestLLMTransport(unittest.TestCase):
+    def test_openai_client_uses_tuned_http_client(self):
+        client = LLMClient()
+        http_client = client.http_clients[client.base_url]
+
+        self.assertIs(client.client._client, http_client)
+        self.assertEqual(client.transport_stats()[client.base_url], {'connections': 0, 'idle': 0, 'active': 0})
+
+    def test_transport_stats_see_open_connections(self):
+        # Падает, если в новой версии httpx пропадет пул транспорта, который читает transport_stats
+        async def scenario():
+            async def handle(reader, writer):
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+                await reader.read()
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            client = LLMClient()
+            http_client = client.http_clients[client.base_url]
+            try:
+                response = await http_client.get(f'http://127.0.0.1:{port}/')
+                self.assertEqual(response.text, 'ok')
+                return client.transport_stats()[client.base_url]
+            finally:
+                await http_client.aclose()
+                server.close()
+                await server.wait_closed()
+
+        self.assertEqual(asyncio.run(scenario()), {'connections': 1, 'idle': 1, 'active': 0})
+
+    def test_aclose_closes_replica_clients(self):
+        async def scenario():
+            client = LLMClient()
+            client.start_health_probe()
+            await client.aclose()
+            return client
+
+        client = asyncio.run(scenario())
+
+        self.assertIsNone(client._probe_task)
+        self.assertTrue(all(http_client.is_closed for http_client in client.http_clients.values()))
+
+
+class _Models:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def list(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return []
+
+
+class TestLLMHealth(unittest.IsolatedAsyncioTestCase):
+    def test_error_rate_marks_llm_unhealthy(self):
+        health = LLMHealth(max_error_rate=0.5)
+        self.assertFalse(health.is_healthy())
+
+        health.record_success(1.0)
+        health.record_failure(RuntimeError("boom"))
+        self.assertTrue(health.is_healthy())
+
+        health.record_failure(RuntimeError("boom"))
+        self.assertFalse(health.is_healthy())
+        self.assertEqual(health.snapshot()['last_error'], "boom")
+
+    async def test_probe_lists_models_without_completion(self):
+        client = LLMClient()
+        openai_client = _Client()
+        openai_client.models = _Models()
+        client.pool = LLMEndpointPool([
+            LLMEndpoint("http://a", "m1", openai_client),
+            LLMEndpoint("http://a", "m2", openai_client),
+        ])
+
+        self.assertTrue(await client.probe())
+        self.assertTrue(client.is_healthy())
+        self.assertEqual(openai_client.models.calls, 1)
+        self.assertEqual(openai_client.chat.completions.calls, 0)
+
+    async def test_probe_records_one_outcome_per_probe(self):
+        client = LLMClient()
+        alive, dead = _Client(), _Client()
+        alive.models, dead.models = _Models(), _Models(APIConnectionError(request=None))
+        client.pool = LLMEndpointPool([LLMEndpoint("http://a", "m", alive), LLMEndpoint("http://b", "m", dead)])
+
+        for _ in range(5):
+            self.assertTrue(await client.probe(connections=4))
+        self.assertEqual(client.health.error_rate, 0.0)
+        self.assertTrue(client.is_healthy())
+
+        alive.models.error = APIConnectionError(request=None)
+        self.assertFalse(await client.probe(connections=4))
+        self.assertAlmostEqual(client.health.error_rate, client.health.ewma_alpha)
+
+
+if __name__ == "__main__":
+    unittest.main()
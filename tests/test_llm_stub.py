@@ -0,0 +1,50 @@
+import unittest
+
+import httpx
+from openai import AsyncOpenAI
+
+from benchmarks.llm_stub import StubProfile, create_app
+
+
+class TestLLMStub(unittest.IsolatedAsyncioTestCase):
+    def _client(self, profile):
+        transport = httpx.ASGITransport(app=create_app(profile))
+        return AsyncOpenAI(
+            api_key="stub",
+            base_url="http://stub/v1",
+            http_client=httpx.AsyncClient(transport=transport),
+            max_retries=0,
+        )
+
+    async def test_echo_completion_and_models(self):
+        client = self._client(StubProfile(mode='echo'))
+
+        response = await client.chat.completions.create(
+            model="m", messages=[{"role": "user", "content": "привет"}]
+        )
+        models = await client.models.list()
+
+        self.assertEqual(response.choices[0].message.content, "привет")
+        self.assertEqual(response.usage.completion_tokens, 2)
+        self.assertEqual([model.id for model in models.data], ['stub-model'])
+
+    async def test_streaming_response(self):
+        client = self._client(StubProfile(response="x" * 40))
+
+        stream = await client.chat.completions.create(
+            model="m", messages=[{"role": "user", "content": "hi"}], stream=True
+        )
+        parts = [chunk.choices[0].delta.content or "" async for chunk in stream if chunk.choices]
+
+        self.assertEqual("".join(parts), "x" * 40)
+        self.assertGreater(len(parts), 2)
+
+    async def test_error_rate(self):
+        client = self._client(StubProfile(error_rate=1.0, seed=1))
+
+        with self.assertRaises(Exception):
+            await client.chat.completions.create(model="m", messages=[])
+
+
+if __name__ == "__main__":
+    unittest.main()
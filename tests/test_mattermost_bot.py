@@ -1,6 +1,23 @@
+import json
+import os
+import tempfile
 import unittest
+from functools import partial
+from unittest.mock import patch
 
+from llm_client import LLMClient
 from mattermost_bot import MattermostBot
+from subscription_manager import SubscriptionManager
+from usage_tracker import UsageTracker
+
+
+def _bot():
+    """Бот с базами во временном каталоге, а не в корне репозитория"""
+    tmp = tempfile.mkdtemp()
+    with patch('mattermost_bot.UsageTracker', partial(UsageTracker, os.path.join(tmp, 'usage.db'))), \
+            patch('mattermost_bot.SubscriptionManager',
+                  partial(SubscriptionManager, os.path.join(tmp, 'subscriptions.db'))):
+        return MattermostBot()
 
 
 class _Response:
@@ -18,17 +35,69 @@ class _SessionStub:
 
 class TestMattermostBotTimeParsing(unittest.TestCase):
     def test_parse_night_time_as_24h(self):
-        bot = MattermostBot()
+        bot = _bot()
         parsed = bot._parse_time_from_message("ежедневно в 2 ночи")
         self.assertEqual(parsed, "02:00")
 
 
+class TestMattermostBotWebhookPosts(unittest.TestCase):
+    def test_webhook_only_channel_still_reaches_prompt(self):
+        bot = _bot()
+        bot.bot_user_id = 'bot'
+        posts = [
+            {'user_id': 'hook', 'message': 'ALERT: disk 95% on db-1', 'create_at': 1,
+             'props': {'from_webhook': 'true', 'from_bot': 'true'}},
+            {'user_id': 'ci', 'message': 'Build #42 failed', 'create_at': 2, 'props': {'from_bot': 'true'}},
+            {'user_id': 'bot', 'message': 'Сводка за день', 'create_at': 3},
+        ]
+        messages = [
+            {'channel_id': 'c1', 'channel_name': 'alerts', 'username': post['user_id'], 'message': post['message'],
+             'create_at': post['create_at'], 'from_bot': bot._is_bot_post(post)}
+            for post in posts
+        ]
+
+        prompt = LLMClient()._format_channels_for_llm(
+            messages, [{'channel_name': 'alerts', 'channel_id': 'c1', 'display_name': 'Alerts', 'message_count': 3}]
+        )
+
+        self.assertIn('ALERT: disk 95% on db-1', prompt)
+        self.assertIn('Build #42 failed', prompt)
+        self.assertNotIn('Сводка за день', prompt)
+
+
 class TestMattermostBotMessageSending(unittest.IsolatedAsyncioTestCase):
     async def test_send_message_returns_true_on_201(self):
-        bot = MattermostBot()
+        bot = _bot()
         bot.base_url = "https://example.org"
         bot._session_requests = _SessionStub(201)
 
         result = await bot._send_message("channel-id", "hello")
 
         self.assertTrue(result)
+
+
+class TestMattermostBotChannelEvents(unittest.IsolatedAsyncioTestCase):
+    async def test_channel_events_update_subscription_channels(self):
+        bot = _bot()
+        bot.bot_user_id = 'bot'
+        manager = bot.subscription_manager
+        await manager.create_subscription('u1', 'alice', ['general'], '09:00', 'daily', timezone='UTC',
+                                          resolved_channels={'general': {'id': 'c1', 'display_name': 'General'}})
+
+        await bot._handle_websocket_message(json.dumps({
+            'event': 'channel_updated',
+            'data': {'channel': json.dumps({'id': 'c1', 'display_name': 'Town square'})},
+        }))
+        subscription = (await manager.get_scheduled_subscriptions([1]))[0]
+        self.assertEqual(subscription['resolved_channels']['general']['display_name'], 'Town square')
+
+        # Исключен другой пользователь - сохраненный ID остается
+        await bot._handle_websocket_message(json.dumps({
+            'event': 'user_removed', 'data': {'channel_id': 'c1', 'user_id': 'someone'}, 'broadcast': {},
+        }))
+        self.assertEqual(len(await manager.get_subscriptions_by_channel('c1')), 1)
+
+        await bot._handle_websocket_message(json.dumps({
+            'event': 'user_removed', 'data': {'channel_id': 'c1', 'remover_id': 'admin'}, 'broadcast': {'user_id': 'bot'},
+        }))
+        self.assertEqual(await manager.get_subscriptions_by_channel('c1'), [])
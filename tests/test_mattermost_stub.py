@@ -0,0 +1,51 @@
+import json
+import unittest
+
+from fastapi.testclient import TestClient
+
+from benchmarks.mattermost_stub import Workspace, create_app
+
+
+class TestMattermostStub(unittest.TestCase):
+    def setUp(self):
+        self.workspace = Workspace.generate(channels=2, users=5, posts_per_channel=30, seed=1)
+
+    def test_rest_endpoints(self):
+        client = TestClient(create_app(self.workspace))
+        channel_id = next(iter(self.workspace.channels))
+        root_id = self.workspace.add_thread(channel_id, 10)
+
+        me = client.get("/api/v4/users/me").json()
+        channels = client.get("/api/v4/users/me/channels").json()
+        page = client.get(f"/api/v4/channels/{channel_id}/posts", params={'page': 0, 'per_page': 20}).json()
+        thread = client.get(f"/api/v4/posts/{root_id}/thread").json()
+        created = client.post("/api/v4/posts", json={'channel_id': channel_id, 'message': 'сводка'})
+
+        self.assertEqual(me['username'], 'summary_bot')
+        self.assertEqual(len(channels), 2)
+        self.assertEqual(len(page['order']), 20)
+        times = [page['posts'][pid]['create_at'] for pid in page['order']]
+        self.assertEqual(times, sorted(times, reverse=True))
+        self.assertEqual(len(thread['order']), 10)
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(self.workspace.sent_posts[0]['message'], 'сводка')
+        self.assertEqual(client.get("/api/v4/channels/unknown").status_code, 404)
+
+    def test_websocket_handshake_and_events(self):
+        client = TestClient(create_app(self.workspace, event_rate=1000, member_event_ratio=0))
+
+        with client.websocket_connect("/api/v4/websocket") as ws:
+            ws.send_text(json.dumps({'seq': 1, 'action': 'authentication_challenge', 'data': {'token': 't'}}))
+            hello = json.loads(ws.receive_text())
+            ws.receive_text()
+            event = json.loads(ws.receive_text())
+
+        self.assertEqual(hello['event'], 'hello')
+        self.assertEqual(event['event'], 'posted')
+        post = json.loads(event['data']['post'])
+        self.assertIn(post['id'], self.workspace.posts)
+        self.assertEqual(post['channel_id'], event['broadcast']['channel_id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from llm_endpoints import LLMEndpoint, LLMEndpointPool
+from model_router import INTERACTIVE, SCHEDULED, ModelRouter
+
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = ModelRouter(
+            enabled=True, fast_model='small', throughput_model='batch', long_context_model='long',
+            fast_max_tokens=1000, long_context_min_tokens=20000,
+        )
+
+    def test_routes_by_size_and_kind(self):
+        self.assertEqual(self.router.route(300, INTERACTIVE), ('fast', 'small'))
+        self.assertEqual(self.router.route(5000, INTERACTIVE), ('default', None))
+        self.assertEqual(self.router.route(300, SCHEDULED), ('throughput', 'batch'))
+        self.assertEqual(self.router.route(50000, SCHEDULED), ('long_context', 'long'))
+
+    def test_unconfigured_tier_falls_back_to_default(self):
+        router = ModelRouter(enabled=True, long_context_model='long')
+        self.assertEqual(router.route(100, INTERACTIVE), ('default', None))
+        self.assertEqual(ModelRouter().route(100000, SCHEDULED), ('default', None))
+
+    def test_pool_prefers_endpoints_serving_routed_model(self):
+        default = LLMEndpoint("http://a", "m", None)
+        small = LLMEndpoint("http://b", "small", None)
+        small.in_flight = 5
+        pool = LLMEndpointPool([default, small])
+
+        self.assertIs(pool.acquire(model='small'), small)
+        self.assertIs(pool.acquire(model='unknown'), default)
+
+
+if __name__ == "__main__":
+    unittest.main()
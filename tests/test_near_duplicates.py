@@ -0,0 +1,33 @@
+import unittest
+
+from near_duplicates import collapse_near_duplicates
+
+
+class TestNearDuplicates(unittest.TestCase):
+    def test_alerts_differing_by_numbers_are_collapsed(self):
+        messages = [
+            {'username': 'ci', 'message': f"Build #{1000 + i} failed on runner 7f3a9c{i:02d}e1 after {i} minutes",
+             'create_at': i}
+            for i in range(50)
+        ]
+        messages.insert(10, {'username': 'alice', 'message': 'Кто посмотрит падение сборки?', 'create_at': 9})
+
+        collapsed = collapse_near_duplicates(messages)
+
+        self.assertEqual(len(collapsed), 2)
+        self.assertEqual(collapsed[0]['duplicate_count'], 50)
+        self.assertEqual(collapsed[0]['last_create_at'], 49)
+        self.assertEqual(collapsed[1]['username'], 'alice')
+
+    def test_distinct_messages_are_kept(self):
+        messages = [
+            {'message': 'Обсуждаем релиз в четверг'},
+            {'message': 'Нужен ревьюер для миграции базы'},
+            {'message': 'Дашборд метрик обновлен'},
+        ]
+
+        self.assertEqual(collapse_near_duplicates(messages), messages)
+
+
+if __name__ == "__main__":
+    unittest.main()
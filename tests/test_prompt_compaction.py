@@ -0,0 +1,63 @@
+import unittest
+
+from prompt_compaction import PromptCompactor
+
+
+class TestPromptCompactor(unittest.TestCase):
+    def setUp(self):
+        self.compactor = PromptCompactor(max_message_chars=50)
+
+    def test_code_blocks_and_urls_are_collapsed(self):
+        text = "Смотри https://github.com/org/repo/pull/42?x=1\n```python\nimport os\nprint(os)\n```"
+        result = self.compactor.compact_text(text)
+        self.assertEqual(result, "Смотри [github.com]\n[код python: 2 строк]")
+
+    def test_log_lines_are_collapsed(self):
+        text = "Упало:\nTraceback (most recent call last):\n  File \"a.py\", line 1, in <module>\nValueError: boom"
+        result = PromptCompactor().compact_text(text)
+        self.assertEqual(result, "Упало:\nTraceback (most recent call last): [лог: 3 строк]")
+
+    def test_inline_code_and_log_like_prose_are_kept(self):
+        self.assertEqual(self.compactor.compact_text("Запусти ```make test``` перед мержем"),
+                         "Запусти ```make test``` перед мержем")
+
+        prose = "ERROR в отчете уже поправили\nError handling обсудим завтра\nINFO для всех: релиз в пятницу"
+        self.assertEqual(PromptCompactor().compact_text(prose), prose)
+
+        logs = "Упало:\nERROR: disk full\n[WARN] retry 1\n2024-01-01 12:00 retry 2"
+        self.assertEqual(PromptCompactor().compact_text(logs), "Упало:\nERROR: disk full [лог: 3 строк]")
+
+    def test_duplicates_are_matched_before_links_and_code_are_collapsed(self):
+        messages = [{'username': f'u{i}', 'message': f'LGTM https://github.com/org/repo/pull/{i}'} for i in range(4)]
+        messages += [
+            {'username': 'a', 'message': '```python\nimport os\n```'},
+            {'username': 'b', 'message': '```python\nimport sys\n```'},
+        ]
+
+        compacted, stats = PromptCompactor().compact(messages)
+
+        self.assertEqual([m['username'] for m in compacted], ['u0', 'u1', 'u2', 'u3', 'a', 'b'])
+        self.assertEqual(stats['dropped_duplicates'], 0)
+
+    def test_duplicates_reactions_and_bots_are_dropped(self):
+        messages = [
+            {'username': 'a', 'message': 'Деплой готов'},
+            {'username': 'b', 'message': ':+1: :tada:'},
+            {'username': 'c', 'message': 'деплой   готов'},
+            {'username': 'bot', 'message': 'Отчет', 'from_bot': True},
+            {'username': 'd', 'message': 'x' * 80},
+        ]
+
+        compacted, stats = self.compactor.compact(messages)
+
+        self.assertEqual([m['username'] for m in compacted], ['a', 'd'])
+        self.assertEqual(compacted[0]['duplicate_count'], 2)
+        self.assertTrue(compacted[1]['message'].endswith('[обрезано]'))
+        self.assertEqual(stats['dropped_duplicates'], 1)
+        self.assertEqual(stats['dropped_reactions'], 1)
+        self.assertEqual(stats['dropped_bots'], 1)
+        self.assertGreater(stats['tokens_saved'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
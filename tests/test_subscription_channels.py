@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from subscription_manager import SubscriptionManager
+
+
+class TestSubscriptionChannels(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        await self.manager.create_subscription(
+            'u1', 'alice', ['general', 'random'], '09:00', 'daily', timezone='UTC',
+            resolved_channels={'general': {'id': 'id-general', 'display_name': 'General'}}
+        )
+        await self.manager.create_subscription(
+            'u2', 'bob', ['general'], '10:00', 'daily', timezone='UTC',
+            resolved_channels={'general': {'id': 'id-general', 'display_name': 'General'}}
+        )
+
+    async def test_reverse_lookup_by_channel_id_and_label(self):
+        by_id = await self.manager.get_subscriptions_by_channel('id-general')
+        self.assertEqual([(s['id'], s['username']) for s in by_id], [(2, 'bob'), (1, 'alice')])
+        self.assertEqual([s['id'] for s in await self.manager.get_subscriptions_by_channel_label('random')], [1])
+        for label in ('#random', '~Random', ' random '):
+            self.assertEqual([s['id'] for s in await self.manager.get_subscriptions_by_channel_label(label)], [1])
+
+        # Та же форма записей, что и в полном списке
+        everything = {s['id']: s for s in await self.manager.get_all_subscriptions()}
+        self.assertEqual(by_id, [everything[2], everything[1]])
+
+        await self.manager.delete_subscription('u2')
+        self.assertEqual([s['id'] for s in await self.manager.get_subscriptions_by_channel('id-general')], [1])
+
+    async def test_lookups_use_indexes(self):
+        with sqlite3.connect(self.manager.db_path) as conn:
+            for condition, index in (('channel_id = ?', 'idx_subscription_channels_channel'),
+                                     ('channel_label = ? COLLATE NOCASE', 'idx_subscription_channels_label_nocase')):
+                plan = ' '.join(row[-1] for row in conn.execute(
+                    f'EXPLAIN QUERY PLAN SELECT subscription_id FROM subscription_channels WHERE {condition}',
+                    ('x',)
+                ))
+                self.assertIn(index, plan)
+
+    async def test_migrates_channels_from_json_column(self):
+        with sqlite3.connect(self.manager.db_path) as conn:
+            conn.execute('''
+                INSERT INTO subscriptions (user_id, username, channels, schedule_time, frequency, timezone)
+                VALUES ('u3', 'carol', ?, '08:00', 'daily', 'UTC')
+            ''', (json.dumps(['dev', 'ops']),))
+
+        migrated = SubscriptionManager(self.manager.db_path)
+        self.assertEqual([s['username'] for s in await migrated.get_subscriptions_by_channel_label('ops')], ['carol'])
+
+    async def test_labels_are_normalized_on_write_and_migrated(self):
+        await self.manager.create_subscription(
+            'u3', 'carol', ['~Dev', ' #ops '], '08:00', 'daily', timezone='UTC',
+            resolved_channels={'~Dev': {'id': 'id-dev', 'display_name': 'Dev'}}
+        )
+        subscription = (await self.manager.get_scheduled_subscriptions([3]))[0]
+        self.assertEqual(subscription['channels'], ['Dev', 'ops'])
+        self.assertEqual(subscription['resolved_channels'], {'Dev': {'id': 'id-dev', 'display_name': 'Dev'}})
+
+        await self.manager.save_channel_resolutions(3, [(1, '#ops', 'id-ops', 'Ops')])
+        with sqlite3.connect(self.manager.db_path) as conn:
+            self.assertEqual(conn.execute(
+                'SELECT channel_label, channel_id FROM subscription_channels WHERE subscription_id = 3 ORDER BY position'
+            ).fetchall(), [('Dev', 'id-dev'), ('ops', 'id-ops')])
+
+            # Строки, записанные до нормализации: ~general и general у одной подписки
+            conn.execute('UPDATE subscriptions SET channels = ? WHERE id = 1',
+                         (json.dumps(['~general', 'general', '#random']),))
+            conn.execute('''
+                INSERT INTO subscription_channels (subscription_id, position, channel_label)
+                VALUES (1, 0, '~general'), (1, 2, '#random')
+            ''')
+            conn.execute("DELETE FROM subscription_channels WHERE subscription_id = 1 AND channel_label = 'random'")
+
+        migrated = SubscriptionManager(self.manager.db_path)
+        with sqlite3.connect(self.manager.db_path) as conn:
+            rows = conn.execute(
+                'SELECT channel_label, channel_id FROM subscription_channels WHERE subscription_id = 1 ORDER BY position'
+            ).fetchall()
+        self.assertEqual(rows, [('general', 'id-general'), ('random', None)])
+        subscription = (await migrated.get_scheduled_subscriptions([1]))[0]
+        self.assertEqual(subscription['channels'], ['general', 'general', 'random'])
+        self.assertEqual(subscription['resolved_channels']['general']['id'], 'id-general')
+
+    async def test_forget_and_rename_channel(self):
+        self.assertEqual(await self.manager.rename_channel('id-general', 'General chat'), 2)
+        subscription = (await self.manager.get_scheduled_subscriptions([1]))[0]
+        self.assertEqual(subscription['resolved_channels']['general']['display_name'], 'General chat')
+
+        self.assertEqual(await self.manager.forget_channel('id-general'), 2)
+        self.assertEqual((await self.manager.get_scheduled_subscriptions([1]))[0]['resolved_channels'], {})
+        self.assertEqual(await self.manager.get_subscriptions_by_channel('id-general'), [])
+        self.assertEqual(len(await self.manager.get_subscriptions_by_channel_label('general')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
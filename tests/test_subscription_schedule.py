@@ -0,0 +1,186 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from config import Config
+
+from scheduler import SCHEDULER_RETRY_DELAY, SubscriptionScheduler
+from subscription_manager import LAST_SUCCESS_QUERY, RUN_AT_FORMAT, SubscriptionManager, compute_next_run_at
+
+
+class TestComputeNextRunAt(unittest.TestCase):
+    def test_daily_today_or_tomorrow(self):
+        # 09:00 в Москве = 06:00 UTC
+        self.assertEqual(compute_next_run_at('09:00', 'daily', None, 'Europe/Moscow', datetime(2026, 5, 4, 5, 0)),
+                         datetime(2026, 5, 4, 6, 0))
+        self.assertEqual(compute_next_run_at('09:00', 'daily', None, 'Europe/Moscow', datetime(2026, 5, 4, 6, 0)),
+                         datetime(2026, 5, 5, 6, 0))
+
+    def test_weekly_weekday(self):
+        # 2026-05-04 - понедельник; ближайшая пятница - 8 мая
+        self.assertEqual(compute_next_run_at('18:00', 'weekly', 4, 'UTC', datetime(2026, 5, 4, 12, 0)),
+                         datetime(2026, 5, 8, 18, 0))
+
+    def test_dst_transitions(self):
+        # Берлин: переход на летнее время 29.03.2026 (UTC+1 → UTC+2)
+        self.assertEqual(compute_next_run_at('09:00', 'daily', None, 'Europe/Berlin', datetime(2026, 3, 28, 9, 0)),
+                         datetime(2026, 3, 29, 7, 0))
+        # 02:30 в ночь перехода не существует - запуск в 03:30 по летнему времени
+        self.assertEqual(compute_next_run_at('02:30', 'daily', None, 'Europe/Berlin', datetime(2026, 3, 28, 12, 0)),
+                         datetime(2026, 3, 29, 1, 30))
+        # 02:30 при переходе назад (25.10.2026) встречается дважды - берется первое
+        self.assertEqual(compute_next_run_at('02:30', 'daily', None, 'Europe/Berlin', datetime(2026, 10, 24, 12, 0)),
+                         datetime(2026, 10, 25, 0, 30))
+
+
+class TestDueSubscriptions(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        await self.manager.create_subscription('u1', 'alice', ['general'], '09:00', 'daily', timezone='UTC')
+        self.run_at, self.sub_id = (await self.manager.get_next_runs())[0]
+
+    async def test_due_only_after_next_run_at(self):
+        self.assertEqual(await self.manager.get_due_subscriptions(self.run_at.replace(minute=59, hour=8)), [])
+
+        due = await self.manager.get_due_subscriptions(self.run_at.replace(second=30))
+
+        self.assertEqual([sub['id'] for sub in due], [self.sub_id])
+
+    async def test_reschedule_and_missed_run_grace(self):
+        due = await self.manager.get_due_subscriptions(self.run_at)
+        await self.manager.reschedule(due[0], self.run_at)
+        self.assertEqual((await self.manager.get_next_runs([self.sub_id]))[0][0], self.run_at + timedelta(days=1))
+
+        # Запуск, просроченный больше чем на grace, пропускается и переносится
+        next_run_at = (await self.manager.get_next_runs())[0][0]
+        late = next_run_at.replace(hour=12)
+        self.assertEqual(await self.manager.get_due_subscriptions(late, missed_run_grace=3600), [])
+        self.assertGreater((await self.manager.get_next_runs())[0][0], late)
+
+    async def test_delivered_in_period_is_not_repeated(self):
+        # delivered_at пишется CURRENT_TIMESTAMP: UTC, 'YYYY-MM-DD HH:MM:SS'
+        with sqlite3.connect(self.manager.db_path) as conn:
+            conn.execute("INSERT INTO delivery_log (subscription_id, status, delivered_at) VALUES (?, 'error', ?)",
+                         (self.sub_id, (self.run_at - timedelta(hours=2)).strftime(RUN_AT_FORMAT)))
+            conn.execute("INSERT INTO delivery_log (subscription_id, status, delivered_at) VALUES (?, 'success', ?)",
+                         (self.sub_id, (self.run_at - timedelta(days=1)).strftime(RUN_AT_FORMAT)))
+        self.assertEqual(len(await self.manager.get_due_subscriptions(self.run_at)), 1)
+
+        with sqlite3.connect(self.manager.db_path) as conn:
+            conn.execute("INSERT INTO delivery_log (subscription_id, status, delivered_at) VALUES (?, 'success', ?)",
+                         (self.sub_id, (self.run_at - timedelta(hours=1)).strftime(RUN_AT_FORMAT)))
+        self.assertEqual(await self.manager.get_due_subscriptions(self.run_at), [])
+        self.assertEqual((await self.manager.get_next_runs())[0][0], self.run_at + timedelta(days=1))
+
+    async def test_last_success_query_uses_index(self):
+        with sqlite3.connect(self.manager.db_path) as conn:
+            plan = ' '.join(row[-1] for row in conn.execute(
+                'EXPLAIN QUERY PLAN ' + LAST_SUCCESS_QUERY.format(placeholders='?,?,?'), (1, 2, 3)
+            ))
+        self.assertIn('USING COVERING INDEX idx_delivery_log_success', plan)
+        self.assertNotIn('SCAN delivery_log', plan)
+
+    async def test_change_listener(self):
+        calls = []
+        self.manager.add_change_listener(lambda: calls.append(1))
+
+        await self.manager.create_subscription('u2', 'bob', ['general'], '10:00', 'daily', timezone='UTC')
+        await self.manager.delete_subscription('u2')
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(await self.manager.get_next_runs()), 1)
+
+
+class TestSchedulerLoop(unittest.IsolatedAsyncioTestCase):
+    async def test_sleeps_until_next_run_and_wakes_on_change(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        scheduler = SubscriptionScheduler(bot=None, subscription_manager=manager)
+        executed = []
+
+        async def execute(subscription, graph=None):
+            executed.append(subscription['id'])
+
+        scheduler._execute_subscription = execute
+        await scheduler.start()
+        try:
+            # Подписка появляется после старта: планировщик должен проснуться и перечитать расписание
+            await manager.create_subscription('u1', 'alice', ['general'], '09:00', 'daily', timezone='UTC')
+            with sqlite3.connect(manager.db_path) as conn:
+                soon = datetime.utcnow() + timedelta(seconds=1)
+                conn.execute('UPDATE subscriptions SET next_run_at = ?', (soon.strftime(RUN_AT_FORMAT),))
+            scheduler.wake_up()
+
+            for _ in range(40):
+                if executed:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            await scheduler.stop()
+
+        self.assertEqual(executed, [1])
+        self.assertGreater(scheduler._heap[0][0], datetime.utcnow())
+
+    async def test_wave_runs_concurrently_with_limits_and_timeouts(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        for index in range(6):
+            await manager.create_subscription(f'u{index}', f'user{index}', ['general'], '09:00', 'daily', timezone='UTC')
+        run_at = (await manager.get_next_runs())[0][0]
+
+        with patch.object(Config, 'SCHEDULER_CONCURRENCY', 3), \
+                patch.object(Config, 'SCHEDULER_SUBSCRIPTION_TIMEOUT', 0.2):
+            scheduler = SubscriptionScheduler(bot=None, subscription_manager=manager)
+            running = []
+            peak = []
+
+            async def execute(subscription, graph=None):
+                running.append(subscription['id'])
+                peak.append(len(running))
+                await asyncio.sleep(1 if subscription['id'] == 1 else 0.05)
+                running.remove(subscription['id'])
+
+            scheduler._execute_subscription = execute
+            await scheduler._check_subscriptions(run_at)
+            scheduler.extractive.shutdown()
+
+        wave = scheduler.last_wave
+        self.assertEqual(max(peak), 3)
+        self.assertEqual(wave['subscriptions'], 6)
+        self.assertEqual(wave['timeouts'], 1)
+        self.assertLess(wave['duration_seconds'], 0.6)
+        # Все подписки перенесены на следующий день, включая прерванную по таймауту
+        self.assertTrue(all(next_run > run_at for next_run, _ in await manager.get_next_runs()))
+
+    async def test_failed_due_query_backs_off_instead_of_spinning(self):
+        manager = SubscriptionManager(os.path.join(tempfile.mkdtemp(), 'subscriptions.db'))
+        await manager.create_subscription('u0', 'user0', ['general'], '09:00', 'daily', timezone='UTC')
+        await manager.create_subscription('u1', 'user1', ['random'], '09:00', 'daily', timezone='UTC')
+        scheduler = SubscriptionScheduler(bot=None, subscription_manager=manager)
+        with patch.object(Config, 'DIGEST_PRECOMPUTE_LEAD', 0):
+            await scheduler._rebuild_heap()
+        run_at = scheduler._heap[0][0]
+
+        async def broken_query(*args, **kwargs):
+            raise sqlite3.OperationalError('database is locked')
+
+        with patch.object(manager, 'get_due_subscriptions', broken_query):
+            await scheduler._fire_due(run_at)
+        retry_at = run_at + timedelta(seconds=SCHEDULER_RETRY_DELAY)
+        self.assertEqual(sorted(scheduler._heap), [(retry_at, 1), (retry_at, 2)])
+
+        # Расписание тоже не читается - сработавшие подписки не выпадают из кучи
+        with patch.object(manager, 'get_next_runs', broken_query):
+            await scheduler._fire_due(retry_at)
+        self.assertEqual(sorted(run for run, _ in scheduler._heap),
+                         [retry_at + timedelta(seconds=SCHEDULER_RETRY_DELAY)] * 2)
+        with patch('scheduler.datetime') as fake_datetime:
+            fake_datetime.utcnow.return_value = retry_at
+            self.assertEqual(scheduler._seconds_until_next_run(), SCHEDULER_RETRY_DELAY)
+        scheduler.extractive.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
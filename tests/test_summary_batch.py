@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from config import Config
+from llm_client import LLMClient
+from summary_batch import BatchSummarizer, _ChannelDaySpool, _submit_batches, parse_export_chunk
+
+
+def _export_lines():
+    posts = [
+        {'team': 't', 'channel': 'dev', 'user': 'alice', 'message': 'Релиз в пятницу?', 'create_at': 1000,
+         'replies': [{'user': 'bob', 'message': 'Да, после ревью', 'create_at': 2000}]},
+        {'team': 't', 'channel': 'dev', 'user': 'carol', 'message': 'Одиночный пост', 'create_at': 3000},
+    ]
+    lines = [json.dumps({'type': 'version', 'version': 1})]
+    lines += [json.dumps({'type': 'post', 'post': post}) for post in posts]
+    return lines
+
+
+class _FakeLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_thread_summary(self, messages):
+        self.calls += 1
+        return f"саммари из {len(messages)} сообщений"
+
+    generate_channel_summary = generate_thread_summary
+
+
+def _read_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+class TestSummaryBatch(unittest.TestCase):
+    def test_export_is_split_into_threads_and_channel_days(self):
+        threads = parse_export_chunk(_export_lines(), 'threads', min_messages=2)
+        self.assertEqual(len(threads), 1)
+        self.assertEqual([m['username'] for m in threads[0]['messages']], ['alice', 'bob'])
+
+        channels = parse_export_chunk(_export_lines(), 'channels', min_messages=2)
+        self.assertEqual(len(channels), 1)
+        self.assertEqual(channels[0]['message_count'], 3)
+
+    def test_rerun_skips_finished_items(self):
+        items = parse_export_chunk(_export_lines(), 'threads', min_messages=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'out.jsonl')
+
+            async def batches():
+                return items
+
+            first = _FakeLLM()
+            asyncio.run(BatchSummarizer(first, output).run([batches()]))
+            second = _FakeLLM()
+            summarizer = BatchSummarizer(second, output)
+            asyncio.run(summarizer.run([batches()]))
+
+            with open(output, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual(first.calls, 2)
+        self.assertEqual(second.calls, 0)
+        self.assertEqual(summarizer.skipped, 2)
+        self.assertEqual(len(records), 2)
+        self.assertTrue(all(record['summary'] for record in records))
+
+    def test_malformed_thread_file_does_not_abort_directory_run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            threads = os.path.join(tmp, 'threads')
+            os.mkdir(threads)
+            with open(os.path.join(threads, 'good.json'), 'w', encoding='utf-8') as f:
+                json.dump([{'user': 'alice', 'message': 'Вопрос', 'create_at': 1},
+                           {'user': 'bob', 'message': 'Ответ', 'create_at': 2}], f)
+            with open(os.path.join(threads, 'broken.json'), 'w', encoding='utf-8') as f:
+                f.write('{"messages": [')
+            output = os.path.join(tmp, 'out.jsonl')
+            args = argparse.Namespace(input=threads, mode='threads', min_messages=2)
+
+            async def run():
+                with ThreadPoolExecutor() as pool:
+                    summarizer = BatchSummarizer(_FakeLLM(), output)
+                    await summarizer.run(_submit_batches(asyncio.get_running_loop(), pool, args))
+                    return summarizer
+
+            summarizer = asyncio.run(run())
+            records = {record['id']: record for record in _read_records(output)}
+
+        self.assertEqual((summarizer.completed, summarizer.failed), (1, 1))
+        self.assertTrue(records['good']['summary'])
+        self.assertIsNone(records['broken']['summary'])
+        self.assertIn('JSONDecodeError', records['broken']['error'])
+
+    def test_channel_days_are_merged_through_disk_spool(self):
+        day = 86400 * 1000
+        chunks = [
+            [json.dumps({'type': 'post', 'post': {'team': 't', 'channel': 'dev', 'user': 'alice',
+                                                  'message': f'Сообщение {create_at}', 'create_at': create_at}})]
+            for create_at in (2 * day + 1, 1, day + 1, 2)
+        ]
+        spool = _ChannelDaySpool()
+        try:
+            for chunk in chunks:
+                spool.add(parse_export_chunk(chunk, 'channels', min_messages=2))
+
+            async def collect():
+                return [item for batch in spool.batches(min_messages=2, size=1) for item in await batch]
+
+            items = asyncio.run(collect())
+        finally:
+            spool.close()
+
+        self.assertFalse(os.path.exists(spool.path))
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['message_count'], 2)
+        self.assertEqual([msg['create_at'] for msg in items[0]['messages']], [1, 2])
+
+    def test_channel_day_is_compacted_whole_after_stats(self):
+        link = 'https://ci.example.com/build/1'
+        chunks = [
+            [json.dumps({'type': 'post', 'post': {'team': 't', 'channel': 'dev', 'user': user,
+                                                  'message': f'Сборка упала {link}', 'create_at': create_at}})]
+            for user, create_at in (('alice', 1), ('bob', 2), ('carol', 3))
+        ]
+        spool = _ChannelDaySpool()
+        try:
+            for chunk in chunks:
+                spool.add(parse_export_chunk(chunk, 'channels', min_messages=1))
+
+            async def collect():
+                return [item for batch in spool.batches(min_messages=2) for item in await batch]
+
+            items = asyncio.run(collect())
+        finally:
+            spool.close()
+
+        self.assertEqual(items[0]['message_count'], 3)
+        self.assertTrue(all(link in msg['message'] for msg in items[0]['messages']))
+
+        with patch.object(Config, 'PROMPT_STATS_ENABLED', True):
+            context = LLMClient()._format_channel_for_llm(items[0]['messages'])
+        self.assertIn('Канал | 3 | 3 |', context)
+        self.assertIn(f'{link} (×3)', context)
+        self.assertEqual(context.count('Сборка упала'), 1)
+        self.assertIn('(×3)', context.split('Сборка упала')[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from llm_client import LLMClient
+from usage_tracker import LLMQuotaExceeded, UsageTracker
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+class TestUsageTracker(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.tracker = UsageTracker(self.db_path, daily_quota=1000)
+
+    def tearDown(self):
+        self.tracker.close()
+        os.remove(self.db_path)
+
+    async def test_usage_is_aggregated_by_dimension(self):
+        context = {'user_id': 'u1', 'channel_id': 'c1', 'command': 'summary'}
+        self.tracker.record(context, 'm', 'http://a', _Usage(100, 20), latency=1.0)
+        self.tracker.record(context, 'm', 'http://a', _Usage(200, 30), latency=3.0)
+        self.tracker.record({'user_id': 'u2', 'subscription_id': 7, 'command': 'digest_daily'},
+                            'm', 'http://a', _Usage(10, 5), latency=0.5)
+
+        by_user = {row['key']: row for row in await self.tracker.get_usage('user_id')}
+        self.assertEqual(by_user['u1']['requests'], 2)
+        self.assertEqual(by_user['u1']['total_tokens'], 350)
+        self.assertEqual(by_user['u1']['avg_latency_ms'], 2000)
+
+        by_subscription = {row['key']: row for row in await self.tracker.get_usage('subscription_id')}
+        self.assertEqual(by_subscription['7']['total_tokens'], 15)
+
+        metrics = self.tracker.prometheus_metrics()
+        self.assertIn('llm_tokens_total{command="summary",model="m"} 350', metrics)
+
+    async def test_quota_is_enforced_before_sending(self):
+        self.tracker.record({'user_id': 'u1'}, 'm', 'http://a', _Usage(900, 100), latency=1.0)
+        client = LLMClient(usage_tracker=self.tracker)
+
+        async def fail_if_called(messages):
+            raise AssertionError("запрос не должен уходить в LLM")
+
+        client._create_completion = fail_if_called
+
+        with self.assertRaises(LLMQuotaExceeded):
+            await client._send_chat_completion([], {'user_id': 'u1'})
+        await self.tracker.check_quota('u2')
+
+    async def test_shared_request_tokens_are_reported_and_charged(self):
+        client = LLMClient(usage_tracker=self.tracker)
+        context = {'channel_id': 'c1', 'command': 'digest_daily_shared', 'spent_tokens': 0}
+
+        client._record_usage(context, type('Response', (), {'usage': _Usage(300, 50)})(), None, latency=1.0)
+        self.tracker.charge({'user_id': 'u1', 'command': 'digest_daily'}, context['spent_tokens'])
+
+        self.assertEqual(context['spent_tokens'], 350)
+        self.assertEqual(await self.tracker.tokens_used_today('u1'), 350)
+        by_command = {row['key']: row for row in await self.tracker.get_usage('command')}
+        self.assertEqual(by_command['digest_daily']['requests'], 0)
+        self.assertEqual(by_command['digest_daily_shared']['requests'], 1)
+
+    async def test_prune_keeps_daily_rollup(self):
+        self.tracker.record({'user_id': 'u1'}, 'm', 'http://a', _Usage(100, 20), latency=1.0)
+        self.tracker.record({'user_id': 'u1'}, 'm', 'http://a', _Usage(10, 5), latency=1.0)
+        await self.tracker.tokens_used_today('u1')  # дожидаемся фоновых записей
+        old = (datetime.utcnow() - timedelta(days=40)).strftime('%Y-%m-%d %H:%M:%S')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('UPDATE llm_usage SET created_at = ? WHERE id = 1', (old,))
+
+        self.assertEqual(await self.tracker.prune(30, batch_size=1), 1)
+        self.assertEqual(await self.tracker.prune(0), 0)
+
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute('SELECT id FROM llm_usage').fetchall(), [(2,)])
+        self.assertEqual(await self.tracker.tokens_used_today('u1'), 135)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Учет токенов и задержек LLM-запросов
+
+Каждый ответ chat.completions записывается в SQLite (сырые записи и дневные
+агрегаты по пользователю, каналу, подписке, команде и модели). Запись ставится
+в очередь потока базы и не задерживает ответ. Сырые записи старше срока
+хранения удаляются, дневные агрегаты остаются. Счетчики с момента запуска
+хранятся в памяти и отдаются в формате Prometheus.
+"""
+
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+# Измерения, по которым можно группировать статистику в /usage
+USAGE_DIMENSIONS = ('user_id', 'channel_id', 'subscription_id', 'command', 'model')
+
+
+class LLMQuotaExceeded(Exception):
+    """Пользователь исчерпал дневной лимит токенов"""
+
+    def __init__(self, user_id: str, used: int, quota: int):
+        super().__init__(f"Дневной лимит токенов исчерпан для {user_id}: {used}/{quota}")
+        self.user_id = user_id
+        self.used = used
+        self.quota = quota
+
+
+class UsageTracker:
+    """Хранилище статистики использования LLM"""
+
+    def __init__(self, db_path: str = "usage.db", daily_quota: int = 0):
+        self.db_path = db_path
+        self.daily_quota = daily_quota
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, Dict[str, float]] = {}
+        self.db = Database(db_path)
+        self._init_database()
+
+    def close(self):
+        """Дожидается фоновых записей и закрывает соединение"""
+        self.db.close()
+
+    def _init_database(self):
+        """Инициализация таблиц учета"""
+        try:
+            self.db.call(self._create_schema)
+            logger.info("✅ База данных учета токенов инициализирована")
+        except Exception as e:
+            logger.error(f"❌ Ошибка инициализации базы учета токенов: {e}")
+            raise
+
+    @staticmethod
+    def _create_schema(conn):
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                user_id TEXT NOT NULL DEFAULT '',
+                channel_id TEXT NOT NULL DEFAULT '',
+                subscription_id TEXT NOT NULL DEFAULT '',
+                command TEXT NOT NULL DEFAULT '',
+                model TEXT NOT NULL DEFAULT '',
+                endpoint TEXT NOT NULL DEFAULT '',
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                total_tokens INTEGER DEFAULT 0,
+                latency_ms INTEGER DEFAULT 0,
+                success BOOLEAN DEFAULT 1
+            )
+        ''')
+
+        # Пустая строка вместо NULL: в UNIQUE-ключе NULL не совпадают друг с другом
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_usage_daily (
+                day TEXT NOT NULL,
+                user_id TEXT NOT NULL DEFAULT '',
+                channel_id TEXT NOT NULL DEFAULT '',
+                subscription_id TEXT NOT NULL DEFAULT '',
+                command TEXT NOT NULL DEFAULT '',
+                model TEXT NOT NULL DEFAULT '',
+                requests INTEGER DEFAULT 0,
+                failures INTEGER DEFAULT 0,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                total_tokens INTEGER DEFAULT 0,
+                latency_ms_sum INTEGER DEFAULT 0,
+                PRIMARY KEY (day, user_id, channel_id, subscription_id, command, model)
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_llm_usage_daily_user ON llm_usage_daily (user_id, day)'
+        )
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.utcnow().strftime('%Y-%m-%d')
+
+    async def tokens_used_today(self, user_id: str) -> int:
+        """Сколько токенов пользователь израсходовал за текущие сутки (UTC)"""
+        row = await self.db.run(lambda conn: conn.execute(
+            'SELECT COALESCE(SUM(total_tokens), 0) FROM llm_usage_daily WHERE user_id = ? AND day = ?',
+            (user_id, self._today())
+        ).fetchone())
+        return int(row[0])
+
+    async def check_quota(self, user_id: Optional[str]):
+        """Бросает LLMQuotaExceeded, если дневной лимит пользователя исчерпан"""
+        if not self.daily_quota or not user_id:
+            return
+        used = await self.tokens_used_today(user_id)
+        if used >= self.daily_quota:
+            logger.warning(f"⛔ Пользователь {user_id} исчерпал дневной лимит токенов ({used}/{self.daily_quota})")
+            raise LLMQuotaExceeded(user_id, used, self.daily_quota)
+
+    @staticmethod
+    def _keys(context: Optional[Dict[str, Any]], model: str) -> Dict[str, str]:
+        context = context or {}
+        return {
+            'user_id': str(context.get('user_id') or ''),
+            'channel_id': str(context.get('channel_id') or ''),
+            'subscription_id': str(context.get('subscription_id') or ''),
+            'command': str(context.get('command') or ''),
+            'model': model or '',
+        }
+
+    def record(self, context: Optional[Dict[str, Any]], model: str, endpoint: str,
+               usage: Any, latency: float, success: bool = True) -> int:
+        """
+        Записывает один запрос к LLM
+
+        Args:
+            context: user_id, channel_id, subscription_id, command (любые поля могут отсутствовать)
+            usage: response.usage из ответа chat.completions (может быть None)
+            latency: время запроса в секундах
+
+        Returns:
+            Израсходовано токенов
+        """
+        keys = self._keys(context, model)
+        prompt_tokens = int(getattr(usage, 'prompt_tokens', 0) or 0)
+        completion_tokens = int(getattr(usage, 'completion_tokens', 0) or 0)
+        total_tokens = int(getattr(usage, 'total_tokens', 0) or 0) or prompt_tokens + completion_tokens
+        latency_ms = int(latency * 1000)
+
+        with self._lock:
+            counter = self._counters.setdefault((keys['command'], keys['model']), {
+                'requests': 0, 'failures': 0, 'prompt_tokens': 0,
+                'completion_tokens': 0, 'total_tokens': 0, 'latency_seconds': 0.0,
+            })
+            counter['requests'] += 1
+            counter['failures'] += 0 if success else 1
+            counter['prompt_tokens'] += prompt_tokens
+            counter['completion_tokens'] += completion_tokens
+            counter['total_tokens'] += total_tokens
+            counter['latency_seconds'] += latency
+
+        def write(conn):
+            conn.execute('''
+                INSERT INTO llm_usage (user_id, channel_id, subscription_id, command, model, endpoint,
+                                       prompt_tokens, completion_tokens, total_tokens, latency_ms, success)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (keys['user_id'], keys['channel_id'], keys['subscription_id'], keys['command'],
+                  keys['model'], endpoint, prompt_tokens, completion_tokens, total_tokens,
+                  latency_ms, success))
+            conn.execute('''
+                INSERT INTO llm_usage_daily (day, user_id, channel_id, subscription_id, command, model,
+                                             requests, failures, prompt_tokens, completion_tokens,
+                                             total_tokens, latency_ms_sum)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+                ON CONFLICT (day, user_id, channel_id, subscription_id, command, model) DO UPDATE SET
+                    requests = requests + 1,
+                    failures = failures + excluded.failures,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum
+            ''', (self._today(), keys['user_id'], keys['channel_id'], keys['subscription_id'],
+                  keys['command'], keys['model'], 0 if success else 1, prompt_tokens,
+                  completion_tokens, total_tokens, latency_ms))
+
+        # Запись в фоне: ошибки пишет в лог поток базы
+        self.db.submit(write)
+        return total_tokens
+
+    def charge(self, context: Dict[str, Any], total_tokens: int):
+        """
+        Относит на подписчика токены общей работы волны (частичных сводок каналов)
+
+        Сами запросы уже записаны без пользователя, поэтому здесь добавляются
+        только токены в дневной агрегат - по ним считается дневной лимит;
+        число запросов и счетчики Prometheus не меняются.
+        """
+        if total_tokens <= 0:
+            return
+        keys = self._keys(context, '')
+
+        def write(conn):
+            conn.execute('''
+                INSERT INTO llm_usage_daily (day, user_id, channel_id, subscription_id, command, model,
+                                             requests, total_tokens)
+                VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+                ON CONFLICT (day, user_id, channel_id, subscription_id, command, model) DO UPDATE SET
+                    total_tokens = total_tokens + excluded.total_tokens
+            ''', (self._today(), keys['user_id'], keys['channel_id'], keys['subscription_id'],
+                  keys['command'], keys['model'], total_tokens))
+
+        self.db.submit(write)
+
+    async def prune(self, retention_days: int, batch_size: int = 500) -> int:
+        """
+        Удаляет сырые записи старше retention_days суток
+
+        Удаление идет пачками по batch_size строк отдельными короткими
+        транзакциями. Дневные агрегаты (статистика /usage и дневной лимит) остаются.
+
+        Returns:
+            Сколько записей удалено
+        """
+        if retention_days <= 0:
+            return 0
+        cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+        def delete_batch(conn):
+            # Старые записи лежат в начале таблицы: обход по id заканчивается, как только набрана пачка
+            return conn.execute('''
+                DELETE FROM llm_usage WHERE id IN (
+                    SELECT id FROM llm_usage WHERE created_at < ? ORDER BY id LIMIT ?
+                )
+            ''', (cutoff, batch_size)).rowcount
+
+        deleted = 0
+        try:
+            while True:
+                removed = await self.db.run(delete_batch)
+                deleted += removed
+                if removed < batch_size:
+                    break
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки учета токенов: {e}")
+
+        if deleted:
+            logger.info(f"🧹 Из учета токенов удалено {deleted} записей старше {retention_days} дней")
+        return deleted
+
+    async def get_usage(self, group_by: str = 'user_id', days: int = 1) -> List[Dict[str, Any]]:
+        """Агрегаты за последние days суток, сгруппированные по одному из USAGE_DIMENSIONS"""
+        if group_by not in USAGE_DIMENSIONS:
+            raise ValueError(f"Неизвестное измерение: {group_by}")
+        since = (datetime.utcnow() - timedelta(days=max(days, 1) - 1)).strftime('%Y-%m-%d')
+
+        def query(conn):
+            cursor = conn.execute(f'''
+                SELECT {group_by} AS key,
+                       SUM(requests) AS requests,
+                       SUM(failures) AS failures,
+                       SUM(prompt_tokens) AS prompt_tokens,
+                       SUM(completion_tokens) AS completion_tokens,
+                       SUM(total_tokens) AS total_tokens,
+                       SUM(latency_ms_sum) AS latency_ms_sum
+                FROM llm_usage_daily
+                WHERE day >= ?
+                GROUP BY {group_by}
+                ORDER BY total_tokens DESC
+            ''', (since,))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        result = []
+        for item in await self.db.run(query):
+            item['avg_latency_ms'] = round(item.pop('latency_ms_sum') / item['requests']) if item['requests'] else 0
+            result.append(item)
+        return result
+
+    def prometheus_metrics(self) -> List[str]:
+        """Счетчики с момента запуска в формате Prometheus"""
+        lines = []
+        with self._lock:
+            counters = {key: dict(value) for key, value in self._counters.items()}
+
+        for (command, model), counter in sorted(counters.items()):
+            labels = f'command="{command}",model="{model}"'
+            lines.append(f"llm_requests_total{{{labels}}} {counter['requests']}")
+            lines.append(f"llm_request_failures_total{{{labels}}} {counter['failures']}")
+            lines.append(f"llm_prompt_tokens_total{{{labels}}} {counter['prompt_tokens']}")
+            lines.append(f"llm_completion_tokens_total{{{labels}}} {counter['completion_tokens']}")
+            lines.append(f"llm_tokens_total{{{labels}}} {counter['total_tokens']}")
+            lines.append(f"llm_request_latency_seconds_sum{{{labels}}} {counter['latency_seconds']:.3f}")
+        return lines
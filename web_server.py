@@ -10,9 +10,10 @@ from typing import Dict, Any, Optional
 from fastapi import FastAPI, HTTPException, Header
 from fastapi.responses import HTMLResponse, JSONResponse
 from config import Config
+from usage_tracker import USAGE_DIMENSIONS
 
-def create_app(bot) -> FastAPI:
-    """Создает FastAPI приложение с переданным ботом"""
+def create_app(bot, scheduler=None) -> FastAPI:
+    """Создает FastAPI приложение с переданным ботом (и планировщиком - для метрик рассылки)"""
     
     app = FastAPI(
         title="Mattermost Summary Bot",
@@ -30,8 +31,12 @@ def create_app(bot) -> FastAPI:
         if x_api_token != Config.WEB_API_TOKEN:
             raise HTTPException(status_code=401, detail="Invalid API token")
     
-    def _generate_subscriptions_html(subscriptions_info):
-        """Генерирует HTML для отображения подписок"""
+    # За сколько суток дашборд показывает статистику доставок
+    DASHBOARD_DELIVERY_DAYS = 7
+    
+    def _generate_subscriptions_html(subscriptions_info, deliveries=None):
+        """Генерирует HTML для отображения подписок (deliveries - агрегаты доставок по id подписки)"""
+        deliveries = deliveries or {}
         if not subscriptions_info:
             return "<div style='text-align: center; color: #666; padding: 20px;'>Нет активных подписок</div>"
         
@@ -47,6 +52,10 @@ def create_app(bot) -> FastAPI:
                 weekday_names = ['понедельникам', 'вторникам', 'средам', 'четвергам', 'пятницам', 'субботам', 'воскресеньям']
                 weekday_text = f" по {weekday_names[sub['weekday']]}"
             
+            delivery = deliveries.get(sub['id'])
+            delivery_text = (f"✅ {delivery['successes']} / ❌ {delivery['errors']}" if delivery
+                             else "доставок не было")
+            
             html_parts.append(f"""
             <div style="background: #f8f9fa; border-radius: 8px; padding: 15px; margin: 10px 0; border-left: 4px solid #28a745;">
                 <div style="font-weight: bold; color: #333; margin-bottom: 8px;">
@@ -58,6 +67,9 @@ def create_app(bot) -> FastAPI:
                 <div style="color: #666; margin-bottom: 5px;">
                     ⏰ Время: {sub['schedule_time']} ({freq_text}{weekday_text})
                 </div>
+                <div style="color: #666; margin-bottom: 5px;">
+                    📬 За {DASHBOARD_DELIVERY_DAYS} дней: {delivery_text}
+                </div>
                 <div style="color: #999; font-size: 0.9em;">
                     📅 Создано: {sub['created_at'][:10]}
                 </div>
@@ -73,8 +85,12 @@ def create_app(bot) -> FastAPI:
             status = await bot.health_check()
             
             # Получаем информацию о подписках
-            subscriptions_info = bot.subscription_manager.get_all_subscriptions()
+            subscriptions_info = await bot.subscription_manager.get_all_subscriptions()
             total_subscriptions = len(subscriptions_info)
+            # Доставки - из дневных агрегатов, сырой журнал не читается
+            delivery_stats = await bot.subscription_manager.get_delivery_stats(DASHBOARD_DELIVERY_DAYS)
+            deliveries = {item['subscription_id']: item for item in delivery_stats['subscriptions']}
+            delivery_totals = delivery_stats['totals']
             
             # Определяем статусы для отображения
             mattermost_status = "🟢 Подключен" if status.get('mattermost_connected') else "🔴 Отключен"
@@ -249,11 +265,15 @@ def create_app(bot) -> FastAPI:
                     <h3>📊 Подписки</h3>
                     <div class="status-value">{total_subscriptions} активных</div>
                 </div>
+                <div class="status-card">
+                    <h3>📬 Доставки за {DASHBOARD_DELIVERY_DAYS} дней</h3>
+                    <div class="status-value">✅ {delivery_totals['successes']} / ❌ {delivery_totals['errors']}</div>
+                </div>
             </div>
             
             <div class="instructions">
                 <h3>📊 Активные подписки</h3>
-                {_generate_subscriptions_html(subscriptions_info)}
+                {_generate_subscriptions_html(subscriptions_info, deliveries)}
             </div>
             
             <div class="instructions">
@@ -308,6 +328,12 @@ def create_app(bot) -> FastAPI:
                     <a href="/subscriptions" class="api-link">
                         📊 Подписки (JSON)
                     </a>
+                    <a href="/deliveries" class="api-link">
+                        📬 Доставки (JSON)
+                    </a>
+                    <a href="/usage" class="api-link">
+                        🔢 Токены LLM (JSON)
+                    </a>
                     <a href="/docs" class="api-link">
                         📚 API Документация
                     </a>
@@ -395,7 +421,8 @@ def create_app(bot) -> FastAPI:
                         "websocket": status.get('websocket_connected', False)
                     },
                     "llm": {
-                        "connected": status.get('llm_connected', False)
+                        "connected": status.get('llm_connected', False),
+                        "health": status.get('llm_health')
                     }
                 },
                 "overall_status": "healthy" if all([
@@ -440,11 +467,17 @@ def create_app(bot) -> FastAPI:
             raise HTTPException(status_code=500, detail=str(e))
     
     @app.get("/subscriptions")
-    async def subscriptions(x_api_token: Optional[str] = Header(default=None)):
-        """Получение информации о подписках"""
+    async def subscriptions(channel_id: Optional[str] = None, channel: Optional[str] = None,
+                            x_api_token: Optional[str] = Header(default=None)):
+        """Получение информации о подписках (channel_id / channel - только включающие канал)"""
         try:
             _verify_api_token(x_api_token)
-            all_subscriptions = bot.subscription_manager.get_all_subscriptions()
+            if channel_id:
+                all_subscriptions = await bot.subscription_manager.get_subscriptions_by_channel(channel_id)
+            elif channel:
+                all_subscriptions = await bot.subscription_manager.get_subscriptions_by_channel_label(channel)
+            else:
+                all_subscriptions = await bot.subscription_manager.get_all_subscriptions()
             
             return {
                 "total_subscriptions": len(all_subscriptions),
@@ -454,6 +487,40 @@ def create_app(bot) -> FastAPI:
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     
+    @app.get("/deliveries")
+    async def deliveries(days: int = 7, subscription_id: Optional[int] = None,
+                         x_api_token: Optional[str] = Header(default=None)):
+        """Доставки сводок за последние дни по дневным агрегатам (всего и по подпискам)"""
+        _verify_api_token(x_api_token)
+        try:
+            return {
+                **await bot.subscription_manager.get_delivery_stats(days, subscription_id),
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    @app.get("/usage")
+    async def usage(group_by: str = 'user_id', days: int = 1,
+                    x_api_token: Optional[str] = Header(default=None)):
+        """Расход токенов LLM по пользователям, каналам, подпискам, командам или моделям"""
+        _verify_api_token(x_api_token)
+        if group_by not in USAGE_DIMENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"group_by должен быть одним из: {', '.join(USAGE_DIMENSIONS)}"
+            )
+        try:
+            return {
+                "group_by": group_by,
+                "days": days,
+                "daily_quota": bot.usage_tracker.daily_quota,
+                "usage": await bot.usage_tracker.get_usage(group_by, days),
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
     @app.get("/metrics")
     async def metrics(x_api_token: Optional[str] = Header(default=None)):
         """Метрики для мониторинга"""
@@ -462,7 +529,8 @@ def create_app(bot) -> FastAPI:
             status = await bot.health_check()
             
             # Получаем информацию о подписках
-            subscriptions_count = len(bot.subscription_manager.get_all_subscriptions())
+            subscriptions_count = len(await bot.subscription_manager.get_all_subscriptions())
+            delivery_totals = (await bot.subscription_manager.get_delivery_stats(1))['totals']
             
             # Простые метрики в формате, совместимом с Prometheus
             metrics = []
@@ -470,7 +538,25 @@ def create_app(bot) -> FastAPI:
             metrics.append(f"mattermost_connected {1 if status.get('mattermost_connected') else 0}")
             metrics.append(f"websocket_connected {1 if status.get('websocket_connected') else 0}")
             metrics.append(f"llm_connected {1 if status.get('llm_connected') else 0}")
+            llm_health = status.get('llm_health') or {}
+            metrics.append(f"llm_error_rate {llm_health.get('error_rate', 0)}")
+            if llm_health.get('ewma_latency') is not None:
+                metrics.append(f"llm_latency_ewma_seconds {llm_health['ewma_latency']}")
+            for base_url, pool_stats in bot.llm_client.transport_stats().items():
+                metrics.append(f'llm_http_connections{{base_url="{base_url}",state="active"}} {pool_stats["active"]}')
+                metrics.append(f'llm_http_connections{{base_url="{base_url}",state="idle"}} {pool_stats["idle"]}')
             metrics.append(f"total_subscriptions {subscriptions_count}")
+            metrics.append(f'subscription_deliveries_today{{status="success"}} {delivery_totals["successes"]}')
+            metrics.append(f'subscription_deliveries_today{{status="error"}} {delivery_totals["errors"]}')
+            last_wave = scheduler.last_wave if scheduler else None
+            if last_wave:
+                metrics.append(f"scheduler_wave_subscriptions {last_wave['subscriptions']}")
+                metrics.append(f"scheduler_wave_duration_seconds {last_wave['duration_seconds']}")
+                metrics.append(f'scheduler_wave_lateness_seconds{{quantile="0.5"}} {last_wave["lateness_p50_seconds"]}')
+                metrics.append(f'scheduler_wave_lateness_seconds{{quantile="1"}} {last_wave["lateness_max_seconds"]}')
+                metrics.append(f"scheduler_wave_timeouts {last_wave['timeouts']}")
+                metrics.append(f"scheduler_wave_errors {last_wave['errors']}")
+            metrics.extend(bot.usage_tracker.prometheus_metrics())
             
             return "\n".join(metrics)
         except Exception as e: